@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Startup check of the G-pka entry point.
+
+The top level imports of G-pka.py are imported in a fresh interpreter,
+several times. The check fails (exit code 1) if the fastest cold import
+takes longer than the budget, or if a module which must only be loaded by
+the feature using it (matplotlib, xlwt, ...) has been imported.
+
+    python check_startup.py [--budget SECONDS] [--repeat N]
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+import argparse
+import ast
+import os
+import subprocess
+import sys
+import time
+
+_entry_script = 'G-pka.py'
+_default_budget = 1.0       # in s
+
+# Modules loaded only when the feature needs them
+_lazy_modules = ('matplotlib', 'xlwt', 'scipy.interpolate', 'multiprocessing', 'pka_cache', 'pka_library')
+
+
+# Top level import statements of the entry script
+def entry_imports(script=_entry_script):
+    with open(script, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), script)
+    return [ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+
+
+# Time of one cold import in a fresh interpreter
+# @return (seconds, lazy modules which have been loaded)
+def cold_import(imports, directory):
+    code = '\n'.join(imports + ['import sys',
+                                'print(",".join(m for m in {!r} if m in sys.modules))'.format(_lazy_modules)])
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], cwd=directory, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True)
+    elapsed = time.perf_counter() - start
+    return elapsed, [m for m in result.stdout.strip().split(',') if m]
+
+
+def check_startup(budget=_default_budget, repeat=5, file_object=sys.stdout):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    imports = entry_imports(os.path.join(directory, _entry_script))
+    times = []
+    loaded = set()
+    for i in range(repeat):
+        elapsed, modules = cold_import(imports, directory)
+        times.append(elapsed)
+        loaded.update(modules)
+
+    ok = min(times) <= budget and not loaded
+    print("Cold import of {}: {:.3f} s (budget {:.3f} s, best of {})".format(_entry_script, min(times), budget,
+          repeat), file=file_object)
+    if loaded:
+        print("Modules which should be loaded lazily: {}".format(', '.join(sorted(loaded))), file=file_object)
+    print("Startup check {}".format('PASSED' if ok else 'FAILED'), file=file_object)
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cold import time budget of the G-pka entry point.')
+    parser.add_argument('--budget', type=float, default=_default_budget, help='in s')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+    sys.exit(0 if check_startup(args.budget, args.repeat) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+Shared pytest fixtures: the example pka file and flux file, and input files written into the test directory.
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+import io
+import json
+import os
+
+import pytest
+
+_test_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test')
+
+
+@pytest.fixture
+def pka_filename():
+    return os.path.join(_test_dir, 'example_data', 'Ag107s-a.asc')
+
+
+@pytest.fixture
+def flux_filename():
+    return os.path.join(_test_dir, 'fluxes_specter.dat')
+
+
+# Write an input file of two parent nuclides read from the example pka file, options replace the defaults
+# @return function(**options) -> input file name
+@pytest.fixture
+def write_input(tmp_path, pka_filename, flux_filename):
+    def write(**options):
+        data = {'flux_filename': flux_filename,
+                'number_pka_files': 2,
+                'material': {'density': 10.49, 'atomic_mass': 107.87},
+                'columns': [{'pka_filename': pka_filename, 'pka_ratios': 0.6, 'parent': 'Ag-107',
+                             'ngamma_parent_mass': 106.905, 'ngamma_daughter_mass': 107.906},
+                            {'pka_filename': pka_filename, 'pka_ratios': 0.4, 'parent': 'Ag-109',
+                             'ngamma_parent_mass': 108.905, 'ngamma_daughter_mass': 109.906}],
+                'flux_rescale_value': 3.25e+14,
+                'do_gamma_estimate': True,
+                'plot_figure': False,
+                'output_format': ['npz']}
+        data.update(options)
+        filename = str(tmp_path / 'input_{}.json'.format(len(list(tmp_path.glob('input_*.json')))))
+        with open(filename, 'w') as f:
+            json.dump(data, f)
+        return filename
+    return write
+
+
+# PKAEngine of an input file, with the flux read and the output not printed
+@pytest.fixture
+def make_engine(write_input):
+    from pka_engine import PKAEngine
+
+    def make(**options):
+        engine = PKAEngine(write_input(**options), file_object=io.StringIO())
+        engine.read_flux()
+        return engine
+    return make
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+Displacement energy and damage model sweep.
+
+The damage energy of each channel (damage function coefficients) and its
+pka spectrum do not depend on Ed or on the damage model. From the collapsed
+parent nuclides, the dpa of all nuclides and elements are computed for a
+list of damage models and a vector of Ed values at once, by broadcasting:
+
+    dpa (models, eds, rows, [spectra,] groups)
+
+Damage models are in models.damage_models: 'nrt_linear' (0.8 T / 2 Ed, the
+dpa of the normal run), 'nrt' and 'arc' (with parameters b and c). Ed values
+are one vector for all target elements, or one vector for each target
+element (the other elements keep their default Ed):
+
+    python damage_sweep.py [input.json] --ed 20 40 60 --models nrt_linear nrt arc:b=-0.568,c=0.286
+    python damage_sweep.py [input.json] --ed-file ed.json     # {"Fe": [30, 40, 50], "Cr": [28, 40, 52]}
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+import argparse
+import inspect
+import json
+import sys
+
+import numpy as np
+
+from models import damage_models, find_damage_displacement_energy
+from nuclide import element_z
+from utility_pka import channel_masks, get_damage_coeffs_array
+
+
+# Damage model of 'name' or 'name:key=value,...' (or a (name, {key: value}) pair)
+# @return (name, parameters)
+def parse_damage_model(spec):
+    if type(spec) in (list, tuple):
+        name, parameters = spec[0], dict(spec[1])
+    else:
+        name, _, text = spec.partition(':')
+        parameters = dict((key.strip(), float(value)) for key, value in
+                          (item.split('=') for item in text.split(',') if item.strip()))
+    if name not in damage_models:
+        raise ValueError("Unknown damage model '{}', use one of {}".format(name, list(damage_models)))
+    # Model parameters are the arguments after (damage_energy, ed)
+    arguments = list(inspect.signature(damage_models[name]).parameters.values())[2:]
+    missing = [a.name for a in arguments if a.default is inspect.Parameter.empty and a.name not in parameters]
+    if missing:
+        raise ValueError("Damage model '{}' needs the parameters {}, e.g. '{}:{}'".format(
+                         name, missing, name, ','.join('{}=...'.format(key) for key in missing)))
+    unknown = set(parameters) - set(a.name for a in arguments)
+    if unknown:
+        raise ValueError("Unknown parameters {} of damage model '{}'".format(sorted(unknown), name))
+    return name, parameters
+
+
+# Check the Ed values of damage_sweep(), the keys of a per-element dict become Z
+# ed_values: None (default Ed of each element), array for all elements, or {element symbol, Z or 'Z': array}
+# @return (ed_values, num_eds)
+def parse_ed_values(ed_values):
+    if ed_values is None:
+        return None, 1
+    if not isinstance(ed_values, dict):
+        ed_values = np.asarray(ed_values, dtype=float).reshape(-1)
+        if ed_values.shape[0] == 0:
+            raise ValueError("Ed values are empty")
+        return ed_values, ed_values.shape[0]
+
+    parsed = {}
+    for key, values in ed_values.items():
+        if type(key) is int or (isinstance(key, str) and key.strip().isdigit()):
+            z = int(key)
+        else:
+            try:
+                z = element_z(key)
+            except (KeyError, AttributeError):
+                raise ValueError("Unknown element '{}' of Ed values, use an element symbol or Z".format(key))
+        values = np.asarray(values, dtype=float).reshape(-1)
+        if values.shape[0] == 0:
+            raise ValueError("Ed values of element '{}' are empty".format(key))
+        parsed[z] = values
+    if not parsed:
+        raise ValueError("Ed values are empty")
+    num_eds = next(iter(parsed.values())).shape[0]
+    if any(values.shape[0] != num_eds for values in parsed.values()):
+        raise ValueError("Ed vectors of all elements must have the same size")
+    return parsed, num_eds
+
+
+# Ed values (in eV) of the target element z, SIZE (eds)
+# ed_values: as returned by parse_ed_values()
+def target_ed_values(z, ed_values, num_eds):
+    if ed_values is None:
+        return np.full(num_eds, float(find_damage_displacement_energy(z)))
+    if isinstance(ed_values, dict):
+        if z in ed_values:
+            return ed_values[z]
+        return np.full(num_eds, float(find_damage_displacement_energy(z)))
+    return ed_values
+
+
+# dpa of all nuclides and elements for each damage model and Ed value, from collapsed parent nuclides
+# (their recoil pka spectra, see PKAEngine.collapse), with the same channels as the total results
+#   ratios: {parent nuclide name: ratio}, the 'pka_ratios' of input if None
+# @return {'models', 'parents', 'parent_ed' (parents, eds),
+#          '<nuclide|element>_names', '<nuclide|element>_dpa' (models, eds, rows, [spectra,] groups),
+#          '<nuclide|element>_total_dpa' (models, eds, rows, [spectra])}
+def damage_sweep(nuclides, ed_values=None, models=('nrt_linear',), ratios=None):
+    models = [parse_damage_model(model) for model in models]
+    ed_values, num_eds = parse_ed_values(ed_values)
+
+    # Rows in the same order as the global nuclides and elements
+    rows = {'nuclide': {}, 'element': {}}
+    seen_nuclides, seen_elements = set(), set()
+    masks = []
+    for nuc in nuclides:
+        to_nuclide, to_element = channel_masks(nuc, seen_nuclides, seen_elements)
+        masks.append((to_nuclide, to_element))
+        for k, recoil in enumerate(nuc.recoil_nuclides):
+            if to_nuclide[k]:
+                rows['nuclide'].setdefault(recoil.name, len(rows['nuclide']))
+            if to_element[k]:
+                rows['element'].setdefault(recoil.element, len(rows['element']))
+
+    spectrum_shape = nuclides[0].recoil_pka_spectra.shape[1:] if nuclides else (0,)
+    dpa = {kind: np.zeros((len(models), num_eds, len(rows[kind])) + spectrum_shape) for kind in rows}
+    parent_ed = np.zeros((len(nuclides), num_eds))
+
+    for p, (nuc, (to_nuclide, to_element)) in enumerate(zip(nuclides, masks)):
+        ratio = nuc.ratio if ratios is None else ratios.get(nuc.name, 0.)
+        ed = target_ed_values(nuc.Z, ed_values, num_eds)
+        parent_ed[p] = ed
+
+        # Damage energy (in eV) of each channel and group, SIZE (channels, groups)
+        damage_energy = np.stack([get_damage_coeffs_array(nuc.recoil_energy_group_struc, (recoil.Z, recoil.A),
+                                                          (nuc.Z, nuc.A))[0] for recoil in nuc.recoil_nuclides])
+        # Displacements per pka, SIZE (models, eds, channels, groups)
+        displacements = np.stack([damage_models[name](damage_energy[None], ed[:, None, None], **parameters)
+                                  for name, parameters in models])
+        if len(spectrum_shape) == 2:
+            displacements = displacements[:, :, :, None, :]
+        values = displacements * nuc.recoil_pka_spectra * ratio
+
+        for kind, mask, key in (('nuclide', to_nuclide, 'name'), ('element', to_element, 'element')):
+            indices = np.array([rows[kind][getattr(recoil, key)] for k, recoil in enumerate(nuc.recoil_nuclides)
+                                if mask[k]], dtype=int)
+            if indices.shape[0]:
+                # (rows x channels) 0/1 matrix, several channels may go into the same row
+                weights = np.zeros((len(rows[kind]), indices.shape[0]))
+                weights[indices, np.arange(indices.shape[0])] = 1.
+                dpa[kind] += np.moveaxis(np.tensordot(values[:, :, mask], weights, axes=([2], [1])), -1, 2)
+
+    result = {'models': np.array([model[0] for model in models], dtype=str),
+              'parents': np.array([nuc.name for nuc in nuclides], dtype=str),
+              'parent_ed': parent_ed}
+    for kind in rows:
+        result[kind + '_names'] = np.array(list(rows[kind]), dtype=str)
+        result[kind + '_dpa'] = dpa[kind]
+        result[kind + '_total_dpa'] = np.sum(dpa[kind], axis=-1)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='dpa for several damage models and displacement energies.')
+    parser.add_argument('input', nargs='?', default='input.json')
+    parser.add_argument('--ed', type=float, nargs='+', default=None, help='Ed values (eV) of all elements')
+    parser.add_argument('--ed-file', default=None, help='json file, {element: [Ed values]}')
+    parser.add_argument('--models', nargs='+', default=['nrt_linear'],
+                        help="damage models, 'name' or 'name:key=value,...', of {}".format(list(damage_models)))
+    parser.add_argument('--output', default='Total_PKAs_damage.npz')
+    args = parser.parse_args(argv)
+
+    # Bad model names or parameters and bad Ed values are reported before any pka file is read
+    models = [parse_damage_model(model) for model in args.models]
+    ed_values = args.ed
+    if args.ed_file is not None:
+        with open(args.ed_file) as f:
+            ed_values = json.load(f)
+    ed_values = parse_ed_values(ed_values)[0]
+
+    from pka_engine import PKAEngine, projectile_flux
+    engine = PKAEngine(args.input)
+    engine.inp.streaming = False
+    engine.read_flux()
+    nuclides = engine.load_nuclides()
+    inp = engine.inp
+    for nuc in nuclides:
+        engine.collapse(nuc, *projectile_flux(nuc, (inp.flux_spectrum, inp.flux_unit, inp.flux_energy_group),
+                                              inp.projectile_flux_spectra))
+    result = damage_sweep(nuclides, ed_values, models)
+    np.savez_compressed(args.output, energy_group=nuclides[0].recoil_energy_group_struc, **result)
+    print("\n>>> DPA OF {} MODELS x {} ED VALUES WRITTEN INTO [{}]".format(
+          len(args.models), result['parent_ed'].shape[1], args.output), file=sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
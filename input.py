@@ -7,6 +7,7 @@ Class definition for input file.
 
 """
 
+import os
 import sys
 import json
 import numpy as np
@@ -24,7 +25,10 @@ class Input:
         self.flux_unit = None   # 0 is n s^-1^, 1 is n s^-1^ MeV^-1^
         self.num_flux_energy_group = 0
         self.flux_energy_group = None
-        self.flux_spectrum = None
+        self.flux_spectrum = None               # np.array - SIZE (num_flux_energy_group), or
+                                                #            SIZE (num_flux_spectra, num_flux_energy_group)
+        self.num_flux_spectra = 1
+        self.flux_names = []
 
         self.do_gamma_estimate = False
         self.do_damage = True
@@ -34,14 +38,49 @@ class Input:
         self.do_write_total_elements = False    # Write total elements into one xls file
 
         self.plot_figure = False                # Plot figure of total nuclides and elements
+        self.output_format = ['xls']            # Result backends: 'xls' and/or 'npz'
+        self.stream_output = []                 # Streaming result files: 'csv' and/or 'jsonl'
+        self.stream_output_gzip = False         # Compress the streaming result files by gzip
 
         self.density = 0.       # Optional
         self.atomic_mass = 0.   # Optional
 
+        self.pka_cache_dir = None           # Binary cache of parsed pka files, not used if None
+        self.pka_cache_max_size = 2048.     # Cache size limit, in MB
+        self.pka_cache_hash = False         # Check the pka file content hash besides size and mtime
+        self.pka_library = None             # Memory-mapped pka library, replaces 'pka_filename' if given
+
+        self.lazy_load = False              # Read only the section index of pka files, matrices are read when used
+        self.mt_include = None              # MT numbers or [low, high] ranges of the channels to be used
+        self.mt_exclude = None              # MT numbers or [low, high] ranges of the channels to be skipped
+        self.particle_include = None        # Particle types of the channels to be used, e.g. ['recoil', 'alpha']
+        self.particle_exclude = None        # Particle types of the channels to be skipped
+
+        self.num_processes = 1              # Number of processes to read pka files
+        self.streaming = False              # Read, collapse and aggregate one pka file at a time
+        self.memory_budget = None           # Size limit (MB) of the pka files in flight in streaming mode
+
+        self.flux_rebin_method = 'interpolate'  # Flux into pka energy group: 'interpolate' or 'conservative'
+
+        self.mesh_filename = None           # Mesh flux file (cells x groups), .npy or text, mesh mode if given
+        self.mesh_energy_group = None       # Energy group of the mesh flux, that of 'flux_filename' if None
+        self.mesh_flux_unit = 'n s^{-1}'    # Unit of the mesh flux, 'n s^{-1}' or 'n s^{-1} MeV^{-1}' (per cm^2)
+        self.mesh_flux_factor = 1.0         # Factor of the mesh flux, e.g. the source strength
+        self.mesh_chunk_size = 256          # Number of cells evaluated at once
+        self.mesh_output = 'Total_PKAs_mesh'    # Directory of the per cell result arrays
+        self.mesh_groups = False            # Also write the total pka spectrum of each cell
+        self.result_store = None            # Directory of the disk-resident (case, product, group) results
+        self.result_store_chunk = 64        # Number of cases aggregated at once into the result store
+
+        # Mixed-field: {projectile: {'flux_filename': ..., 'flux_rescale_value': ...}}, flux of the pka files
+        # whose 'projectile' is given, the other pka files use 'flux_filename'
+        self.projectile_fluxes = None
+        self.projectile_flux_spectra = None     # {projectile: (flux_spectrum, flux_unit, flux_energy_group)}
+
     def read_infile(self, file_object=sys.stdout):
         with open(self.infile_name) as f:
             print(">>> START READ INPUT FILE [{}]".format(self.infile_name), file=file_object)
-            data = json.load(f, encoding="utf-8")
+            data = json.load(f)
 
             # Read necessary parameters
             try:
@@ -64,54 +103,165 @@ class Input:
             self.do_write_total_nuclides = data.get('do_write_total_nuclides', False)
             self.do_write_total_elements = data.get('do_write_total_elements', False)
             self.plot_figure = data.get('plot_figure', False)
+            self.output_format = data.get('output_format', ['xls'])
+            if type(self.output_format) is str:
+                self.output_format = [self.output_format]
+            self.stream_output = data.get('stream_output', [])
+            if type(self.stream_output) is str:
+                self.stream_output = [self.stream_output]
+            self.stream_output_gzip = data.get('stream_output_gzip', False)
 
             self.density = data.get('material', {}).get('density', 0.)
             self.atomic_mass = data.get('material', {}).get('atomic_mass', 0.)
 
+            self.pka_cache_dir = data.get('pka_cache_dir', None)
+            self.pka_cache_max_size = data.get('pka_cache_max_size', 2048.)
+            self.pka_cache_hash = data.get('pka_cache_hash', False)
+            self.pka_library = data.get('pka_library', None)
+
+            self.lazy_load = data.get('lazy_load', False)
+            if self.lazy_load and self.pka_cache_dir is not None:
+                # Cache entries are binary, only the selected matrices are read, there is no text to defer
+                print("    WARNING: 'lazy_load' is not used with 'pka_cache_dir', the selected sections are read "
+                      "from the cache entries", file=file_object)
+            self.mt_include = data.get('mt_include', None)
+            self.mt_exclude = data.get('mt_exclude', None)
+            self.particle_include = data.get('particle_include', None)
+            self.particle_exclude = data.get('particle_exclude', None)
+
+            self.num_processes = data.get('num_processes', 1)
+            self.streaming = data.get('streaming', False)
+            self.memory_budget = data.get('memory_budget', None)
+
+            self.flux_rebin_method = data.get('flux_rebin_method', 'interpolate')
+
+            self.mesh_filename = data.get('mesh_filename', None)
+            self.mesh_energy_group = data.get('mesh_energy_group', None)
+            self.mesh_flux_unit = data.get('mesh_flux_unit', 'n s^{-1}')
+            self.mesh_flux_factor = data.get('mesh_flux_factor', 1.0)
+            self.mesh_chunk_size = data.get('mesh_chunk_size', 256)
+            self.mesh_output = data.get('mesh_output', 'Total_PKAs_mesh')
+            self.mesh_groups = data.get('mesh_groups', False)
+            self.result_store = data.get('result_store', None)
+            self.result_store_chunk = data.get('result_store_chunk', 64)
+            self.projectile_fluxes = data.get('projectile_fluxes', None)
+
             print("--- FINISH READING INPUT FILE [{}]\n".format(self.infile_name), file=file_object)
 
+    # Flux files of input: one file, a list of files or all files in a directory
+    def flux_filenames(self, infile_flux_name=None):
+        if infile_flux_name is None:
+            infile_flux_name = self.infile_flux_name
+        if type(infile_flux_name) in [list, tuple]:
+            return list(infile_flux_name)
+        if os.path.isdir(infile_flux_name):
+            return sorted(os.path.join(infile_flux_name, name) for name in os.listdir(infile_flux_name)
+                          if os.path.isfile(os.path.join(infile_flux_name, name)))
+        return [infile_flux_name]
+
+    # Read the flux spectra. With more than one spectrum (list or directory of flux files, or a
+    # multi-column flux file), flux_spectrum is an array of shape (num_flux_spectra, num_flux_energy_group)
+    # In a mixed-field input, the fluxes of 'projectile_fluxes' are read into projectile_flux_spectra
     def read_flux(self, file_object=sys.stdout):
         if self.infile_flux_name is None:
             print("No input flux file!")
-        with open(self.infile_flux_name) as flux_file:
-            print(">>> START READ FLUX INPUT FILE [{}]".format(self.infile_flux_name), file=file_object)
-            flux_file.readline()
-            line = flux_file.readline()  # 跳过标题行和第二行
-            line = line.strip().split()
-            if int(line[2]) == 2:
-                self.flux_unit = 'n s^{-1}'
+        self.flux_spectrum, self.flux_unit, self.flux_energy_group, self.flux_names = \
+            self._read_flux_files(self.infile_flux_name, self.flux_rescale_value, file_object)
+        self.num_flux_energy_group = self.flux_energy_group.shape[0] - 1
+        self.num_flux_spectra = len(self.flux_names)
+
+        self.projectile_flux_spectra = None
+        if self.projectile_fluxes:
+            self.projectile_flux_spectra = {}
+            for projectile, flux_info in self.projectile_fluxes.items():
+                print(">>> PROJECTILE [{}]".format(projectile), file=file_object)
+                flux_spectrum, flux_unit, flux_energy_group, flux_names = self._read_flux_files(
+                    flux_info['flux_filename'], flux_info.get('flux_rescale_value', self.flux_rescale_value),
+                    file_object)
+                assert (len(flux_names) == self.num_flux_spectra), \
+                    "Flux of projectile '{}' must have {} spectra, as 'flux_filename'!".format(
+                        projectile, self.num_flux_spectra)
+                self.projectile_flux_spectra[projectile] = (flux_spectrum, flux_unit, flux_energy_group)
+
+    # @return (flux_spectrum, flux_unit, flux_energy_group, flux_names) of the flux files
+    def _read_flux_files(self, infile_flux_name, flux_rescale_value, file_object):
+        spectra = []
+        flux_names = []
+        flux_energy_group = None
+        for flux_name in self.flux_filenames(infile_flux_name):
+            print(">>> START READ FLUX INPUT FILE [{}]".format(flux_name), file=file_object)
+            flux_unit, file_energy_group, flux_spectra = read_specter_flux_file(flux_name)
+            if flux_energy_group is None:
+                flux_energy_group = file_energy_group
+            assert (np.array_equal(flux_energy_group, file_energy_group)), \
+                "Flux file {} is not in the same energy group as others!".format(flux_name)
+
+            # Change unit into 'n s^{-1}'
+            if flux_unit == 'n s^{-1} MeV^{-1}':
+                flux_spectra *= (flux_energy_group[1:] - flux_energy_group[:-1])
+            spectra.append(flux_spectra)
+            if flux_spectra.shape[0] == 1:
+                flux_names.append(flux_name)
             else:
-                self.flux_unit = 'n s^{-1} MeV^{-1}'
-            line = flux_file.readline()
-            line = line.strip().split()
-            group = self.num_flux_energy_group = int(line[0])
-            self.flux_spectrum = np.zeros(group)
-            self.flux_energy_group = np.zeros(group + 1)
-            for i in range(group + 1):
-                line = flux_file.readline()
-                self.flux_energy_group[i] = float(line.strip())
-            for i in range(group):
-                line = flux_file.readline()
-                self.flux_spectrum[i] = float(line.strip())
+                flux_names.extend('{}:{}'.format(flux_name, k + 1) for k in range(flux_spectra.shape[0]))
+
+        flux_spectrum = np.concatenate(spectra)
+        if flux_spectrum.shape[0] == 1:
+            flux_spectrum = flux_spectrum[0]
 
         # ------ Rescale the flux spectrum ------
-        if self.flux_unit == 'n s^{-1} MeV^{-1}':
-            # Change unit into 'n s^{-1}'
-            self.flux_spectrum *= (self.flux_energy_group[1:] - self.flux_energy_group[:-1])
+        flux_spectrum, flux_unit = normalize_flux_spectrum(flux_spectrum, 'n s^{-1}', flux_energy_group,
+                                                           flux_rescale_value)
+
+        # ------ Output flux information ------
+        print("\tFlux group number  : {}".format(flux_energy_group.shape[0] - 1), file=file_object)
+        print("\tFlux spectra number: {}".format(len(flux_names)), file=file_object)
+        print("\tTotal flux         : {0:.3e} {1}".format(flux_rescale_value, flux_unit), file=file_object)
+        return flux_spectrum, flux_unit, flux_energy_group, flux_names
+
+
+# Normalize a flux spectrum to the total flux flux_rescale_value, in unit 'n s^{-1} MeV^{-1}' and barn^{-1}
+#   flux_spectrum: np.array - SIZE (groups) or (spectra, groups), in unit 'n s^{-1}' or 'n s^{-1} MeV^{-1}'
+#   flux_rescale_value: total flux of each spectrum, the totals are kept if None (absolute fluxes)
+# @return (flux_spectrum, flux_unit) - a new array, as Input.flux_spectrum after read_flux()
+def normalize_flux_spectrum(flux_spectrum, flux_unit, flux_energy_group, flux_rescale_value):
+    flux_spectrum = np.array(flux_spectrum, dtype=float)
+    group_width = flux_energy_group[1:] - flux_energy_group[:-1]
+    # Change unit into 'n s^{-1}'
+    if flux_unit == 'n s^{-1} MeV^{-1}':
+        flux_spectrum *= group_width
+    if flux_rescale_value is not None:
         # Make sure the normalization
-        total_flux = self.flux_spectrum.sum()
-        self.flux_spectrum /= total_flux
+        total_flux = flux_spectrum.sum(axis=-1, keepdims=True)
+        flux_spectrum /= total_flux
         # Rescale
-        self.flux_spectrum *= self.flux_rescale_value
-        # Make sure the flux spectrum unit is 'n s^{-1} MeV^{-1}'
-        self.flux_spectrum /= (self.flux_energy_group[1:] - self.flux_energy_group[:-1])
-        self.flux_unit = 'n s^{-1} MeV^{-1}'
-        # *** Change flux from cm^{-2} into barn^{-1} ***
-        self.flux_spectrum *= 1.e-24
+        flux_spectrum *= flux_rescale_value
+    # Make sure the flux spectrum unit is 'n s^{-1} MeV^{-1}'
+    flux_spectrum /= group_width
+    # *** Change flux from cm^{-2} into barn^{-1} ***
+    flux_spectrum *= 1.e-24
+    return flux_spectrum, 'n s^{-1} MeV^{-1}'
 
-        # ------ Output flux information ------
-        print("\tFlux group number  : {}".format(self.num_flux_energy_group), file=file_object)
-        print("\tTotal flux         : {0:.3e} {1}".format(self.flux_rescale_value, self.flux_unit), file=file_object)
+
+# Read flux file in SPECTER format, the spectrum lines could have more than one column (one per spectrum)
+# @return (flux_unit, flux_energy_group, flux_spectra) - flux_spectra in shape (columns, groups)
+def read_specter_flux_file(filename):
+    with open(filename) as flux_file:
+        flux_file.readline()
+        line = flux_file.readline()  # 跳过标题行和第二行
+        line = line.strip().split()
+        if int(line[2]) == 2:
+            flux_unit = 'n s^{-1}'
+        else:
+            flux_unit = 'n s^{-1} MeV^{-1}'
+        line = flux_file.readline()
+        line = line.strip().split()
+        group = int(line[0])
+        flux_energy_group = np.array([float(flux_file.readline().strip()) for i in range(group + 1)])
+        lines = [flux_file.readline() for i in range(group)]
+    columns = len(lines[0].split())
+    flux_spectra = np.fromstring("".join(lines), sep=' ').reshape(group, columns).T.copy()
+    return flux_unit, flux_energy_group, flux_spectra
 
 
 if __name__ == '__main__':
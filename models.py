@@ -5,11 +5,22 @@ MODULE for NRT and MD models
 @time   2017-6-16
 """
 
-from scipy import interpolate
 import numpy as np
-import matplotlib.pyplot as plt
 import math
 
+# Constants used in NJOY method
+_njoy_abohr = 52.91772108   # in pm
+_njoy_ec2 = 1.4399764       # in eVnm
+_njoy_twothd = 2./3.
+_njoy_threeq = 3./4.
+_njoy_sixth = 1./6.
+_njoy_onethd = 1./3.
+_njoy_onep5 = 1.5
+_njoy_c1 = 30.724
+_njoy_c2 = 0.07952410617
+_njoy_c3 = 3.4008
+_njoy_c4 = 0.40244
+
 
 def define_residual(mt, izp, iap, izt, iat):
     # compound nucleus
@@ -181,12 +192,39 @@ def efficiency(z2, dam, brk):
     if emd <= 40. :
         eff = 0.5608 * math.pow(emd, -0.3029) + 3.227e-3 * emd
     else:
-        f = interpolate.interp1d(teff[:, 0], teff[:, 1], kind='linear')
-        eff = f(emd)
+        eff = np.interp(emd, teff[:, 0], teff[:, 1])
 
     return eff
 
 
+# Number of displacements of damage energy T (in eV) with displacement energy ed (in eV), for the damage models
+# below. T and ed are broadcast, so that arrays of energies, displacement energies and models are done at once.
+# NRT without the threshold regions, as used for the dpa of each channel: 0.8 T / (2 Ed)
+def nrt_linear_displacements(damage_energy, ed):
+    return 0.8 * damage_energy / (2. * ed)
+
+
+# Standard NRT: 0 below Ed, 1 up to 2 Ed / 0.8, then 0.8 T / (2 Ed)
+def nrt_displacements(damage_energy, ed):
+    nrt = 0.8 * damage_energy / (2. * ed)
+    return np.where(damage_energy < ed, 0., np.where(damage_energy < 2. * ed / 0.8, 1., nrt))
+
+
+# arc-dpa (Nordlund et al. 2018): NRT times (1 - c) / (2 Ed / 0.8)^b * T^b + c above 2 Ed / 0.8,
+# b and c are material parameters
+def arc_displacements(damage_energy, ed, b, c):
+    threshold = 2. * ed / 0.8
+    above = damage_energy >= threshold
+    efficiency = (1. - c) / threshold**b * np.where(above, damage_energy, threshold)**b + c
+    return nrt_displacements(damage_energy, ed) * np.where(above, efficiency, 1.)
+
+
+# Damage models by name, extra parameters are keyword arguments
+damage_models = {'nrt_linear': nrt_linear_displacements,
+                 'nrt': nrt_displacements,
+                 'arc': arc_displacements}
+
+
 # Find default damage displacement energy
 def find_damage_displacement_energy(zz):
     edarray = {4: 31, 6: 31, 12: 25, 13: 27, 14: 25, 20: 40,
@@ -201,25 +239,31 @@ def find_damage_displacement_energy(zz):
 
 # Define another coeffs calculation method like NJOY
 def def_coeffs_njoy(e, z1, a1, z2, a2, brk):
-    abohr = 52.91772108  # in pm
-    ec2 = 1.4399764      # in eVnm
-    twothd = 2./3.
-    threeq = 3./4.
-    sixth = 1./6.
-    onethd = 1./3.
-    onep5 = 1.5
-    c1 = 30.724
-    c2 = 0.07952410617
-    c3 = 3.4008
-    c4 = 0.40244
-
-    el = (ec2 / (abohr * 1.e-3 * (9. * np.pi**2 / 128.)**onethd)) * z1 * z2 * \
-         (z1**twothd + z2**twothd)**0.5 * (a1 + a2) / a2
-    rel = 1. / el
-    denom = (z1**twothd + z2**twothd)**threeq * a1**onep5 * a2**0.5
-    kk = c2 * z1**twothd * z1**0.5 * (a1 + a2)**onep5 / denom
+    rel, kk = _njoy_coeffs_constants(z1, a1, z2, a2)
     ee = e * rel
-    gg = c3 * ee**sixth + c4 * ee**threeq + ee
+    gg = _njoy_c3 * ee**_njoy_sixth + _njoy_c4 * ee**_njoy_threeq + ee
     df = e / (1. + kk * gg)
     return df
 
+
+# Vectorized def_coeffs_njoy, evaluate the whole energy array (in eV) at once
+#       z1, a1: projectile
+#       z2, a2: material
+def def_coeffs_njoy_array(e_array, z1, a1, z2, a2):
+    rel, kk = _njoy_coeffs_constants(z1, a1, z2, a2)
+    e_array = np.asarray(e_array, dtype=float)
+    ee = e_array * rel
+    gg = _njoy_c3 * np.power(ee, _njoy_sixth) + _njoy_c4 * np.power(ee, _njoy_threeq) + ee
+    return e_array / (1. + kk * gg)
+
+
+# Constants of Robinson partition function which don't depend on energy
+# @return (rel, kk) - 1 / E_L and k_L
+def _njoy_coeffs_constants(z1, a1, z2, a2):
+    el = (_njoy_ec2 / (_njoy_abohr * 1.e-3 * (9. * np.pi**2 / 128.)**_njoy_onethd)) * z1 * z2 * \
+         (z1**_njoy_twothd + z2**_njoy_twothd)**0.5 * (a1 + a2) / a2
+    rel = 1. / el
+    denom = (z1**_njoy_twothd + z2**_njoy_twothd)**_njoy_threeq * a1**_njoy_onep5 * a2**0.5
+    kk = _njoy_c2 * z1**_njoy_twothd * z1**0.5 * (a1 + a2)**_njoy_onep5 / denom
+    return rel, kk
+
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Natural isotopic composition of the elements, in atom percent (IUPAC
+representative isotopic compositions), used to expand element fractions
+into isotope ratios.
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+from nuclide import element_z, nuclide_names
+
+# Z -> {A: atom percent}
+_natural_abundance = {
+    1: {1: 99.9885, 2: 0.0115},
+    2: {3: 0.000134, 4: 99.999866},
+    3: {6: 7.59, 7: 92.41},
+    4: {9: 100.},
+    5: {10: 19.9, 11: 80.1},
+    6: {12: 98.93, 13: 1.07},
+    7: {14: 99.636, 15: 0.364},
+    8: {16: 99.757, 17: 0.038, 18: 0.205},
+    9: {19: 100.},
+    10: {20: 90.48, 21: 0.27, 22: 9.25},
+    11: {23: 100.},
+    12: {24: 78.99, 25: 10.00, 26: 11.01},
+    13: {27: 100.},
+    14: {28: 92.223, 29: 4.685, 30: 3.092},
+    15: {31: 100.},
+    16: {32: 94.99, 33: 0.75, 34: 4.25, 36: 0.01},
+    17: {35: 75.76, 37: 24.24},
+    18: {36: 0.3365, 38: 0.0632, 40: 99.6003},
+    19: {39: 93.2581, 40: 0.0117, 41: 6.7302},
+    20: {40: 96.941, 42: 0.647, 43: 0.135, 44: 2.086, 46: 0.004, 48: 0.187},
+    21: {45: 100.},
+    22: {46: 8.25, 47: 7.44, 48: 73.72, 49: 5.41, 50: 5.18},
+    23: {50: 0.250, 51: 99.750},
+    24: {50: 4.345, 52: 83.789, 53: 9.501, 54: 2.365},
+    25: {55: 100.},
+    26: {54: 5.845, 56: 91.754, 57: 2.119, 58: 0.282},
+    27: {59: 100.},
+    28: {58: 68.077, 60: 26.223, 61: 1.1399, 62: 3.6346, 64: 0.9255},
+    29: {63: 69.15, 65: 30.85},
+    30: {64: 49.17, 66: 27.73, 67: 4.04, 68: 18.45, 70: 0.61},
+    31: {69: 60.108, 71: 39.892},
+    32: {70: 20.57, 72: 27.45, 73: 7.75, 74: 36.50, 76: 7.73},
+    33: {75: 100.},
+    34: {74: 0.89, 76: 9.37, 77: 7.63, 78: 23.77, 80: 49.61, 82: 8.73},
+    35: {79: 50.69, 81: 49.31},
+    36: {78: 0.355, 80: 2.286, 82: 11.593, 83: 11.500, 84: 56.987, 86: 17.279},
+    37: {85: 72.17, 87: 27.83},
+    38: {84: 0.56, 86: 9.86, 87: 7.00, 88: 82.58},
+    39: {89: 100.},
+    40: {90: 51.45, 91: 11.22, 92: 17.15, 94: 17.38, 96: 2.80},
+    41: {93: 100.},
+    42: {92: 14.53, 94: 9.15, 95: 15.84, 96: 16.67, 97: 9.60, 98: 24.39, 100: 9.82},
+    44: {96: 5.54, 98: 1.87, 99: 12.76, 100: 12.60, 101: 17.06, 102: 31.55, 104: 18.62},
+    45: {103: 100.},
+    46: {102: 1.02, 104: 11.14, 105: 22.33, 106: 27.33, 108: 26.46, 110: 11.72},
+    47: {107: 51.839, 109: 48.161},
+    48: {106: 1.25, 108: 0.89, 110: 12.49, 111: 12.80, 112: 24.13, 113: 12.22, 114: 28.73, 116: 7.49},
+    49: {113: 4.29, 115: 95.71},
+    50: {112: 0.97, 114: 0.66, 115: 0.34, 116: 14.54, 117: 7.68, 118: 24.22, 119: 8.59, 120: 32.58,
+         122: 4.63, 124: 5.79},
+    51: {121: 57.21, 123: 42.79},
+    52: {120: 0.09, 122: 2.55, 123: 0.89, 124: 4.74, 125: 7.07, 126: 18.84, 128: 31.74, 130: 34.08},
+    53: {127: 100.},
+    54: {124: 0.0952, 126: 0.0890, 128: 1.9102, 129: 26.4006, 130: 4.0710, 131: 21.2324, 132: 26.9086,
+         134: 10.4357, 136: 8.8573},
+    55: {133: 100.},
+    56: {130: 0.106, 132: 0.101, 134: 2.417, 135: 6.592, 136: 7.854, 137: 11.232, 138: 71.698},
+    57: {138: 0.08881, 139: 99.91119},
+    58: {136: 0.185, 138: 0.251, 140: 88.450, 142: 11.114},
+    59: {141: 100.},
+    60: {142: 27.152, 143: 12.174, 144: 23.798, 145: 8.293, 146: 17.189, 148: 5.756, 150: 5.638},
+    62: {144: 3.07, 147: 14.99, 148: 11.24, 149: 13.82, 150: 7.38, 152: 26.75, 154: 22.75},
+    63: {151: 47.81, 153: 52.19},
+    64: {152: 0.20, 154: 2.18, 155: 14.80, 156: 20.47, 157: 15.65, 158: 24.84, 160: 21.86},
+    65: {159: 100.},
+    66: {156: 0.056, 158: 0.095, 160: 2.329, 161: 18.889, 162: 25.475, 163: 24.896, 164: 28.260},
+    67: {165: 100.},
+    68: {162: 0.139, 164: 1.601, 166: 33.503, 167: 22.869, 168: 26.978, 170: 14.910},
+    69: {169: 100.},
+    70: {168: 0.123, 170: 2.982, 171: 14.09, 172: 21.68, 173: 16.103, 174: 32.026, 176: 12.996},
+    71: {175: 97.401, 176: 2.599},
+    72: {174: 0.16, 176: 5.26, 177: 18.60, 178: 27.28, 179: 13.62, 180: 35.08},
+    73: {180: 0.01201, 181: 99.98799},
+    74: {180: 0.12, 182: 26.50, 183: 14.31, 184: 30.64, 186: 28.43},
+    75: {185: 37.40, 187: 62.60},
+    76: {184: 0.02, 186: 1.59, 187: 1.96, 188: 13.24, 189: 16.15, 190: 26.26, 192: 40.78},
+    77: {191: 37.3, 193: 62.7},
+    78: {190: 0.012, 192: 0.782, 194: 32.86, 195: 33.78, 196: 25.21, 198: 7.356},
+    79: {197: 100.},
+    80: {196: 0.15, 198: 9.97, 199: 16.87, 200: 23.10, 201: 13.18, 202: 29.86, 204: 6.87},
+    81: {203: 29.52, 205: 70.48},
+    82: {204: 1.4, 206: 24.1, 207: 22.1, 208: 52.4},
+    83: {209: 100.},
+    90: {232: 100.},
+    91: {231: 100.},
+    92: {234: 0.0054, 235: 0.7204, 238: 99.2742},
+}
+
+
+# Natural isotopes of an element (symbol or Z), as fractions summing to 1
+# available: nuclide names, only these isotopes are used (fractions renormalized), all if None
+# @return {nuclide name: fraction}, such as {'Ag-107': 0.51839, 'Ag-109': 0.48161}
+def natural_isotopes(element, available=None):
+    z = element if type(element) is int else element_z(element)
+    if z not in _natural_abundance:
+        raise ValueError("No natural isotopic composition of element {}".format(element))
+    isotopes = {nuclide_names(z, a)[1]: percent for a, percent in _natural_abundance[z].items()}
+    if available is not None:
+        isotopes = {name: percent for name, percent in isotopes.items() if name in available}
+        if not isotopes:
+            raise ValueError("No natural isotope of element {} in {}".format(element, sorted(available)))
+    total = sum(isotopes.values())
+    return {name: percent / total for name, percent in isotopes.items()}
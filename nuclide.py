@@ -11,6 +11,9 @@ import string
 from functools import total_ordering
 
 import numpy as np
+import scipy.sparse as sp
+
+from read_pka_file import load_sections
 
 # Chemical element name in order of atomic number Z,
 # note that element[0] is neutron 'n'
@@ -42,6 +45,143 @@ _element = 'n', \
 
 _sym2z = dict([(_element[k].upper(), k) for k in range(97)])
 
+# Flyweight registry: each hashable nuclide identifier is parsed once into (Z, A),
+# and each (Z, A) has one shared (element, name) pair
+_nuclide_ids = {}
+_nuclide_names = {}
+
+
+# Parse nuclide identifier, such as 'U235', 'U-235', '235U', 92235, '92235', (92, 235), [92, 235],
+# {'Z': 92, 'A': 235} or any object with Z and A
+# @return (Z, A)
+def _parse_nuclide_id(nuc_id):
+    try:
+        # 属性对象输入， 如 (Z, A) 或 [Z, A]
+        return nuc_id.Z, nuc_id.A
+    except (AttributeError, TypeError):
+        pass
+
+    try:
+        # 字典类型输入，如 {'Z':92, 'A':235}
+        return nuc_id['Z'], nuc_id['A']
+    except (KeyError, TypeError, IndexError):
+        pass
+
+    # ZAID输入： 92235
+    if type(nuc_id) is int:
+        zaid = str(int(nuc_id))
+        return int(zaid[:-3]), int(zaid[-3:])
+
+    # List输入
+    if type(nuc_id) in [list, tuple]:
+        if len(nuc_id) == 2:
+            return tuple(nuc_id)
+
+    # 字符串输入
+    if type(nuc_id) is str:
+        if re.search('[a-zA-Z]', nuc_id):
+            # 大写，方便比较
+            nuc_id = nuc_id.upper()
+
+            # 如果有连字符
+            if re.search('-', nuc_id):
+                s1, s2 = nuc_id.split('-')
+                s1 = s1.strip()
+                s2 = s2.strip()
+            else:
+                s1 = list(filter(lambda x: x in string.ascii_letters, nuc_id))
+                s2 = list(filter(lambda x: not (x in string.ascii_letters), nuc_id))
+            # 不确定s1和s2的顺序，故试一下
+            s1 = "".join(s1)
+            s2 = "".join(s2)
+
+            try:
+                return _sym2z[s1[:]], int(s2)
+            except (KeyError, ValueError):
+                return _sym2z[s2[:]], int(s1)
+
+        zaid = str(int(nuc_id))
+        return int(zaid[:-3]), int(zaid[-3:])
+
+    raise ValueError("Unknown nuclide identifier: {}".format(nuc_id))
+
+
+# (Z, A) of nuclide identifier, parsed once for each hashable identifier
+def nuclide_za(nuc_id):
+    if type(nuc_id) in (int, str, tuple):
+        za = _nuclide_ids.get(nuc_id)
+        if za is None:
+            za = _parse_nuclide_id(nuc_id)
+            _nuclide_ids[nuc_id] = za
+        return za
+    return _parse_nuclide_id(nuc_id)
+
+
+# Z of element symbol, such as 'U' or 'u'
+def element_z(symbol):
+    return _sym2z[symbol.strip().upper()]
+
+
+# Shared (element, name) of (Z, A), such as ('U', 'U-235')
+def nuclide_names(z, a):
+    names = _nuclide_names.get((z, a))
+    if names is None:
+        names = (_element[z], _element[z] + '-' + str(a))
+        _nuclide_names[(z, a)] = names
+    return names
+
+
+# Root array of the buffer of array, such as the memory map of the pka library
+def _root_array(array):
+    while isinstance(array.base, np.ndarray):
+        array = array.base
+    return array
+
+
+# Are the arrays a and b views of one buffer, b right after a?
+def _adjacent_arrays(a, b):
+    return a.dtype == b.dtype and a.base is not None and _root_array(a) is _root_array(b) and \
+        a.ctypes.data + a.nbytes == b.ctypes.data
+
+
+# One view of the buffer of the adjacent arrays
+def _joined_view(arrays):
+    root = _root_array(arrays[0]).reshape(-1).view(np.uint8)
+    offset = arrays[0].ctypes.data - root.ctypes.data
+    return root[offset:offset + sum(array.nbytes for array in arrays)].view(arrays[0].dtype)
+
+
+# Stack row blocks (sparse matrices with the same columns) into a list of CSR operators.
+# Consecutive CSR blocks whose indices and data are adjacent views of one buffer (channels of the pka library)
+# are one operator, a view of that buffer: only its indptr is built. The other blocks are stacked by copy
+def stack_row_blocks(blocks):
+    runs = []       # [(is_view, [blocks])]
+    for block in blocks:
+        is_view = block.format == 'csr' and block.data.base is not None and block.indices.base is not None \
+            and block.data.shape[0] == block.indices.shape[0] == block.indptr[-1]
+        if runs and runs[-1][0] == is_view and (not is_view or (
+                _adjacent_arrays(runs[-1][1][-1].data, block.data) and
+                _adjacent_arrays(runs[-1][1][-1].indices, block.indices))):
+            runs[-1][1].append(block)
+        else:
+            runs.append((is_view, [block]))
+
+    operators = []
+    for is_view, run in runs:
+        if not is_view:
+            operators.append(sp.vstack(run, format='csr'))
+        elif len(run) == 1:
+            operators.append(run[0])
+        else:
+            starts = np.cumsum([0] + [block.nnz for block in run[:-1]])
+            indptr = np.concatenate([block.indptr[:-1] + start for block, start in zip(run, starts)] +
+                                    [[starts[-1] + run[-1].nnz]]).astype(run[0].indptr.dtype)
+            operators.append(sp.csr_matrix((_joined_view([block.data for block in run]),
+                                            _joined_view([block.indices for block in run]), indptr),
+                                           shape=(sum(block.shape[0] for block in run), run[0].shape[1]),
+                                           copy=False))
+    return operators
+
 
 @total_ordering     # 让类支持比较操作
 class Element:
@@ -49,6 +189,10 @@ class Element:
     提供元素相关信息。仅用于最终结果输出。
     """
 
+    __slots__ = ('Z', 'name', 'num_recoil_pka_energy_group', 'recoil_pka_energy_group', 'recoil_pka_spectrum',
+                 'average_pka_energy', 'damage_function_coeffs', 'damage_cross_section', 'damage_dpa',
+                 'average_displacement_energy')
+
     # Input could be 'U' or ‘92’
     def __init__(self, ele_id):
         if type(ele_id) is int:
@@ -102,60 +246,16 @@ class Nuclide:
 
     """
 
-    def __init__(self, nuc_id):
-
-        try:
-            # 属性对象输入， 如 (Z, A) 或 [Z, A]
-            self.Z, self.A = nuc_id.Z, nuc_id.A
-        except (AttributeError, TypeError):
+    __slots__ = ('Z', 'A', 'element', 'name', 'ratio', 'mass', 'ngamma_daughter_mass', 'incident_particle',
+                 'num_recoil_energy_group_struc', 'recoil_energy_group_struc', 'recoil_flux_pka',
+                 'recoil_nuclides_particles_info', 'recoil_nuclides', 'recoil_operators', 'recoil_pka_spectra',
+                 'recoil_damage_coeffs', 'recoil_damage_cross_sections', 'recoil_damage_dpa',
+                 'ngamma_xs_array', 'recoil_pka_spectrum', 'average_pka_energy', 'damage_function_coeffs',
+                 'damage_cross_section', 'damage_dpa', 'average_displacement_energy')
 
-            try:
-                # 字典类型输入，如 {'Z':92, 'A':235}
-                self.Z, self.A = nuc_id['Z'], nuc_id['A']
-            except (KeyError, TypeError):
-
-                # ZAID输入： 92235
-                if type(nuc_id) is int:
-                    zaid = str(int(nuc_id))
-                    self.Z, self.A = int(zaid[:-3]), int(zaid[-3:])
-
-                # List输入
-                if type(nuc_id) in [list, tuple]:
-                    if len(nuc_id) == 2:
-                        self.Z, self.A = nuc_id
-
-                # 字符串输入
-                if type(nuc_id) is str:
-                    if re.search('[a-zA-Z]', nuc_id):
-                        # 大写，方便比较
-                        nuc_id = nuc_id.upper()
-
-                        # 如果有连字符
-                        if re.search('-', nuc_id):
-                            s1, s2 = nuc_id.split('-')
-                            s1 = s1.strip()
-                            s2 = s2.strip()
-                        else:
-                            s1 = list(filter(lambda x: x in string.ascii_letters, nuc_id))
-                            s2 = list(filter(lambda x: not (x in string.ascii_letters), nuc_id))
-                        # 不确定s1和s2的顺序，故试一下
-                        s1 = "".join(s1)
-                        s2 = "".join(s2)
-
-                        try:
-
-                            self.Z = _sym2z[s1[:]]
-                            self.A = int(s2)
-                        except:
-                            self.Z = _sym2z[s2[:]]
-                            self.A = int(s1)
-
-                    else:
-                        zaid = str(int(nuc_id))
-                        self.Z, self.A = int(zaid[:-3]), int(zaid[-3:])
-
-        self.element = _element[self.Z]
-        self.name = self.element + '-' + str(self.A)
+    def __init__(self, nuc_id):
+        self.Z, self.A = nuclide_za(nuc_id)
+        self.element, self.name = nuclide_names(self.Z, self.A)
         self.ratio = 0.
         self.mass = 0.
         self.ngamma_daughter_mass = 0.              # ONLY used in (n, gamma) matrix estimate
@@ -166,6 +266,11 @@ class Nuclide:
 
         self.recoil_nuclides_particles_info = []    # save the recoil and particle matrix info from input file
         self.recoil_nuclides = []                   # save the recoil and particle matrix
+        self.recoil_operators = None                # [CSR, ...], recoil matrices of all channels, a row block per channel
+        self.recoil_pka_spectra = None              # np.array - SIZE (channels, [spectra,] num_recoil_energy_group_struc)
+        self.recoil_damage_coeffs = None            # np.array - SIZE (channels, num_recoil_energy_group_struc)
+        self.recoil_damage_cross_sections = None    # np.array - same SIZE as recoil_pka_spectra
+        self.recoil_damage_dpa = None               # np.array - same SIZE as recoil_pka_spectra
         self.ngamma_xs_array = None
 
         self.recoil_pka_spectrum = None             # ONLY used for total pka spectrum of this nuclide
@@ -198,6 +303,48 @@ class Nuclide:
     def set_ngamma_xs_array(self, ng_xs_array):
         self.ngamma_xs_array = ng_xs_array
 
+    # Stack the (transposed) recoil matrices of all channels into CSR operators, a row block per channel
+    # Lazy sections (PKASection) are read here, with one open of the pka file, and are not kept
+    # Channels of the pka library stay views of its memory map, see stack_row_blocks()
+    def stack_recoil_matrices(self):
+        matrices = load_sections([nuc_recoil.recoil_matrix for nuc_recoil in self.recoil_nuclides])
+        blocks = [matrix.T for matrix in matrices]
+        num_groups = set(block.shape[0] for block in blocks)
+        assert (len(num_groups) <= 1), "Recoil matrices of {} are not in same energy group!".format(self.name)
+        if blocks:
+            self.recoil_operators = stack_row_blocks(blocks)
+        else:
+            self.recoil_operators = [sp.csr_matrix((0, self.num_recoil_energy_group_struc))]
+
+    # Compute pka spectra of all channels by one sparse mat-vec (or mat-mat for more than one flux spectrum),
+    # the pka_spectrum of each NuclideRecoil is a view of recoil_pka_spectra
+    #   flux: np.array - SIZE (groups) or (spectra, groups)
+    #   recoil_pka_spectra: np.array - SIZE (channels, groups) or (channels, spectra, groups)
+    def compute_recoil_pka_spectra(self, flux):
+        if self.recoil_operators is None:
+            self.stack_recoil_matrices()
+        assert (all(operator.shape[1] == flux.shape[-1] for operator in self.recoil_operators)), \
+            "PKA matrix and pka flux spectrum do not match!"
+
+        num_channels = len(self.recoil_nuclides)
+        if flux.ndim == 1:
+            spectra = np.concatenate([operator.dot(flux) for operator in self.recoil_operators])
+            self.recoil_pka_spectra = spectra.reshape(num_channels, -1)
+        else:
+            spectra = np.concatenate([operator.dot(flux.T) for operator in self.recoil_operators])
+            # Contiguous (channels, spectra, groups), the damage arrays then keep the same layout
+            self.recoil_pka_spectra = np.ascontiguousarray(
+                spectra.reshape(num_channels, -1, flux.shape[0]).transpose(0, 2, 1))
+        for k, nuc_recoil in enumerate(self.recoil_nuclides):
+            nuc_recoil.pka_spectrum = self.recoil_pka_spectra[k]
+
+    # Release the recoil matrices after collapse, only the per group results are kept
+    def release_recoil_matrices(self):
+        self.recoil_nuclides_particles_info = []
+        self.recoil_operators = None
+        for nuc_recoil in self.recoil_nuclides:
+            nuc_recoil.recoil_matrix = None
+
     def add_recoil_pka_spectrum(self, other_recoil_pka_spectrum):
         self.recoil_pka_spectrum += other_recoil_pka_spectrum
 
@@ -219,12 +366,14 @@ class NuclideRecoil:
 
     '''
 
+    __slots__ = ('Z', 'A', 'mtd', 'element', 'name', 'title', 'mass', 'xs_energy_group_struc', 'recoil_matrix',
+                 'pka_spectrum', 'estimate_ed', 'damage_function_coeffs', 'damage_cross_section', 'damage_dpa')
+
     def __init__(self, Z, A, mtd):
         self.Z = Z
         self.A = A
         self.mtd = mtd
-        self.element = _element[self.Z]
-        self.name = _element[self.Z] + '-' + str(self.A)
+        self.element, self.name = nuclide_names(self.Z, self.A)
         self.title = None
         self.mass = 0.
         self.xs_energy_group_struc = None
@@ -240,18 +389,18 @@ class NuclideRecoil:
     # def set_energy_group_structure(self, eg_array):
     #     self.xs_energy_group_struc = eg_array
 
-    # save the recoil matrix
+    # save the recoil matrix, a lazy section (PKASection) is kept as it is and read when the matrix is used
     def load_recoil_matrix(self, matrix):
         self.recoil_matrix = matrix
 
     def compute_recoil_pka_spectra(self, flux):
-        B = self.recoil_matrix.toarray()
-        row, column = B.shape
+        matrix = load_sections([self.recoil_matrix])[0]
+        row, column = matrix.shape
         row_f = flux.shape[0]
 
         assert (row == row_f), "PKA matrix and pka flux spectrum do not match!"
 
-        self.pka_spectrum = np.dot(B.T, flux)
+        self.pka_spectrum = matrix.T.dot(flux)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+"""
+Array-backed accumulator of the global recoil nuclides and elements.
+
+Each recoil nuclide (and element) of the total results is a row of
+preallocated arrays:
+
+    pka                     - pka spectrum,                 SIZE (rows, [spectra,] groups)
+    damage_function_coeffs  - damage function coefficients, SIZE (rows, groups)
+    damage_cross_section    - displacement cross section,   SIZE (rows, [spectra,] groups)
+    damage_dpa              - NRT dpa,                      SIZE (rows, [spectra,] groups)
+
+All the channels of a parent nuclide are added at once by a sparse
+(rows x channels) weight matrix, with the same duplicated channel rules as
+before (see utility_pka.channel_masks). Nuclide and Element objects are only
+built when asked for, as views of the rows.
+
+With num_parents, each parent nuclide is added with ratio 1 into its own
+slice, SIZE (rows, parents, [spectra,] groups), and the totals of any
+composition are a product with the parent ratios (see pka_sweep).
+
+With for_store, the rows are the products of a ResultStore, and the pka,
+displacement cross section and dpa of a range of cases are added straight
+into the memory-mapped store arrays (see pka_store).
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+from collections.abc import Mapping
+
+import numpy as np
+import scipy.sparse as sp
+
+from nuclide import Element, Nuclide
+from utility_pka import calculate_average_pka_energy, channel_masks
+
+
+# Names and ids of the global nuclides and elements of the parent nuclides, in the order of the rows
+# @return {'nuclide': (names, [(Z, A), ...]), 'element': (names, [Z, ...])}
+def product_index(nuclides):
+    products = {'nuclide': {}, 'element': {}}
+    seen_nuclides, seen_elements = set(), set()
+    for nuc in nuclides:
+        to_nuclide, to_element = channel_masks(nuc, seen_nuclides, seen_elements)
+        for k, recoil in enumerate(nuc.recoil_nuclides):
+            if to_nuclide[k]:
+                products['nuclide'].setdefault(recoil.name, (recoil.Z, recoil.A))
+            if to_element[k]:
+                products['element'].setdefault(recoil.element, recoil.Z)
+    return {kind: (list(items), list(items.values())) for kind, items in products.items()}
+
+
+class _Rows:
+    """
+    Rows of one kind (nuclides or elements): key -> row index, and the arrays growing with the keys.
+    """
+
+    def __init__(self):
+        self.index = {}             # key -> row, in order of first appearance
+        self.ids = []               # Nuclide or Element id of each row
+        self.arrays = {}            # {quantity: np.array - SIZE (capacity, ...)}
+        self.fixed = False          # Rows given in advance, no other key may be added
+
+    # Rows fixed in advance, with external arrays (e.g. views of a ResultStore) for some quantities
+    def bind(self, keys, ids, arrays):
+        self.index.update((key, row) for row, key in enumerate(keys))
+        self.ids.extend(ids)
+        self.arrays.update(arrays)
+        self.fixed = True
+
+    def row(self, key, item_id):
+        if key not in self.index:
+            if self.fixed:
+                raise KeyError("{} is not in the product index of the result store".format(key))
+            self.index[key] = len(self.ids)
+            self.ids.append(item_id)
+        return self.index[key]
+
+    def reserve(self, shapes):
+        capacity = max(len(self.ids), 1)
+        for q, shape in shapes.items():
+            array = self.arrays.get(q)
+            if array is None or array.shape[0] < capacity:
+                new_array = np.zeros((max(capacity, 2 * (0 if array is None else array.shape[0])),) + shape)
+                if array is not None:
+                    new_array[:array.shape[0]] = array
+                self.arrays[q] = new_array
+
+    def add(self, rows, channel_values, ratio, parent=None):
+        if rows.shape[0] == 0:
+            return
+        # Several channels may go into the same row, sum them by one sparse product
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        weights = sp.csr_matrix((np.full(rows.shape[0], ratio), (inverse, np.arange(rows.shape[0]))),
+                                shape=(unique_rows.shape[0], rows.shape[0]))
+        for q, values in channel_values.items():
+            target = self.arrays[q] if parent is None else self.arrays[q][:, parent]
+            target[unique_rows] += weights.dot(values.reshape(rows.shape[0], -1)).reshape(
+                (unique_rows.shape[0],) + values.shape[1:])
+
+    def values(self, q):
+        return self.arrays[q][:len(self.ids)]
+
+
+class _GlobalView(Mapping):
+    """
+    Read only dict of the global nuclides (or elements), objects are built when first used.
+    """
+
+    def __init__(self, index, build):
+        self._index = index
+        self._build = build
+        self._items = {}
+
+    def __getitem__(self, key):
+        if key not in self._items:
+            if key not in self._index:
+                raise KeyError(key)
+            self._items[key] = self._build(key)
+        return self._items[key]
+
+    def __iter__(self):
+        return iter(list(self._index))
+
+    def __len__(self):
+        return len(self._index)
+
+
+class PKAAccumulator:
+    """
+    Global recoil nuclides and elements of all parent nuclides.
+    """
+
+    def __init__(self, energy_group, do_damage=True, num_parents=None):
+        self.energy_group = energy_group        # np.array - SIZE (groups + 1), pka energy group
+        self.do_damage = do_damage
+        self.num_parents = num_parents          # One slice for each parent nuclide if not None
+        self._nuclides = _Rows()
+        self._elements = _Rows()
+        self._seen_nuclides = set()
+        self._seen_elements = set()
+        self.nuclides = _GlobalView(self._nuclides.index, self._nuclide_view)
+        self.elements = _GlobalView(self._elements.index, self._element_view)
+
+    # Accumulator of the cases [first, last) of a ResultStore, added straight into the store arrays
+    # The flux spectra must be one batch (spectra, groups) of last - first spectra
+    @classmethod
+    def for_store(cls, store, first, last):
+        from pka_store import store_quantities
+        accumulator = cls(store.energy_group, 'nrt_dpa' in store.quantities)
+        for kind, rows in (('nuclide', accumulator._nuclides), ('element', accumulator._elements)):
+            # (cases, products, groups) -> (products, cases, groups), rows first as in the accumulator
+            rows.bind(store.names(kind), store.ids(kind),
+                      dict((store_quantities[q], store.array(kind, q)[first:last].transpose(1, 0, 2))
+                           for q in store.quantities))
+        return accumulator
+
+    # Add all the channels of one parent nuclide, its pka spectra (and damage) must have been computed
+    # ratio: fraction of the parent nuclide in the material, nuc.ratio if None
+    # parent: index of the parent nuclide slice, needed (and only used) with num_parents
+    def add(self, nuc, ratio=None, parent=None):
+        assert ((parent is None) == (self.num_parents is None)), "Parent slice index and num_parents go together!"
+        # All parent nuclides (e.g. of several projectiles) share the pka energy group of the results
+        assert (np.array_equal(nuc.recoil_energy_group_struc, self.energy_group)), \
+            "Pka energy group of {} differs from that of the results!".format(nuc.name)
+        if ratio is None:
+            ratio = nuc.ratio
+        to_nuclide, to_element = channel_masks(nuc, self._seen_nuclides, self._seen_elements)
+        nuclide_rows = np.array([self._nuclides.row(recoil.name, (recoil.Z, recoil.A))
+                                 for k, recoil in enumerate(nuc.recoil_nuclides) if to_nuclide[k]], dtype=int)
+        element_rows = np.array([self._elements.row(recoil.element, recoil.Z)
+                                 for k, recoil in enumerate(nuc.recoil_nuclides) if to_element[k]], dtype=int)
+
+        spectrum_shape = nuc.recoil_pka_spectra.shape[1:]
+        shapes = {'pka': spectrum_shape}
+        if self.do_damage:
+            shapes.update(damage_function_coeffs=spectrum_shape[-1:], damage_cross_section=spectrum_shape,
+                          damage_dpa=spectrum_shape)
+        if self.num_parents is not None:
+            shapes = {q: (self.num_parents,) + shape for q, shape in shapes.items()}
+        self._nuclides.reserve(shapes)
+        self._elements.reserve(shapes)
+
+        for rows, mask, target in ((nuclide_rows, to_nuclide, self._nuclides),
+                                   (element_rows, to_element, self._elements)):
+            if not mask.any():
+                continue
+            channel_values = {'pka': nuc.recoil_pka_spectra[mask]}
+            if self.do_damage:
+                channel_values.update(damage_function_coeffs=nuc.recoil_damage_coeffs[mask],
+                                      damage_cross_section=nuc.recoil_damage_cross_sections[mask],
+                                      damage_dpa=nuc.recoil_damage_dpa[mask])
+            target.add(rows, channel_values, ratio, parent)
+
+        # Views built before are out of date
+        self.nuclides._items.clear()
+        self.elements._items.clear()
+
+    def accumulate(self, nuclides):
+        for nuc in nuclides:
+            self.add(nuc)
+
+    # Arrays of all nuclides (kind 'nuclide') or elements (kind 'element'), one row per name
+    # @return {column: np.array}
+    def columns(self, kind):
+        rows = self._nuclides if kind == 'nuclide' else self._elements
+        pka = rows.values('pka')
+        columns = {'names': np.array(list(rows.index), dtype=str),
+                   'pka': pka,
+                   # Elements divide whenever the total is not 0, same as their views
+                   'average_pka_energy': calculate_average_pka_energy(pka, self.energy_group,
+                                                                      positive_only=(kind == 'nuclide'))}
+        if kind == 'nuclide':
+            columns['za'] = np.array(rows.ids, dtype=int).reshape(-1, 2)
+        else:
+            columns['z'] = np.array(rows.ids, dtype=int)
+        if self.do_damage:
+            columns['disp_cross_section'] = rows.values('damage_cross_section')
+            columns['nrt_dpa'] = rows.values('damage_dpa')
+            columns['displacement_energy'] = np.sum(columns['disp_cross_section'], axis=-1) * 1.E+6     # in eV
+            columns['total_nrt_dpa'] = np.sum(columns['nrt_dpa'], axis=-1)
+        return columns
+
+    # Names, ids and the parent nuclide slices of all nuclides or elements (only with num_parents)
+    # @return {'names': ..., 'za' or 'z': ..., quantity: np.array - SIZE (rows, parents, ...)}
+    def parent_slices(self, kind):
+        assert (self.num_parents is not None), "Accumulator has no parent nuclide slices!"
+        rows = self._nuclides if kind == 'nuclide' else self._elements
+        slices = {q: rows.values(q) for q in rows.arrays}
+        slices['names'] = np.array(list(rows.index), dtype=str)
+        if kind == 'nuclide':
+            slices['za'] = np.array(rows.ids, dtype=int).reshape(-1, 2)
+        else:
+            slices['z'] = np.array(rows.ids, dtype=int)
+        return slices
+
+    # Sum of the pka spectra of all elements
+    def total_pka_spectrum(self):
+        if not self._elements.ids:
+            return None
+        return self._elements.values('pka').sum(axis=0)
+
+    def _fill_view(self, item, rows, row, positive_only):
+        item.recoil_pka_spectrum = rows.values('pka')[row]
+        item.average_pka_energy = calculate_average_pka_energy(item.recoil_pka_spectrum, self.energy_group,
+                                                               positive_only=positive_only)
+        if self.do_damage:
+            item.damage_function_coeffs = rows.values('damage_function_coeffs')[row]
+            item.damage_cross_section = rows.values('damage_cross_section')[row]
+            item.damage_dpa = rows.values('damage_dpa')[row]
+            # in eV
+            item.average_displacement_energy = np.sum(item.damage_cross_section, axis=-1) * 1.E+6
+        return item
+
+    def _nuclide_view(self, key):
+        row = self._nuclides.index[key]
+        nuclide = Nuclide(self._nuclides.ids[row])
+        nuclide.set_recoil_energy_group_struc(self.energy_group)
+        return self._fill_view(nuclide, self._nuclides, row, True)
+
+    def _element_view(self, key):
+        row = self._elements.index[key]
+        element = Element(self._elements.ids[row])
+        element.num_recoil_pka_energy_group = self.energy_group.shape[0] - 1
+        element.copy_recoil_pka_energy_group(self.energy_group)
+        return self._fill_view(element, self._elements, row, False)
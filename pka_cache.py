@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+"""
+Binary cache of parsed pka files.
+
+Each pka file is parsed once from ASCII and saved as one '.npz' file in the
+cache directory. An 'index.json' file records, for each entry, the pka file
+path, size, modification time and optional content hash, so that a changed
+pka file is parsed again. The cache size is bounded, the least recently used
+entries are removed first.
+
+Hits and misses only change the index in memory. flush() merges the changes
+into the index on disk once per run, under a lock of the cache directory, so
+that processes sharing the cache don't drop the entries of each other. The
+workers of a process pool send their changes to the parent process instead
+(see take_changes() and merge()).
+
+    python pka_cache.py warm [input.json] [--cache-dir DIR] [--max-size MB] [--hash]
+    python pka_cache.py inspect [--cache-dir DIR]
+    python pka_cache.py purge [--cache-dir DIR]
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+try:
+    import fcntl
+except ImportError:     # Windows, a lock file is used instead
+    fcntl = None
+
+import numpy as np
+import scipy.sparse as sp
+
+from read_pka_file import read_pka_file
+
+_cache_version = 1
+_default_cache_dir = '.pka_cache'
+_default_max_size = 2048    # in MB
+_index_name = 'index.json'
+_lock_name = 'index.lock'
+_lock_timeout = 60.         # in s, a lock file older than this is left by a killed process
+
+
+# Content hash of a pka file
+def file_content_hash(filename):
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+# Save the read_pka_file() results into a '.npz' file (file name or file object)
+def save_pka_data(filename, pka_data):
+    num_egs, pka_e_array, matrices, (ng_title, ng_mtd, ng_xs) = pka_data
+    nnz = [A.nnz for title, mtd, A in matrices]
+    coo = [A.tocoo() for title, mtd, A in matrices]
+    np.savez(filename,
+             num_egs=np.array(num_egs),
+             pka_e_array=pka_e_array,
+             titles=np.array([title for title, mtd, A in matrices], dtype=str),
+             mtds=np.array([mtd for title, mtd, A in matrices], dtype=np.int32),
+             shapes=np.array([A.shape for title, mtd, A in matrices], dtype=np.int32).reshape(-1, 2),
+             offsets=np.concatenate(([0], np.cumsum(nnz))).astype(np.int64),
+             rows=np.concatenate([A.row for A in coo] + [[]]).astype(np.int32),
+             columns=np.concatenate([A.col for A in coo] + [[]]).astype(np.int32),
+             values=np.concatenate([A.data for A in coo] + [[]]).astype(np.float64),
+             ng_title=np.array('' if ng_title is None else ng_title),
+             ng_mtd=np.array(-1 if ng_mtd is None else ng_mtd),
+             ng_xs=np.zeros(0) if ng_xs is None else ng_xs)
+
+
+# Read the slices [start, stop) of the 1-D array name of an npz file, the file is not compressed
+# (see save_pka_data), so only the bytes of the slices are read
+def _read_npz_slices(data, name, slices):
+    with data.zip.open(name + '.npy') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        base = f.tell()
+        arrays = []
+        for start, stop in slices:
+            f.seek(base + int(start) * dtype.itemsize)
+            arrays.append(np.frombuffer(f.read(int(stop - start) * dtype.itemsize), dtype=dtype))
+        return arrays
+
+
+# Load the '.npz' file into the same results as read_pka_file()
+# section_selection: PKASectionSelection, only the matrices of the selected sections are read
+def load_pka_data(filename, section_selection=None):
+    with np.load(filename) as data:
+        offsets = data['offsets']
+        sections = [(str(title), int(mtd), tuple(int(n) for n in shape))
+                    for title, mtd, shape in zip(data['titles'], data['mtds'], data['shapes'])]
+        selected = [k for k, (title, mtd, shape) in enumerate(sections)
+                    if section_selection is None or section_selection(title, mtd)]
+        slices = [(offsets[k], offsets[k + 1]) for k in selected]
+        if len(selected) == len(sections):
+            rows, columns, values = data['rows'], data['columns'], data['values']
+            parts = [(rows[start:stop], columns[start:stop], values[start:stop]) for start, stop in slices]
+        else:
+            parts = zip(*[_read_npz_slices(data, name, slices) for name in ('rows', 'columns', 'values')])
+        matrices = []
+        for k, (rows, columns, values) in zip(selected, parts):
+            title, mtd, shape = sections[k]
+            matrices.append((title, mtd, sp.coo_matrix((values, (rows, columns)), shape=shape)))
+        if int(data['ng_mtd']) < 0:
+            ng_info = (None, None, None)
+        else:
+            ng_info = (str(data['ng_title']), int(data['ng_mtd']), data['ng_xs'])
+        return int(data['num_egs']), data['pka_e_array'], matrices, ng_info
+
+
+class _IndexLock:
+    """
+    Inter-process lock of the cache index: flock of the lock file, or the lock file itself where there is no flock.
+    """
+
+    def __init__(self, directory):
+        self.filename = os.path.join(directory, _lock_name)
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.filename, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            return self
+        while True:
+            try:
+                self._file = os.open(self.filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.filename) > _lock_timeout:
+                        os.remove(self.filename)
+                except OSError:
+                    pass
+                time.sleep(0.01)
+
+    def __exit__(self, *args):
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+        else:
+            os.close(self._file)
+            os.remove(self.filename)
+
+
+class PKACache:
+    """
+    Size bounded (LRU) binary cache of parsed pka files.
+    """
+
+    def __init__(self, directory=_default_cache_dir, max_size=_default_max_size, use_hash=False):
+        self.directory = directory
+        self.max_size = max_size * 1024 * 1024      # in bytes
+        self.use_hash = use_hash
+        self.hits = 0
+        self.misses = 0
+        self.index = {}
+        self._changed = set()       # Paths changed by this object, not written into the index file yet
+        self._removed = set()       # Paths removed by this object, not written into the index file yet
+        os.makedirs(self.directory, exist_ok=True)
+        self.index = self._read_index()
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.directory, _index_name)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('version') == _cache_version:
+            return data.get('entries', {})
+        return {}
+
+    # Merge the changes into the index on disk, which may have been changed by other processes, and write it.
+    # Read, merge and write are done under the index lock; call it once after all pka files have been read
+    def flush(self):
+        if not self._changed and not self._removed:
+            return
+        with _IndexLock(self.directory):
+            index = self._read_index()
+            for path in self._removed:
+                index.pop(path, None)
+            for path in self._changed:
+                if path in self.index:
+                    index[path] = self.index[path]
+            self.index = index
+            self.evict()
+            self._changed.clear()
+            self._removed.clear()
+
+            index_file = os.path.join(self.directory, _index_name)
+            tmp_file = '{}.{}'.format(index_file, os.getpid())
+            with open(tmp_file, 'w') as f:
+                json.dump({'version': _cache_version, 'entries': self.index}, f, indent=1)
+            os.replace(tmp_file, index_file)
+
+    # Entries changed by this object and not written yet, they are no longer written by this object.
+    # Used by the workers of a process pool, the parent process merges them (see merge())
+    def take_changes(self):
+        changes = dict((path, self.index[path]) for path in self._changed if path in self.index)
+        self._changed.clear()
+        return changes
+
+    # Add the changes taken from the cache of another process, they are written by the next flush()
+    def merge(self, changes):
+        self.index.update(changes)
+        self._changed.update(changes)
+
+    def _entry_file(self, entry):
+        return os.path.join(self.directory, entry['data_file'])
+
+    # Key of pka file: (path, size, mtime[, content hash])
+    def _file_key(self, filename):
+        stat = os.stat(filename)
+        key = {'path': os.path.abspath(filename), 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        if self.use_hash:
+            key['hash'] = file_content_hash(filename)
+        return key
+
+    def _is_valid(self, entry, key):
+        if entry is None or entry['size'] != key['size'] or not os.path.exists(self._entry_file(entry)):
+            return False
+        if self.use_hash and entry.get('hash') is not None:
+            return entry['hash'] == key['hash']
+        return entry['mtime'] == key['mtime']
+
+    # Same as read_pka_file(), the text is parsed only if the cache entry is missing or out of date.
+    # section_selection: only the selected matrices are read from the cache entry. A missing entry is
+    # parsed and stored with all its sections, the selection is applied afterwards
+    def read_pka_file(self, filename, section_selection=None):
+        key = self._file_key(filename)
+        entry = self.index.get(key['path'])
+        if self._is_valid(entry, key):
+            try:
+                pka_data = load_pka_data(self._entry_file(entry), section_selection)
+            except (OSError, ValueError, KeyError):
+                pka_data = None
+            if pka_data is not None:
+                self.hits += 1
+                entry.update(key)
+                entry['last_used'] = time.time()
+                self._changed.add(key['path'])
+                return pka_data
+
+        self.misses += 1
+        pka_data = read_pka_file(filename)
+        self.store(key, pka_data)
+        if section_selection is not None:
+            num_egs, pka_e_array, matrices, ng_info = pka_data
+            pka_data = num_egs, pka_e_array, section_selection.select(matrices), ng_info
+        return pka_data
+
+    def store(self, key, pka_data):
+        data_file = hashlib.sha1(key['path'].encode('utf-8')).hexdigest() + '.npz'
+        entry = dict(key, data_file=data_file)
+        # Write into a temporary file first, other processes may read or write the same entry
+        tmp_file = '{}.{}'.format(self._entry_file(entry), os.getpid())
+        with open(tmp_file, 'wb') as f:
+            save_pka_data(f, pka_data)
+        os.replace(tmp_file, self._entry_file(entry))
+        entry['bytes'] = os.path.getsize(self._entry_file(entry))
+        entry['last_used'] = time.time()
+        self.index[key['path']] = entry
+        self._changed.add(key['path'])
+
+    # Remove the least recently used entries until the cache fits in max_size
+    def evict(self):
+        total = sum(entry['bytes'] for entry in self.index.values())
+        for path, entry in sorted(self.index.items(), key=lambda x: x[1]['last_used']):
+            if total <= self.max_size:
+                break
+            total -= entry['bytes']
+            self._remove(path)
+
+    def _remove(self, path):
+        entry = self.index.pop(path)
+        self._removed.add(path)
+        self._changed.discard(path)
+        try:
+            os.remove(self._entry_file(entry))
+        except OSError:
+            pass
+
+    def purge(self):
+        for path in list(self.index):
+            self._remove(path)
+        self.flush()
+
+    def warm(self, filenames, file_object=sys.stdout):
+        for filename in filenames:
+            self.read_pka_file(filename)
+            print("\tCACHED: {}".format(filename), file=file_object)
+        self.flush()
+
+    def inspect(self, file_object=sys.stdout):
+        total = 0
+        print("Cache directory: {}".format(os.path.abspath(self.directory)), file=file_object)
+        for path, entry in sorted(self.index.items(), key=lambda x: x[1]['last_used'], reverse=True):
+            total += entry['bytes']
+            print("\t{0:10.3f} MB  {1}  {2}".format(entry['bytes'] / 1024. ** 2,
+                  time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['last_used'])), path), file=file_object)
+        print("Entries: {0}, total size: {1:.3f} MB / {2:.3f} MB".format(
+              len(self.index), total / 1024. ** 2, self.max_size / 1024. ** 2), file=file_object)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Binary cache of parsed pka files.')
+    parser.add_argument('command', choices=['warm', 'inspect', 'purge'])
+    parser.add_argument('input', nargs='?', default=None, help='input file, used by warm')
+    parser.add_argument('--cache-dir', default=None)
+    parser.add_argument('--max-size', type=float, default=None, help='in MB')
+    parser.add_argument('--hash', action='store_true', help='check file content hash')
+    args = parser.parse_args(argv)
+
+    directory, max_size, use_hash = args.cache_dir, args.max_size, args.hash
+    filenames = []
+    if args.command == 'warm':
+        from input import Input
+        inp = Input(args.input or 'input.json')
+        inp.read_infile()
+        filenames = [pka_file['pka_filename'] for pka_file in inp.pka_files]
+        directory = directory or inp.pka_cache_dir
+        max_size = max_size or inp.pka_cache_max_size
+        use_hash = use_hash or inp.pka_cache_hash
+
+    cache = PKACache(directory or _default_cache_dir, max_size or _default_max_size, use_hash)
+    if args.command == 'warm':
+        cache.warm(filenames)
+    elif args.command == 'purge':
+        cache.purge()
+    cache.inspect()
+
+
+if __name__ == '__main__':
+    main()
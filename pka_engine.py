@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+"""
+In-process PKA engine.
+
+PKAEngine wraps one input file: reading the pka data, collapse of the recoil
+matrices with a flux, aggregation into the global nuclides and elements, and
+output, as separate methods. The parsed pka nuclides (with their stacked
+recoil operators), the pka cache or library, and the damage coefficients and
+flux rebinning caches are kept between runs, so that many fluxes can be
+evaluated in one process:
+
+    engine = PKAEngine('input.json')
+    engine.read_flux()
+    result = engine.run()
+    engine.write_output(result)
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+import sys
+
+from input import Input
+from pka_accumulator import PKAAccumulator
+from pka_ingest import read_pka_nuclides, iter_pka_nuclides
+from utility_pka import set_up_recoil_nuclides, compute_recoil_damage, interpolate_flux_pka_from_input, \
+    damage_coeffs_cache
+from utility_rebin import rebin_operator_cache
+
+
+# Flux of the parent nuclide nuc: that of its projectile in a mixed field, else flux
+# flux, projectile_fluxes[projectile]: (flux_spectrum, flux_unit, flux_energy_group)
+def projectile_flux(nuc, flux, projectile_fluxes=None):
+    if projectile_fluxes is None:
+        return flux
+    return projectile_fluxes.get(nuc.incident_particle, flux)
+
+
+class PKAResult:
+    """
+    Results of one run: global nuclides and elements, for one or more flux spectra.
+    """
+
+    def __init__(self, accumulator, nuclides, flux_names):
+        self.accumulator = accumulator
+        self.energy_group = accumulator.energy_group
+        self.nuclides = nuclides            # Parent nuclides, their channel results are those of the last run
+        self.flux_names = list(flux_names)
+
+    # Global nuclides dictionary, name -> Nuclide (a view of the result arrays)
+    @property
+    def global_recoil(self):
+        return self.accumulator.nuclides
+
+    # Global elements dictionary, name -> Element (a view of the result arrays)
+    @property
+    def global_element(self):
+        return self.accumulator.elements
+
+    @property
+    def num_flux_spectra(self):
+        return len(self.flux_names)
+
+    def total_pka_spectrum(self):
+        return self.accumulator.total_pka_spectrum()
+
+    # Arrays of all nuclides ('nuclide') or elements ('element'), see PKAAccumulator.columns()
+    def columns(self, kind):
+        return self.accumulator.columns(kind)
+
+
+class PKAEngine:
+    """
+    G-PKA calculation of one input file, the pka data are read once and kept between runs.
+    """
+
+    def __init__(self, input_file='input.json', file_object=sys.stdout, inp=None):
+        self.file_object = file_object
+        if inp is None:
+            inp = Input(input_file)
+            inp.read_infile(file_object)
+        self.inp = inp
+        self.nuclides = None        # Parent nuclides with recoil matrices, not kept in streaming mode
+
+    # Read the flux files of input, or the given flux files
+    def read_flux(self, flux_filenames=None):
+        if flux_filenames is not None:
+            self.inp.infile_flux_name = flux_filenames
+        self.inp.read_flux(self.file_object)
+
+    # Read the pka files and set up the recoil channels of all parent nuclides, once
+    def load_nuclides(self):
+        if self.nuclides is None:
+            print("\n\n>>> START READ PKA MATRIX FILES ...", file=self.file_object)
+            nuclides = read_pka_nuclides(self.inp, self.file_object)
+            for nuc in nuclides:
+                # --- Set up the NuclideRecoil of each channel and load the recoil matrix
+                set_up_recoil_nuclides(nuc)
+            self.nuclides = nuclides
+        return self.nuclides
+
+    # Parent nuclides to be collapsed: all loaded nuclides, or one by one from the pka files in streaming mode
+    def iter_nuclides(self):
+        if not self.inp.streaming:
+            for nuc in self.load_nuclides():
+                yield nuc
+            return
+        print("\n\n>>> START READ PKA MATRIX FILES ...", file=self.file_object)
+        for nuc in iter_pka_nuclides(self.inp, self.file_object):
+            set_up_recoil_nuclides(nuc)
+            yield nuc
+
+    # Collapse the recoil matrices of one parent nuclide with flux (as Input.flux_spectrum)
+    def collapse(self, nuc, flux_spectrum, flux_unit, flux_energy_group):
+        # prepare for collapse
+        nuc.recoil_flux_pka = interpolate_flux_pka_from_input(flux_spectrum,
+                                    flux_unit,
+                                    flux_energy_group,
+                                    nuc.recoil_energy_group_struc,
+                                    self.inp.flux_rebin_method)
+
+        # --- Calculate recoil pka spectra of all channels and save them
+        nuc.compute_recoil_pka_spectra(nuc.recoil_flux_pka)
+
+        # Calculate dpa values
+        if self.inp.do_damage:
+            compute_recoil_damage(nuc)
+
+        # Save the total recoil pka spectrum for this nuc
+        nuc.recoil_pka_spectrum = nuc.recoil_pka_spectra.sum(axis=0)
+
+    # Collapse and aggregate all parent nuclides, with the flux of input or the given flux
+    # flux_spectrum: np.array - SIZE (groups) or (spectra, groups), same unit and scale as Input.flux_spectrum
+    # ratios: {parent nuclide name: ratio}, replaces the 'pka_ratios' of input, missing nuclides are 0
+    # accumulator: PKAAccumulator to aggregate into (e.g. PKAAccumulator.for_store), a new one if None
+    # projectile_fluxes: {projectile: (flux_spectrum, flux_unit, flux_energy_group)}, mixed field: the parent
+    #   nuclides of each projectile are collapsed with its flux into the same accumulator, the others use
+    #   flux_spectrum. Those of input ('projectile_fluxes') if flux_spectrum is None
+    # @return PKAResult
+    def run(self, flux_spectrum=None, flux_unit=None, flux_energy_group=None, flux_names=None, ratios=None,
+            accumulator=None, projectile_fluxes=None):
+        inp = self.inp
+        if flux_spectrum is None:
+            flux_spectrum, flux_unit, flux_energy_group = inp.flux_spectrum, inp.flux_unit, inp.flux_energy_group
+            flux_names = inp.flux_names
+            projectile_fluxes = inp.projectile_flux_spectra
+        if flux_names is None:
+            flux_names = ['flux'] if flux_spectrum.ndim == 1 else \
+                ['flux:{}'.format(k + 1) for k in range(flux_spectrum.shape[0])]
+
+        stream_writer = None
+        if inp.stream_output:
+            from utility_output import ResultStreamWriter
+            # Results of each parent nuclide are written as soon as it is collapsed
+            stream_writer = ResultStreamWriter(flux_names, inp.stream_output, inp.stream_output_gzip)
+
+        nuclides = []
+        started = False
+        for nuc in self.iter_nuclides():
+            if not started:
+                print("\n\n>>> START CALCULATE PKA AND DPA VALUES ...", file=self.file_object)
+                started = True
+                if accumulator is None:
+                    accumulator = PKAAccumulator(nuc.recoil_energy_group_struc, inp.do_damage)
+            self.collapse(nuc, *projectile_flux(nuc, (flux_spectrum, flux_unit, flux_energy_group),
+                                                projectile_fluxes))
+
+            # Check each recoil nuclides of this nuclide, save them into global nuclides and elements
+            # 计算每个初始靶核的每个反冲核，并保存在全局的核素和元素字典内
+            # ****** Add the nuclide ratio here ******
+            # ****** 注意，在此处引入核素比值 ******
+            accumulator.add(nuc, None if ratios is None else ratios.get(nuc.name, 0.))
+            if stream_writer is not None:
+                stream_writer.write_parent_nuclide(nuc, inp.do_write_each_nuclides)
+                stream_writer.flush()
+
+            if inp.streaming:
+                nuc.release_recoil_matrices()
+                # Pka spectra of each channel are only kept for the output of each nuclide
+                if not inp.do_write_each_nuclides:
+                    continue
+            nuclides.append(nuc)
+
+        print("\tFLUX REBIN OPERATORS: {} [{}], {} reused".format(rebin_operator_cache.misses,
+              inp.flux_rebin_method, rebin_operator_cache.hits), file=self.file_object)
+        if inp.do_damage:
+            print("\tDAMAGE COEFFS CACHE: {} hits, {} misses".format(damage_coeffs_cache.hits,
+                  damage_coeffs_cache.misses), file=self.file_object)
+
+        result = PKAResult(accumulator, nuclides, flux_names)
+        if stream_writer is not None:
+            stream_writer.write_totals(accumulator)
+            stream_writer.close()
+        return result
+
+    # Collapse and aggregate all flux spectra of input straight into a ResultStore (see pka_store), by
+    # batches of 'result_store_chunk' spectra, so that the results of all spectra are never in memory
+    # @return ResultStore - opened to read
+    def run_into_store(self, directory=None):
+        import os
+        from pka_accumulator import product_index
+        from pka_store import ResultStore
+        inp = self.inp
+        if directory is None:
+            directory = inp.result_store
+        # The product index needs all parent nuclides, they are kept for all the batches. Streaming is off
+        # for this run, the options of input are restored at the end
+        streaming, stream_output = inp.streaming, inp.stream_output
+        inp.streaming = False
+        inp.stream_output = []
+        try:
+            nuclides = self.load_nuclides()
+            flux_spectrum = inp.flux_spectrum.reshape(-1, inp.flux_spectrum.shape[-1])
+            flux_names = list(inp.flux_names)
+            projectile_fluxes = inp.projectile_flux_spectra or {}
+            store = ResultStore.create(directory, flux_names, nuclides[0].recoil_energy_group_struc,
+                                       product_index(nuclides), inp.do_damage)
+            print("\n\n>>> START CALCULATE PKA AND DPA VALUES INTO STORE [{}]: {} spectra, batches of {}".format(
+                  directory, store.num_cases, inp.result_store_chunk), file=self.file_object)
+
+            # Per batch run output is not printed
+            with open(os.devnull, 'w') as devnull:
+                batch_engine = PKAEngine(file_object=devnull, inp=inp)
+                batch_engine.nuclides = nuclides
+                for first in range(0, store.num_cases, inp.result_store_chunk):
+                    last = min(first + inp.result_store_chunk, store.num_cases)
+                    batch_fluxes = dict((projectile,
+                                         (spectrum.reshape(-1, spectrum.shape[-1])[first:last], unit, group))
+                                        for projectile, (spectrum, unit, group) in projectile_fluxes.items())
+                    batch_engine.run(flux_spectrum[first:last], inp.flux_unit, inp.flux_energy_group,
+                                     flux_names[first:last], accumulator=PKAAccumulator.for_store(store, first, last),
+                                     projectile_fluxes=batch_fluxes or None)
+                    store.flush()
+            store.close()
+        finally:
+            inp.streaming, inp.stream_output = streaming, stream_output
+        print(">>> RESULTS OF {} SPECTRA WRITTEN INTO [{}]".format(store.num_cases, directory),
+              file=self.file_object)
+        return ResultStore(directory)
+
+    # Write the results into the files of 'output_format'
+    def write_output(self, result):
+        from utility_output import write_each_recoil_pka_into_xls, write_total_nuclides_into_xls, \
+            write_total_elements_into_xls, write_results_into_npz
+        inp = self.inp
+        # 将结果写入Excel表
+        if result.num_flux_spectra > 1:
+            # Batch mode: arrays of all flux spectra are written into the columnar npz file, xls is not supported
+            write_results_into_npz(result.accumulator, result.flux_names)
+        else:
+            if 'npz' in inp.output_format:
+                write_results_into_npz(result.accumulator)
+            if 'xls' in inp.output_format:
+                if inp.do_write_each_nuclides:
+                    for nuc in result.nuclides:
+                        write_each_recoil_pka_into_xls(nuc)
+                write_total_nuclides_into_xls(result.global_recoil)
+                write_total_elements_into_xls(result.global_element)
+
+    # Figures are rendered from the saved result file in a background process, off the critical path
+    def plot(self, result):
+        from utility_fig import plot_result_file_in_background
+        from utility_output import write_results_into_npz
+        inp = self.inp
+        if inp.plot_figure and result.num_flux_spectra == 1:
+            if 'npz' not in inp.output_format:
+                write_results_into_npz(result.accumulator)
+            return plot_result_file_in_background('Total_PKAs.npz', inp.density, inp.atomic_mass,
+                                                  self.file_object)
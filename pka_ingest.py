@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+Read the pka files of the input file into parent nuclides.
+
+Each pka file is independent of the others: it is read (from text, binary
+cache or pka library), the (n,g) recoil matrix is estimated if needed and a
+Nuclide is set up. With 'num_processes' > 1 in the input file, the files are
+dealt in a process pool. Results and logs are returned in input order.
+
+iter_pka_nuclides() yields the nuclides one by one (streaming mode). The
+number of files in flight is limited by 'num_processes' and by the input
+option 'memory_budget' (MB, checked against the pka file sizes).
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+import io
+import os
+import sys
+from collections import deque
+
+from nuclide import Nuclide
+from read_pka_file import read_pka_file, PKASectionSelection
+from utility_pka import estimate_ng_recoil_matrix
+
+# Cache and library opened once in each process
+_worker_state = {}
+
+
+def _open_pka_sources(inp):
+    key = (inp.pka_cache_dir, inp.pka_cache_max_size, inp.pka_cache_hash, inp.pka_library)
+    if _worker_state.get('key') != key:
+        _worker_state['key'] = key
+        _worker_state['cache'] = None
+        _worker_state['library'] = None
+        if inp.pka_cache_dir is not None:
+            from pka_cache import PKACache
+            _worker_state['cache'] = PKACache(inp.pka_cache_dir, inp.pka_cache_max_size, inp.pka_cache_hash)
+        if inp.pka_library is not None:
+            from pka_library import PKALibrary
+            _worker_state['library'] = PKALibrary(inp.pka_library)
+    return _worker_state['cache'], _worker_state['library']
+
+
+# Read the i-th pka file of input into a parent nuclide
+# @return (nuc, log) - log is the text to be printed into output
+def read_pka_nuclide(inp, i):
+    output = io.StringIO()
+    pka_cache, pka_library = _open_pka_sources(inp)
+    section_selection = PKASectionSelection(inp.mt_include, inp.mt_exclude,
+                                            inp.particle_include, inp.particle_exclude)
+    pka_info = inp.pka_files[i]
+
+    # Set up a new parent nuclide and its ratio
+    nuc = Nuclide(pka_info['parent'])
+    nuc.ratio = pka_info['pka_ratios']
+    # Incident particle, its flux is used in a mixed-field input
+    nuc.incident_particle = pka_info.get('projectile', 'n')
+
+    # Read the parent and daughter mass for ngamma reaction channel
+    nuc.mass = pka_info['ngamma_parent_mass']
+    nuc.ngamma_daughter_mass = pka_info['ngamma_daughter_mass']
+
+    if pka_library is None:
+        print("\tPKA FILE    : {}".format(pka_info['pka_filename']), file=output)
+    else:
+        print("\tPKA LIBRARY : {}".format(inp.pka_library), file=output)
+    print("\tNUCLIDE INFO: {} Z={}, A={}, ratio={}, projectile={}".format(nuc.name, nuc.Z, nuc.A, nuc.ratio,
+                                                                      nuc.incident_particle), file=output)
+
+    # Read the parent nuclide pka file
+    if pka_library is not None:
+        pi, pe_array, recoil_matrices, ng_info = pka_library.read_pka_file(pka_info['parent'],
+                                                                          nuc.incident_particle)
+    elif pka_cache is None:
+        pi, pe_array, recoil_matrices, ng_info = read_pka_file(pka_info['pka_filename'],
+                                                               inp.lazy_load, section_selection)
+    else:
+        misses = pka_cache.misses
+        pi, pe_array, recoil_matrices, ng_info = pka_cache.read_pka_file(pka_info['pka_filename'],
+                                                                        section_selection)
+        print("\tPKA CACHE   : {} [{}]".format('miss' if pka_cache.misses > misses else 'hit', inp.pka_cache_dir),
+              file=output)
+    recoil_matrices = section_selection.select(recoil_matrices)
+
+    print("    >>> LIST OF MTD WHICH HAS BEEN READ:", file=output)
+
+    # 读取第一部分，能量网格结构
+    nuc.num_recoil_energy_group_struc = pi
+    nuc.set_recoil_energy_group_struc(pe_array)
+
+    # 读取第二部分：多个不同的反冲核、生成粒子的群群矩阵，稀疏矩阵格式
+    for title, mtd, A in recoil_matrices:
+        nuc.append_recoil_nuclide_info((title, mtd, A))   # Add the recoil info
+        print("\t\t| {0:3d} | {1:30s} |".format(mtd, title), file=output)
+
+    # 读取第三部分：(n, g) 反应截面。单独存储。
+    title, mtd, ng_xs_array = ng_info
+
+    # 若需要处理 (n,g) 反应，则在此处生成 (n,g) 群群矩阵
+    # The capture channel of the projectile, e.g. '(p,g) recoil matrix', its residual follows the projectile
+    capture_title = '({},g) recoil matrix'.format(nuc.incident_particle)
+    if inp.do_gamma_estimate and mtd == 102 and 'cross' in title and section_selection(capture_title, mtd):
+        nuc.set_ngamma_xs_array(ng_xs_array)
+        A = estimate_ng_recoil_matrix(nuc.recoil_energy_group_struc, nuc.ngamma_xs_array, nuc.mass,
+                                      nuc.incident_particle, nuc.ngamma_daughter_mass)
+        nuc.append_recoil_nuclide_info((capture_title, mtd, A))
+        print("\t\t| {0:3d} | {1:30s} |".format(mtd, capture_title + ' [estimated]'), file=output)
+
+    return nuc, output.getvalue()
+
+
+def _read_pka_nuclide_star(args):
+    return read_pka_nuclide(*args)
+
+
+# read_pka_nuclide() in a worker of a process pool, the cache index changes are sent to the parent process
+# @return (nuc, log, cache_changes)
+def _read_pka_nuclide_in_worker(inp, i):
+    nuc, log = read_pka_nuclide(inp, i)
+    pka_cache = _open_pka_sources(inp)[0]
+    return nuc, log, None if pka_cache is None else pka_cache.take_changes()
+
+
+def _read_pka_nuclide_in_worker_star(args):
+    return _read_pka_nuclide_in_worker(*args)
+
+
+# Merge the cache index changes of a worker into the cache of this process
+def _merge_cache_changes(inp, cache_changes):
+    pka_cache = _open_pka_sources(inp)[0]
+    if pka_cache is not None and cache_changes:
+        pka_cache.merge(cache_changes)
+
+
+# Write the cache index changes of this process once, after the pka files have been read
+def _flush_pka_cache(inp):
+    pka_cache = _open_pka_sources(inp)[0]
+    if pka_cache is not None:
+        pka_cache.flush()
+
+
+# Use fork where it exists, the workers get the imported modules for free. The entry points have
+# __main__ guards, so spawn and forkserver are safe too.
+# multiprocessing and concurrent.futures are only imported when a process pool is used
+def process_pool(num_processes, initializer=None, initargs=()):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+    return ProcessPoolExecutor(max_workers=num_processes, mp_context=context, initializer=initializer,
+                               initargs=initargs)
+
+
+# Read all the pka files of input, in a process pool if inp.num_processes > 1
+# The memory-mapped pka library is always read in this process, there is nothing to parse
+# @return nuclides - in the same order as input
+def read_pka_nuclides(inp, file_object=sys.stdout):
+    tasks = [(inp, i) for i in range(inp.number_pka_files)]
+    num_processes = min(inp.num_processes, len(tasks))
+    if num_processes > 1 and inp.pka_library is None:
+        with process_pool(num_processes) as executor:
+            nuclides = []
+            for nuc, log, cache_changes in executor.map(_read_pka_nuclide_in_worker_star, tasks):
+                _merge_cache_changes(inp, cache_changes)
+                print(log, end='', file=file_object)
+                nuclides.append(nuc)
+    else:
+        nuclides = _collect_results(map(_read_pka_nuclide_star, tasks), file_object)
+    _flush_pka_cache(inp)
+    return nuclides
+
+
+def _collect_results(results, file_object):
+    nuclides = []
+    for nuc, log in results:
+        print(log, end='', file=file_object)
+        nuclides.append(nuc)
+    return nuclides
+
+
+# Size of the i-th pka file, as the estimate of its memory when read
+def _pka_file_bytes(inp, i):
+    try:
+        return os.path.getsize(inp.pka_files[i]['pka_filename'])
+    except (KeyError, OSError):
+        return 0
+
+
+# Yield the nuclides of all the pka files of input one by one, in input order
+# In a process pool, files are submitted while the in-flight file sizes fit in inp.memory_budget (MB);
+# a file larger than the budget is read alone
+def iter_pka_nuclides(inp, file_object=sys.stdout):
+    num_tasks = inp.number_pka_files
+    num_processes = min(inp.num_processes, num_tasks)
+    if num_processes <= 1 or inp.pka_library is not None:
+        try:
+            for i in range(num_tasks):
+                nuc, log = read_pka_nuclide(inp, i)
+                print(log, end='', file=file_object)
+                yield nuc
+        finally:
+            _flush_pka_cache(inp)
+        return
+
+    budget = float('inf') if inp.memory_budget is None else inp.memory_budget * 1024 * 1024
+    with process_pool(num_processes) as executor:
+        pending = deque()       # (future, bytes), in input order
+        in_flight = 0
+        i = 0
+        try:
+            while i < num_tasks or pending:
+                while i < num_tasks and len(pending) < num_processes and \
+                        (not pending or in_flight + _pka_file_bytes(inp, i) <= budget):
+                    size = _pka_file_bytes(inp, i)
+                    pending.append((executor.submit(_read_pka_nuclide_in_worker, inp, i), size))
+                    in_flight += size
+                    i += 1
+                future, size = pending.popleft()
+                nuc, log, cache_changes = future.result()
+                _merge_cache_changes(inp, cache_changes)
+                in_flight -= size
+                print(log, end='', file=file_object)
+                yield nuc
+        finally:
+            _flush_pka_cache(inp)
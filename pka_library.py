@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""
+Indexed, memory-mapped container of a whole pka library.
+
+All the pka files (SPECTER-PKA format) of a directory are converted into one
+library file. Layout of the file (all numbers are little endian):
+
+    0   8 bytes   magic 'GPKALIB1'
+    8   uint64    byte offset of the index
+    16  uint64    byte length of the index
+    64  ...       arrays, each one aligned to 8 bytes
+    ... index     utf-8 json
+
+The index maps nuclide -> projectile -> {energy group structure, channels,
+(n,g) cross section}. The channels of a nuclide are stored transposed, as one
+stacked CSR operator (a row block per channel, as Nuclide.recoil_operators),
+given by the byte offsets of its 'indptr' (int32), 'indices' (int32) and
+'data' (float64) arrays; each channel gives its first row and nonzero. The
+library is opened with a memory map, the matrices are views into it and only
+the touched pages are read from disk. Consecutive channels are adjacent in
+the arrays, so their stacked operator is also a view, without copy.
+
+    python pka_library.py build <pka_directory> <library_file> [--pattern PATTERN]
+    python pka_library.py inspect <library_file>
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+import argparse
+import fnmatch
+import json
+import os
+import re
+import struct
+import sys
+
+import numpy as np
+import scipy.sparse as sp
+
+from nuclide import Nuclide
+from read_pka_file import read_pka_file
+
+_magic = b'GPKALIB1'
+_preamble = struct.Struct('<8sQQ')
+_data_start = 64
+_library_version = 2
+
+# SPECTER-PKA file name, such as 'Zr090s.asc', 'Ag107s-a.asc' or 'Am242ms-p.asc'
+_pka_filename = re.compile(r'^([A-Za-z]+)(\d+)(m?)s(?:-([a-z]))?\.asc$')
+
+
+# Nuclide name of the library index, such as 'Zr-90' or 'Am-242m'
+def library_nuclide_name(nuc_id):
+    if type(nuc_id) is str and nuc_id.lower().endswith('m'):
+        return Nuclide(nuc_id[:-1]).name + 'm'
+    return Nuclide(nuc_id).name
+
+
+# Get the nuclide name and the projectile from the pka file name
+# @return (name, projectile) or None if the file name is not a pka file
+def parse_pka_filename(filename):
+    m = _pka_filename.match(os.path.basename(filename))
+    if m is None:
+        return None
+    element, mass, meta, projectile = m.groups()
+    return library_nuclide_name(element + mass + meta), projectile or 'n'
+
+
+class _LibraryWriter:
+    """
+    Write arrays into the library file, keep the 8 bytes alignment.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.f.write(b'\0' * _data_start)
+
+    def write_array(self, array, dtype):
+        array = np.ascontiguousarray(array, dtype=dtype)
+        offset = self.f.tell()
+        self.f.write(array.tobytes())
+        padding = -self.f.tell() % 8
+        if padding:
+            self.f.write(b'\0' * padding)
+        return offset
+
+    def close(self, index):
+        index_bytes = json.dumps(index).encode('utf-8')
+        index_offset = self.f.tell()
+        self.f.write(index_bytes)
+        self.f.seek(0)
+        self.f.write(_preamble.pack(_magic, index_offset, len(index_bytes)))
+
+
+# Convert all the pka files into one library file
+def build_pka_library(filenames, library_file, file_object=sys.stdout):
+    index = {'version': _library_version, 'nuclides': {}}
+    with open(library_file, 'wb') as f:
+        writer = _LibraryWriter(f)
+        for filename in filenames:
+            name, projectile = parse_pka_filename(filename)
+            num_egs, pka_e_array, matrices, (ng_title, ng_mtd, ng_xs) = read_pka_file(filename)
+
+            entry = {'file': os.path.basename(filename),
+                     'num_egs': num_egs,
+                     'energy': writer.write_array(pka_e_array, '<f8'),
+                     'channels': [],
+                     'operator': None,
+                     'ng': None}
+            # Transposed recoil matrices of all channels, stacked into one CSR operator
+            blocks = [A.T.tocsr() for title, mtd, A in matrices]
+            row, start = 0, 0
+            for (title, mtd, A), block in zip(matrices, blocks):
+                entry['channels'].append({'title': title,
+                                          'mtd': mtd,
+                                          'shape': list(A.shape),
+                                          'nnz': int(block.nnz),
+                                          'row': row,
+                                          'start': start})
+                row += block.shape[0]
+                start += block.nnz
+            operator = sp.vstack(blocks, format='csr') if blocks else sp.csr_matrix((0, 0))
+            entry['operator'] = {'rows': int(operator.shape[0]),
+                                 'nnz': int(operator.nnz),
+                                 'indptr': writer.write_array(operator.indptr, '<i4'),
+                                 'indices': writer.write_array(operator.indices, '<i4'),
+                                 'data': writer.write_array(operator.data, '<f8')}
+            if ng_xs is not None:
+                entry['ng'] = {'title': ng_title, 'mtd': ng_mtd, 'size': int(ng_xs.shape[0]),
+                               'data': writer.write_array(ng_xs, '<f8')}
+
+            index['nuclides'].setdefault(name, {})[projectile] = entry
+            print("\t{0:10s} {1:2s} {2:4d} channels  [{3}]".format(name, projectile, len(matrices), filename),
+                  file=file_object)
+        writer.close(index)
+    return index
+
+
+class PKALibrary:
+    """
+    Read only, memory mapped pka library.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.buffer = np.memmap(filename, dtype=np.uint8, mode='r')
+        magic, index_offset, index_length = _preamble.unpack(bytes(self.buffer[:_preamble.size]))
+        if magic != _magic:
+            raise ValueError("{} is not a G-PKA library file!".format(filename))
+        index = json.loads(bytes(self.buffer[index_offset:index_offset + index_length]).decode('utf-8'))
+        if index.get('version') != _library_version:
+            raise ValueError("Version of G-PKA library file {} is not supported, rebuild it with "
+                             "'pka_library.py build'!".format(filename))
+        self.nuclides = index['nuclides']
+
+    def _array(self, offset, count, dtype):
+        dtype = np.dtype(dtype)
+        return self.buffer[offset:offset + count * dtype.itemsize].view(dtype)
+
+    def entry(self, nuclide, projectile='n'):
+        name = library_nuclide_name(nuclide)
+        try:
+            return self.nuclides[name][projectile]
+        except KeyError:
+            raise KeyError("Nuclide {} with projectile '{}' is not in library {}!".format(
+                name, projectile, self.filename))
+
+    # Recoil matrix of one channel of entry, the transpose (CSC) of its row block of the stacked operator.
+    # Indices and data are views of the memory map, only the indptr of the block is built
+    def channel_matrix(self, entry, channel):
+        operator = entry['operator']
+        rows = channel['shape'][1]
+        indptr = self._array(operator['indptr'], operator['rows'] + 1, '<i4')[channel['row']:channel['row'] + rows + 1]
+        indices = self._array(operator['indices'], operator['nnz'], '<i4')[channel['start']:]
+        data = self._array(operator['data'], operator['nnz'], '<f8')[channel['start']:]
+        block = sp.csr_matrix((data[:channel['nnz']], indices[:channel['nnz']], indptr - channel['start']),
+                              shape=(rows, channel['shape'][0]), copy=False)
+        return block.T
+
+    # Same results as read_pka_file(), but without any parsing or copy
+    def read_pka_file(self, nuclide, projectile='n'):
+        entry = self.entry(nuclide, projectile)
+        num_egs = entry['num_egs']
+        pka_e_array = self._array(entry['energy'], num_egs + 1, '<f8')
+        matrices = [(channel['title'], channel['mtd'], self.channel_matrix(entry, channel))
+                    for channel in entry['channels']]
+        ng = entry['ng']
+        if ng is None:
+            ng_info = (None, None, None)
+        else:
+            ng_info = (ng['title'], ng['mtd'], self._array(ng['data'], ng['size'], '<f8'))
+        return num_egs, pka_e_array, matrices, ng_info
+
+    def inspect(self, file_object=sys.stdout):
+        print("Library file: {}".format(os.path.abspath(self.filename)), file=file_object)
+        for name in sorted(self.nuclides, key=lambda x: Nuclide(x.rstrip('m'))):
+            for projectile, entry in sorted(self.nuclides[name].items()):
+                nnz = entry['operator']['nnz']
+                print("\t{0:10s} {1:2s} {2:4d} groups {3:4d} channels {4:10d} nnz  [{5}]".format(
+                      name, projectile, entry['num_egs'], len(entry['channels']), nnz, entry['file']),
+                      file=file_object)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Indexed, memory-mapped pka library.')
+    subparsers = parser.add_subparsers(dest='command')
+    parser_build = subparsers.add_parser('build', help='convert a directory of pka files into a library')
+    parser_build.add_argument('directory')
+    parser_build.add_argument('library')
+    parser_build.add_argument('--pattern', default='*.asc')
+    parser_inspect = subparsers.add_parser('inspect', help='list the contents of a library')
+    parser_inspect.add_argument('library')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        filenames = sorted(os.path.join(args.directory, name) for name in os.listdir(args.directory)
+                           if fnmatch.fnmatch(name, args.pattern) and parse_pka_filename(name) is not None)
+        print(">>> BUILD PKA LIBRARY [{}] FROM {} FILES".format(args.library, len(filenames)))
+        build_pka_library(filenames, args.library)
+    elif args.command == 'inspect':
+        PKALibrary(args.library).inspect()
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+"""
+Mesh mode: pka and dpa maps of many flux cells.
+
+The mesh flux file has one group spectrum per cell, as a (cells, groups)
+.npy array (memory-mapped) or a text file with one cell per line. The
+cells are evaluated in chunks of 'mesh_chunk_size': each chunk is one batch
+of spectra, collapsed by the sparse stacked recoil operators of the loaded
+pka data (sparse x dense over the cell block), in a process pool if
+'num_processes' > 1. The per cell results are written into memory-mapped
+.npy files of the directory 'mesh_output', so that the memory is bounded by
+the chunk size, not by the mesh size:
+
+    total_pka.npy, total_dpa.npy                - SIZE (cells)
+    <nuclide|element>_total_pka.npy             - SIZE (cells, products)
+    <nuclide|element>_average_pka_energy.npy    - SIZE (cells, products), in eV
+    <nuclide|element>_total_nrt_dpa.npy         - SIZE (cells, products)
+    total_pka_spectrum.npy                      - SIZE (cells, groups), with 'mesh_groups'
+    <nuclide|element>_names.npy, energy_group.npy
+
+The mesh fluxes are absolute (per cm^2), multiplied by 'mesh_flux_factor',
+they are not normalized to 'flux_rescale_value'.
+
+With 'result_store', the group-resolved pka, displacement cross section and
+dpa of each cell are also added straight into a ResultStore (see pka_store),
+one case per cell.
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+import atexit
+import itertools
+import os
+import sys
+
+import numpy as np
+
+from input import normalize_flux_spectrum, read_specter_flux_file
+from pka_accumulator import PKAAccumulator, product_index
+from pka_engine import PKAEngine
+from pka_store import ResultStore
+
+_mesh_state = {}
+
+
+class MeshFlux:
+    """
+    Flux of each mesh cell, read by chunks of cells: .npy (memory-mapped) or text (one cell per line).
+    """
+
+    def __init__(self, filename, energy_group):
+        self.filename = filename
+        self.energy_group = np.asarray(energy_group, dtype=float)
+        num_groups = self.energy_group.shape[0] - 1
+        if filename.endswith('.npy'):
+            self._array = np.load(filename, mmap_mode='r')
+            assert (self._array.ndim == 2 and self._array.shape[1] == num_groups), \
+                "Mesh flux {} must be an array of (cells, {}) values!".format(filename, num_groups)
+            self.num_cells = self._array.shape[0]
+        else:
+            self._array = None
+            with open(filename) as f:
+                self.num_cells = sum(1 for line in self._data_lines(f))
+
+    @staticmethod
+    def _data_lines(f):
+        return (line for line in f if line.strip() and not line.lstrip().startswith('#'))
+
+    # @return (first cell, flux - np.array SIZE (cells of chunk, groups)) of each chunk
+    def chunks(self, chunk_size):
+        if self._array is not None:
+            for start in range(0, self.num_cells, chunk_size):
+                yield start, np.array(self._array[start:start + chunk_size], dtype=float)
+            return
+        with open(self.filename) as f:
+            lines = self._data_lines(f)
+            start = 0
+            while True:
+                block = list(itertools.islice(lines, chunk_size))
+                if not block:
+                    return
+                flux = np.loadtxt(block, ndmin=2)
+                assert (flux.shape[1] == self.energy_group.shape[0] - 1), \
+                    "Mesh flux {} must have {} groups in each line!".format(self.filename,
+                                                                          self.energy_group.shape[0] - 1)
+                yield start, flux
+                start += flux.shape[0]
+
+
+# Energy group of the mesh flux: 'mesh_energy_group' (list or file), else that of 'flux_filename'
+def mesh_energy_group(inp):
+    if inp.mesh_energy_group is None:
+        return read_specter_flux_file(inp.infile_flux_name)[1]
+    if type(inp.mesh_energy_group) is str:
+        if inp.mesh_energy_group.endswith('.npy'):
+            return np.load(inp.mesh_energy_group)
+        return np.loadtxt(inp.mesh_energy_group).ravel()
+    return np.asarray(inp.mesh_energy_group, dtype=float)
+
+
+# Per cell results of one chunk of cells, the group results are added into the cases [start, ...) of store
+# @return {name: np.array - SIZE (cells of chunk, ...)}, {kind: product names}
+def evaluate_cells(engine, flux, energy_group, store=None, start=0):
+    inp = engine.inp
+    flux_spectrum, flux_unit = normalize_flux_spectrum(flux, inp.mesh_flux_unit, energy_group, None)
+    flux_spectrum *= inp.mesh_flux_factor
+    accumulator = None if store is None else PKAAccumulator.for_store(store, start, start + flux.shape[0])
+    result = engine.run(flux_spectrum, flux_unit, energy_group, flux_names=range(flux.shape[0]),
+                        accumulator=accumulator)
+
+    arrays = {}
+    names = {}
+    for kind in ('nuclide', 'element'):
+        columns = result.columns(kind)
+        names[kind] = columns['names']
+        arrays[kind + '_total_pka'] = np.sum(columns['pka'], axis=-1).T
+        arrays[kind + '_average_pka_energy'] = columns['average_pka_energy'].T
+        if inp.do_damage:
+            arrays[kind + '_total_nrt_dpa'] = columns['total_nrt_dpa'].T
+    arrays['total_pka'] = np.sum(arrays['element_total_pka'], axis=1)
+    if inp.do_damage:
+        arrays['total_dpa'] = np.sum(arrays['element_total_nrt_dpa'], axis=1)
+    if inp.mesh_groups:
+        arrays['total_pka_spectrum'] = result.total_pka_spectrum()
+    return arrays, names
+
+
+def _init_mesh_worker(inp):
+    # Forked workers have the engine of the parent process, the others read the pka data once.
+    # Their output is not printed, devnull is open as long as the worker process
+    if 'engine' not in _mesh_state:
+        devnull = open(os.devnull, 'w')
+        atexit.register(devnull.close)
+        engine = PKAEngine(file_object=devnull, inp=inp)
+        engine.load_nuclides()
+        _mesh_state['engine'] = engine
+    if inp.result_store is not None and 'store' not in _mesh_state:
+        _mesh_state['store'] = ResultStore(inp.result_store, 'r+')
+
+
+def _evaluate_chunk(start, flux, energy_group):
+    store = _mesh_state.get('store')
+    arrays, names = evaluate_cells(_mesh_state['engine'], flux, energy_group, store, start)
+    if store is not None:
+        store.flush()
+    return start, arrays, names
+
+
+class MeshResultWriter:
+    """
+    Per cell result arrays, memory-mapped .npy files of one directory, opened with the first chunk.
+    """
+
+    def __init__(self, directory, num_cells, energy_group):
+        self.directory = directory
+        self.num_cells = num_cells
+        self.names = None
+        self._arrays = {}
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'energy_group.npy'), energy_group)
+
+    def write(self, start, arrays, names):
+        if self.names is None:
+            self.names = names
+            for kind, kind_names in names.items():
+                np.save(os.path.join(self.directory, kind + '_names.npy'), kind_names)
+        assert (all(np.array_equal(self.names[kind], names[kind]) for kind in names)), \
+            "Products of the chunks differ!"
+        for name, values in arrays.items():
+            if name not in self._arrays:
+                self._arrays[name] = np.lib.format.open_memmap(os.path.join(self.directory, name + '.npy'),
+                                                               mode='w+', dtype=float,
+                                                               shape=(self.num_cells,) + values.shape[1:])
+            self._arrays[name][start:start + values.shape[0]] = values
+
+    def close(self):
+        for array in self._arrays.values():
+            array.flush()
+        self._arrays = {}
+
+
+# Evaluate the cells chunk by chunk, the runs of the chunks print into cell_file_object
+def _run_mesh_chunks(engine, cell_file_object):
+    inp = engine.inp
+    file_object = engine.file_object
+    energy_group = mesh_energy_group(inp)
+    mesh = MeshFlux(inp.mesh_filename, energy_group)
+    nuclides = engine.load_nuclides()
+    print("\n\n>>> START MESH CALCULATION [{}]: {} cells, chunks of {}, {} process(es)".format(
+          inp.mesh_filename, mesh.num_cells, inp.mesh_chunk_size, inp.num_processes), file=file_object)
+
+    cell_engine = PKAEngine(file_object=cell_file_object, inp=inp)
+    cell_engine.nuclides = nuclides
+    writer = MeshResultWriter(inp.mesh_output, mesh.num_cells, nuclides[0].recoil_energy_group_struc)
+    store = None
+    if inp.result_store is not None:
+        # Cells of each chunk are written into their own cases, also by the worker processes
+        store = ResultStore.create(inp.result_store, mesh.num_cells, nuclides[0].recoil_energy_group_struc,
+                                   product_index(nuclides), inp.do_damage)
+    done = 0
+    reported = 0
+    chunks = mesh.chunks(inp.mesh_chunk_size)
+    if inp.num_processes > 1:
+        from concurrent.futures import wait, FIRST_COMPLETED
+        from pka_ingest import process_pool
+        _mesh_state['engine'] = cell_engine
+        if store is not None:
+            _mesh_state['store'] = store
+        try:
+            with process_pool(inp.num_processes, _init_mesh_worker, (inp,)) as executor:
+                pending = set()
+                for start, flux in itertools.chain(chunks, [(None, None)]):
+                    if start is not None:
+                        pending.add(executor.submit(_evaluate_chunk, start, flux, energy_group))
+                    # Bounded number of chunks in flight
+                    while pending and (start is None or len(pending) >= 2 * inp.num_processes):
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            chunk_start, arrays, names = future.result()
+                            writer.write(chunk_start, arrays, names)
+                            done += arrays['total_pka'].shape[0]
+                        reported = _report_progress(done, reported, mesh.num_cells, file_object)
+        finally:
+            _mesh_state.clear()
+    else:
+        for start, flux in chunks:
+            arrays, names = evaluate_cells(cell_engine, flux, energy_group, store, start)
+            writer.write(start, arrays, names)
+            done += flux.shape[0]
+            reported = _report_progress(done, reported, mesh.num_cells, file_object)
+    writer.close()
+    print(">>> MESH RESULTS WRITTEN INTO [{}]".format(inp.mesh_output), file=file_object)
+    if store is not None:
+        store.close()
+        print(">>> MESH GROUP RESULTS WRITTEN INTO STORE [{}]".format(inp.result_store), file=file_object)
+    return writer
+
+
+# Evaluate all cells of the mesh flux file of input, with the pka data of engine
+# @return MeshResultWriter - directory and product names of the results
+def run_mesh(engine):
+    inp = engine.inp
+    assert (not inp.projectile_fluxes), "Mesh mode has one flux per cell, 'projectile_fluxes' is not supported!"
+    # The pka data are kept for all the chunks, results are only written per cell. Streaming is off for
+    # this run, the options of input are restored at the end
+    streaming, stream_output = inp.streaming, inp.stream_output
+    inp.streaming = False
+    inp.stream_output = []
+    try:
+        # Per chunk run output is not printed
+        with open(os.devnull, 'w') as devnull:
+            writer = _run_mesh_chunks(engine, devnull)
+    finally:
+        inp.streaming, inp.stream_output = streaming, stream_output
+    return writer
+
+
+def _report_progress(done, reported, num_cells, file_object=sys.stdout):
+    if done * 10 // max(num_cells, 1) > reported * 10 // max(num_cells, 1) or done == num_cells:
+        print("\t{} / {} cells".format(done, num_cells), file=file_object)
+        return done
+    return reported
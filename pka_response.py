@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""
+Precomputed response vectors of a composition.
+
+For a fixed composition and damage model, every result of G-PKA is linear
+in the pka flux. The recoil matrices, contracted with the damage coefficients
+(or 1, or the recoil energy) and weighted by 'pka_ratios', are reduced once
+into response vectors over the incident energy groups:
+
+    pka         - PKA rate of each element
+    pka_energy  - numerator of the average PKA energy of each element (eV)
+    damage      - displacement cross section of each element
+    dpa         - NRT dpa of each element
+    total_dpa   - total NRT dpa
+
+Results of a new flux are then one dot product, the pka files are not read.
+
+    python pka_response.py build [input.json]
+    python pka_response.py eval <input.json> <flux_file> [<flux_file> ...]
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from input import Input
+from pka_ingest import read_pka_nuclides
+from utility_pka import set_up_recoil_nuclides, get_damage_coeffs_array, global_channel_masks, \
+    interpolate_flux_pka_from_input
+
+_quantities = ('pka', 'pka_energy', 'damage', 'dpa')
+
+
+# Response file is saved next to the input file: 'input.json' -> 'input_response.npz'
+def response_filename(input_file):
+    return os.path.splitext(input_file)[0] + '_response.npz'
+
+
+class PKAResponse:
+    """
+    Response vectors over the pka incident energy group.
+    """
+
+    def __init__(self, energy_group, element_names, responses, flux_rescale_value=1.0, rebin_method='interpolate'):
+        self.energy_group = energy_group            # np.array - SIZE (groups + 1), pka incident energy group
+        self.element_names = list(element_names)
+        self.responses = responses                  # {quantity: np.array - SIZE (groups, elements)}
+        self.flux_rescale_value = flux_rescale_value
+        self.rebin_method = rebin_method            # Flux into pka energy group, see utility_rebin
+
+    # Reduce the recoil matrices of all nuclides into response vectors
+    # nuclides must have been read by read_pka_nuclides()
+    @classmethod
+    def build(cls, nuclides, do_damage=True, flux_rescale_value=1.0, rebin_method='interpolate'):
+        energy_group = nuclides[0].recoil_energy_group_struc
+        emid = 0.5 * 1.E+6 * (energy_group[:-1] + energy_group[1:])     # in eV
+        num_groups = energy_group.shape[0] - 1
+
+        for nuc in nuclides:
+            assert (np.array_equal(nuc.recoil_energy_group_struc, energy_group)), \
+                "Response needs the same pka energy group for all nuclides, {} is different!".format(nuc.name)
+            set_up_recoil_nuclides(nuc)
+            nuc.stack_recoil_matrices()
+
+        masks = global_channel_masks(nuclides)
+        element_names = []
+        for nuc, (to_nuclide, to_element) in zip(nuclides, masks):
+            for k, nuc_recoil in enumerate(nuc.recoil_nuclides):
+                if to_element[k] and nuc_recoil.element not in element_names:
+                    element_names.append(nuc_recoil.element)
+
+        responses = dict((q, np.zeros((num_groups, len(element_names)))) for q in _quantities)
+        for nuc, (to_nuclide, to_element) in zip(nuclides, masks):
+            # Weights of the recoil groups of each channel, a row block per channel as the recoil operator
+            num_channels = len(nuc.recoil_nuclides)
+            weights = dict((q, np.zeros((num_channels * num_groups, len(element_names)))) for q in _quantities)
+            for k, nuc_recoil in enumerate(nuc.recoil_nuclides):
+                if not to_element[k]:
+                    continue
+                rows = slice(k * num_groups, (k + 1) * num_groups)
+                column = element_names.index(nuc_recoil.element)
+                weights['pka'][rows, column] = nuc.ratio
+                weights['pka_energy'][rows, column] = nuc.ratio * emid
+                if do_damage:
+                    coeffs, ed = get_damage_coeffs_array(energy_group, (nuc_recoil.Z, nuc_recoil.A), (nuc.Z, nuc.A))
+                    weights['damage'][rows, column] = nuc.ratio * coeffs
+                    weights['dpa'][rows, column] = nuc.ratio * coeffs * 0.8 / (2. * ed)
+            row = 0
+            for operator in nuc.recoil_operators:
+                rows = slice(row, row + operator.shape[0])
+                for q in _quantities:
+                    responses[q] += operator.T.dot(weights[q][rows])
+                row += operator.shape[0]
+
+        return cls(energy_group, element_names, responses, flux_rescale_value, rebin_method)
+
+    # Results of flux (n s^{-1} MeV^{-1}, as Input.flux_spectrum), one or more spectra
+    # @return {quantity: np.array - SIZE ([spectra,] elements)}, with 'average_pka_energy' and 'total_dpa'
+    def evaluate(self, flux_spectrum, flux_unit, flux_energy_group):
+        flux_pka = interpolate_flux_pka_from_input(flux_spectrum, flux_unit, flux_energy_group, self.energy_group,
+                                                   self.rebin_method)
+        results = dict((q, flux_pka.dot(self.responses[q])) for q in _quantities)
+        results['average_pka_energy'] = np.divide(results['pka_energy'], results['pka'],
+                                                  out=np.zeros_like(results['pka']), where=results['pka'] != 0.)
+        results['total_pka'] = results['pka'].sum(axis=-1)
+        results['total_dpa'] = results['dpa'].sum(axis=-1)
+        return results
+
+    def save(self, filename):
+        arrays = dict(('response_' + q, self.responses[q]) for q in _quantities)
+        np.savez(filename, energy_group=self.energy_group, element_names=np.array(self.element_names, dtype=str),
+                 flux_rescale_value=np.array(self.flux_rescale_value), rebin_method=np.array(self.rebin_method),
+                 **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            responses = dict((q, data['response_' + q]) for q in _quantities)
+            rebin_method = str(data['rebin_method']) if 'rebin_method' in data else 'interpolate'
+            return cls(data['energy_group'], [str(name) for name in data['element_names']], responses,
+                       float(data['flux_rescale_value']), rebin_method)
+
+
+# The response is linear in one flux, mixed-field inputs (one flux per projectile) are not supported
+def _check_single_flux(inp):
+    assert (not inp.projectile_fluxes), "Response vectors have one flux, 'projectile_fluxes' is not supported!"
+
+
+# Read the input file and all the pka files, then build and save the response
+def build_response(input_file, file_object=sys.stdout):
+    inp = Input(input_file)
+    inp.read_infile(file_object)
+    _check_single_flux(inp)
+    print("\n\n>>> START READ PKA MATRIX FILES ...", file=file_object)
+    nuclides = read_pka_nuclides(inp, file_object)
+    print("\n\n>>> START BUILD RESPONSE ...", file=file_object)
+    response = PKAResponse.build(nuclides, inp.do_damage, inp.flux_rescale_value, inp.flux_rebin_method)
+    filename = response_filename(input_file)
+    response.save(filename)
+    print("--- FINISH BUILD RESPONSE [{}]".format(filename), file=file_object)
+    return response
+
+
+# Evaluate the saved response with flux files, no pka file is read
+def evaluate_response(input_file, flux_filenames, file_object=sys.stdout):
+    response = PKAResponse.load(response_filename(input_file))
+    inp = Input(input_file)
+    with open(os.devnull, 'w') as devnull:
+        inp.read_infile(devnull)
+        _check_single_flux(inp)
+        inp.infile_flux_name = list(flux_filenames)
+        inp.flux_rescale_value = response.flux_rescale_value
+        inp.read_flux(devnull)
+    results = response.evaluate(inp.flux_spectrum, inp.flux_unit, inp.flux_energy_group)
+
+    table = dict((q, np.atleast_2d(results[q])) for q in ('pka', 'average_pka_energy', 'damage', 'dpa'))
+    total_dpa = np.atleast_1d(results['total_dpa'])
+    for s, flux_name in enumerate(inp.flux_names):
+        print(">>> FLUX [{}]".format(flux_name), file=file_object)
+        print("\t{0:8s} {1:>12s} {2:>12s} {3:>12s} {4:>12s}".format(
+              'Element', 'PKAs', 'Ave E (eV)', 'Disp (eV/s)', 'NRT dpa'), file=file_object)
+        for e, name in enumerate(response.element_names):
+            print("\t{0:8s} {1:12.4E} {2:12.4E} {3:12.4E} {4:12.4E}".format(
+                  name, table['pka'][s, e], table['average_pka_energy'][s, e], table['damage'][s, e] * 1.E+6,
+                  table['dpa'][s, e]), file=file_object)
+        print("\tTotal NRT dpa: {0:12.4E}".format(total_dpa[s]), file=file_object)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Precomputed dpa/PKA response vectors.')
+    subparsers = parser.add_subparsers(dest='command')
+    parser_build = subparsers.add_parser('build', help='build the response of input file')
+    parser_build.add_argument('input', nargs='?', default='input.json')
+    parser_eval = subparsers.add_parser('eval', help='evaluate the response with flux files')
+    parser_eval.add_argument('input')
+    parser_eval.add_argument('flux', nargs='+')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        build_response(args.input)
+    elif args.command == 'eval':
+        evaluate_response(args.input, args.flux)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
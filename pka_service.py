@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+"""
+Long-running local PKA service.
+
+The pka data of one or more input files are read once, into one PKAEngine
+each, and kept in memory. Queries (a flux and optionally a composition) are
+answered over HTTP, on localhost or on a Unix socket, each request in its own
+thread:
+
+    python pka_service.py input.json [more.json ...] [--port 8765 | --socket /tmp/gpka.sock]
+
+    POST /pka       - JSON query, see PKAService.query()
+    GET  /metrics   - number of requests, warm hit ratio, cache counters, latency
+    GET  /health    - inputs served
+
+Queries of the same input are run one at a time (the parent nuclides hold the
+collapsed spectra of the running query), queries of different inputs run in
+parallel. Nothing is written into files by the service.
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+import argparse
+import http.client
+import http.server
+import json
+import math
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import numpy as np
+
+from input import Input, normalize_flux_spectrum, read_specter_flux_file
+from pka_engine import PKAEngine
+from utility_pka import damage_coeffs_cache
+from utility_rebin import rebin_operator_cache
+
+_default_port = 8765
+_flux_units = ('n s^{-1}', 'n s^{-1} MeV^{-1}')
+
+
+class ServiceError(Exception):
+    """
+    Bad query, answered with HTTP status 400.
+    """
+
+
+class PKAService:
+    """
+    Warm PKA engines of several input files, and the query metrics.
+    """
+
+    def __init__(self, input_files, file_object=None, preload=True):
+        self.file_object = open(os.devnull, 'w') if file_object is None else file_object
+        self.engines = {}           # input name -> PKAEngine
+        self.locks = {}             # input name -> threading.Lock, one query at a time for each engine
+        for input_file in input_files:
+            inp = Input(input_file)
+            inp.read_infile(self.file_object)
+            # All parent nuclides are kept in memory and no result file is written
+            inp.streaming = False
+            inp.stream_output = []
+            self.engines[input_file] = PKAEngine(file_object=self.file_object, inp=inp)
+            # The flux of input is the default flux of queries
+            if inp.infile_flux_name is not None:
+                self.engines[input_file].read_flux()
+            self.locks[input_file] = threading.Lock()
+
+        self._metrics_lock = threading.Lock()
+        self.num_requests = 0
+        self.num_errors = 0
+        self.warm_hits = 0          # Queries served by an engine with the pka data already in memory
+        self.warm_misses = 0        # Queries which had to read the pka data first
+        self.total_time = 0.        # in s, of all answered queries
+        self.started = time.time()
+        if preload:
+            for name in self.engines:
+                self.load(name)
+
+    def load(self, name):
+        with self.locks[name]:
+            self.engines[name].load_nuclides()
+
+    def _engine_name(self, query):
+        name = query.get('input')
+        if name is None:
+            if len(self.engines) > 1:
+                raise ServiceError("'input' is needed, one of {}".format(list(self.engines)))
+            return next(iter(self.engines))
+        if name not in self.engines:
+            raise ServiceError("Unknown input '{}', one of {}".format(name, list(self.engines)))
+        return name
+
+    # Flux of a query, same normalization as Input.read_flux()
+    # @return (flux_spectrum, flux_unit, flux_energy_group, flux_names)
+    @staticmethod
+    def _query_flux(query, inp):
+        rescale_value = query.get('flux_rescale_value', inp.flux_rescale_value)
+        if 'flux_filename' in query:
+            try:
+                flux_unit, flux_energy_group, flux_spectra = read_specter_flux_file(query['flux_filename'])
+            except (OSError, IndexError, ValueError) as e:
+                raise ServiceError("Cannot read flux file '{}' in SPECTER format: {}".format(
+                                   query['flux_filename'], e))
+            flux_names = [query['flux_filename']] if flux_spectra.shape[0] == 1 else \
+                ['{}:{}'.format(query['flux_filename'], k + 1) for k in range(flux_spectra.shape[0])]
+            if flux_spectra.shape[0] == 1:
+                flux_spectra = flux_spectra[0]
+        elif 'flux' in query:
+            flux = query['flux']
+            try:
+                flux_energy_group = np.array(flux['energy_group'], dtype=float)
+                flux_spectra = np.array(flux['spectrum'], dtype=float)
+            except (KeyError, TypeError, ValueError):
+                raise ServiceError("'flux' needs 'energy_group' and 'spectrum' arrays")
+            flux_unit = flux.get('unit', 'n s^{-1}')
+            if flux_unit not in _flux_units:
+                raise ServiceError("Unknown flux unit '{}', one of {}".format(flux_unit, _flux_units))
+            if flux_spectra.ndim not in (1, 2) or flux_spectra.shape[-1] != flux_energy_group.shape[0] - 1:
+                raise ServiceError("'spectrum' must have {} values (or rows of them), one per group".format(
+                                   flux_energy_group.shape[0] - 1))
+            flux_names = flux.get('names')
+        else:
+            return inp.flux_spectrum, inp.flux_unit, inp.flux_energy_group, inp.flux_names
+
+        flux_spectrum, flux_unit = normalize_flux_spectrum(flux_spectra, flux_unit, flux_energy_group,
+                                                           rescale_value)
+        return flux_spectrum, flux_unit, flux_energy_group, flux_names
+
+    # Answer one query:
+    #   {"input": "input.json",                 # needed if the service has more than one input
+    #    "flux": {"energy_group": [...], "spectrum": [...] or [[...], ...], "unit": "n s^{-1}"},
+    #                                           # or "flux_filename": "...", default the flux of input
+    #    "flux_rescale_value": 1.e+14,          # default that of input
+    #    "composition": {"Ag-107": 0.5, ...},   # default the 'pka_ratios' of input
+    #    "groups": false}                       # also return the spectra of each group
+    # @return dict, the summary of elements and nuclides (see PKAAccumulator.columns)
+    def query(self, query):
+        start = time.perf_counter()
+        try:
+            if not isinstance(query, dict):
+                raise ServiceError("Query must be a JSON object")
+            name = self._engine_name(query)
+            engine = self.engines[name]
+            composition = query.get('composition')
+            if composition is not None and not isinstance(composition, dict):
+                raise ServiceError("'composition' must be an object of parent nuclide: ratio")
+            if composition is not None:
+                for parent, ratio in composition.items():
+                    if type(ratio) not in (int, float) or not math.isfinite(ratio):
+                        raise ServiceError("Ratio of '{}' in 'composition' must be a finite number, not {}".format(
+                                           parent, json.dumps(ratio)))
+
+            with self.locks[name]:
+                warm = engine.nuclides is not None
+                nuclides = engine.load_nuclides()
+                if composition is not None:
+                    unknown = set(composition) - set(nuc.name for nuc in nuclides)
+                    if unknown:
+                        raise ServiceError("Parent nuclides not in '{}': {}".format(name, sorted(unknown)))
+                flux_spectrum, flux_unit, flux_energy_group, flux_names = self._query_flux(query, engine.inp)
+                if flux_spectrum is None:
+                    raise ServiceError("No flux in query and in input '{}'".format(name))
+                # The flux of a query is used for all pka files, that of input keeps its projectile fluxes
+                projectile_fluxes = None if 'flux' in query or 'flux_filename' in query else \
+                    engine.inp.projectile_flux_spectra
+                result = engine.run(flux_spectrum, flux_unit, flux_energy_group, flux_names, composition,
+                                    projectile_fluxes=projectile_fluxes)
+                response = self._response(name, result, query.get('groups', False))
+        except Exception:
+            with self._metrics_lock:
+                self.num_requests += 1
+                self.num_errors += 1
+            raise
+
+        elapsed = time.perf_counter() - start
+        with self._metrics_lock:
+            self.num_requests += 1
+            self.total_time += elapsed
+            if warm:
+                self.warm_hits += 1
+            else:
+                self.warm_misses += 1
+        response['elapsed_ms'] = elapsed * 1.E+3
+        response['warm'] = warm
+        return response
+
+    @staticmethod
+    def _response(name, result, groups):
+        response = {'input': name, 'flux_names': result.flux_names}
+        if groups:
+            response['energy_group'] = result.energy_group.tolist()
+            response['total_pka_spectrum'] = result.total_pka_spectrum().tolist()
+        for kind in ('element', 'nuclide'):
+            columns = result.columns(kind)
+            summary = {'names': columns['names'].tolist(),
+                       'total_pka': np.sum(columns['pka'], axis=-1).tolist(),
+                       'average_pka_energy': columns['average_pka_energy'].tolist()}
+            for column in ('displacement_energy', 'total_nrt_dpa'):
+                if column in columns:
+                    summary[column] = columns[column].tolist()
+            if groups:
+                for column in ('pka', 'nrt_dpa'):
+                    if column in columns:
+                        summary[column] = columns[column].tolist()
+            response[kind + 's'] = summary
+        return response
+
+    def metrics(self):
+        with self._metrics_lock:
+            answered = self.num_requests - self.num_errors
+            warm_total = self.warm_hits + self.warm_misses
+            metrics = {'requests': self.num_requests,
+                       'errors': self.num_errors,
+                       'warm_hits': self.warm_hits,
+                       'warm_misses': self.warm_misses,
+                       'warm_hit_ratio': self.warm_hits / warm_total if warm_total else None,
+                       'mean_latency_ms': self.total_time / answered * 1.E+3 if answered else None,
+                       'uptime_s': time.time() - self.started}
+        for cache_name, cache in (('rebin_operator_cache', rebin_operator_cache),
+                                  ('damage_coeffs_cache', damage_coeffs_cache)):
+            total = cache.hits + cache.misses
+            metrics[cache_name] = {'hits': cache.hits, 'misses': cache.misses,
+                                   'hit_ratio': cache.hits / total if total else None}
+        metrics['inputs'] = {name: {'warm': engine.nuclides is not None,
+                                    'parent_nuclides': 0 if engine.nuclides is None else len(engine.nuclides)}
+                             for name, engine in self.engines.items()}
+        return metrics
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+    server_version = 'G-PKA'
+    protocol_version = 'HTTP/1.1'
+
+    # Unix socket peers have no address
+    def address_string(self):
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == '/metrics':
+            self._send_json(200, service.metrics())
+        elif self.path == '/health':
+            self._send_json(200, {'status': 'ok', 'inputs': list(service.engines)})
+        else:
+            self._send_json(404, {'error': 'Unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path != '/pka':
+            self._send_json(404, {'error': 'Unknown path {}'.format(self.path)})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            query = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as e:
+            self._send_json(400, {'error': 'Bad JSON: {}'.format(e)})
+            return
+        try:
+            self._send_json(200, self.server.service.query(query))
+        except ServiceError as e:
+            self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            self._send_json(500, {'error': '{}: {}'.format(type(e).__name__, e)})
+
+
+class _TCPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+# HTTP server of the service, on localhost:port or on the Unix socket socket_path
+def make_server(service, port=_default_port, socket_path=None, verbose=False):
+    if socket_path is None:
+        server = _TCPServer(('127.0.0.1', port), _RequestHandler)
+    else:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = _UnixServer(socket_path, _RequestHandler)
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+# Client of the service: send a query (POST /pka) or, if query is None, GET path
+# @return (status, dict)
+def request_service(query=None, path=None, port=_default_port, socket_path=None, timeout=None):
+    if socket_path is None:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    else:
+        connection = _UnixHTTPConnection(socket_path, timeout=timeout)
+    try:
+        if query is None:
+            connection.request('GET', path or '/metrics')
+        else:
+            connection.request('POST', path or '/pka', json.dumps(query), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve PKA and dpa queries with the pka data kept in memory.')
+    parser.add_argument('inputs', nargs='*', default=['input.json'], help='input files, default input.json')
+    parser.add_argument('--port', type=int, default=_default_port, help='localhost port')
+    parser.add_argument('--socket', default=None, help='Unix socket path, instead of the localhost port')
+    parser.add_argument('--log', default=None, help='file of the reading output, default discarded')
+    parser.add_argument('--verbose', action='store_true', help='log each request')
+    args = parser.parse_args(argv)
+
+    file_object = None if args.log is None else open(args.log, 'w')
+    start = time.perf_counter()
+    service = PKAService(args.inputs, file_object)
+    server = make_server(service, args.port, args.socket, args.verbose)
+    print("G-PKA service: {} input(s) loaded in {:.2f} s, listening on {}".format(
+          len(service.engines), time.perf_counter() - start,
+          args.socket if args.socket else '127.0.0.1:{}'.format(args.port)), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+Disk-resident result store.
+
+Results of many cases (flux spectra, mesh cells, ...) are kept in a
+directory of memory-mapped .npy arrays, one array per kind and quantity,
+with the layout (case, product, group):
+
+    <nuclide|element>_pka.npy                   - pka spectra,                SIZE (cases, products, groups)
+    <nuclide|element>_disp_cross_section.npy    - displacement cross section, SIZE (cases, products, groups)
+    <nuclide|element>_nrt_dpa.npy               - NRT dpa,                    SIZE (cases, products, groups)
+    energy_group.npy                            - pka energy group boundaries (MeV), SIZE (groups + 1)
+    index.json                                  - layout, case names and the product index
+
+The product index gives the names and ids ((Z, A) of nuclides, Z of
+elements) of the products, in the order of the product axis, and it is
+known before any collapse (see pka_accumulator.product_index). So the
+accumulator writes the cases straight into the store arrays (see
+PKAAccumulator.for_store), and readers slice one product or one case
+without loading the other ones:
+
+    store = ResultStore('Total_PKAs_store')
+    store.product('Zr-90')          # SIZE (cases, groups)
+    store.case(3, kind='element')   # SIZE (products, groups)
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+import json
+import os
+
+import numpy as np
+
+_index_file = 'index.json'
+# Quantity of the store (same names as the npz file) -> quantity of the accumulator
+store_quantities = {'pka': 'pka', 'disp_cross_section': 'damage_cross_section', 'nrt_dpa': 'damage_dpa'}
+
+
+class ResultStore:
+    """
+    Memory-mapped (case, product, group) result arrays of one directory, and their index.
+    """
+
+    def __init__(self, directory, mode='r'):
+        self.directory = directory
+        self.mode = mode                # 'r' to read, 'r+' to write into the arrays
+        with open(os.path.join(directory, _index_file)) as f:
+            index = json.load(f)
+        self.num_cases = index['num_cases']
+        self.cases = index['cases']     # Case names, None if the cases are only numbered
+        self.quantities = index['quantities']
+        self.energy_group = np.load(os.path.join(directory, 'energy_group.npy'))
+        self._products = index['products']
+        self._rows = {kind: dict((name, row) for row, name in enumerate(products['names']))
+                      for kind, products in self._products.items()}
+        self._arrays = {}
+
+    # Create the store directory with zero arrays (sparse files), and open it to write
+    # products: {kind: (names, ids)}, see pka_accumulator.product_index
+    # cases: number of cases, or the list of case names
+    @classmethod
+    def create(cls, directory, cases, energy_group, products, do_damage=True):
+        os.makedirs(directory, exist_ok=True)
+        num_cases = cases if type(cases) is int else len(cases)
+        num_groups = len(energy_group) - 1
+        quantities = list(store_quantities) if do_damage else ['pka']
+        np.save(os.path.join(directory, 'energy_group.npy'), np.asarray(energy_group, dtype=float))
+        index = {'layout': ['case', 'product', 'group'],
+                 'num_cases': num_cases,
+                 'cases': None if type(cases) is int else [str(case) for case in cases],
+                 'num_groups': num_groups,
+                 'quantities': quantities,
+                 'products': {},
+                 'arrays': {}}
+        for kind, (names, ids) in products.items():
+            id_key = 'za' if kind == 'nuclide' else 'z'
+            index['products'][kind] = {'names': list(names), id_key: [list(i) if type(i) is tuple else i
+                                                                      for i in ids]}
+            for quantity in quantities:
+                filename = '{}_{}.npy'.format(kind, quantity)
+                index['arrays'].setdefault(kind, {})[quantity] = filename
+                array = np.lib.format.open_memmap(os.path.join(directory, filename), mode='w+', dtype=float,
+                                                  shape=(num_cases, len(names), num_groups))
+                del array
+        # The index is written last, a store without it is incomplete
+        with open(os.path.join(directory, _index_file), 'w') as f:
+            json.dump(index, f, indent=1)
+        return cls(directory, 'r+')
+
+    # Product names of kind 'nuclide' or 'element', in the order of the product axis
+    def names(self, kind='nuclide'):
+        return self._products[kind]['names']
+
+    # Product ids: (Z, A) of nuclides, Z of elements
+    def ids(self, kind='nuclide'):
+        if kind == 'nuclide':
+            return [tuple(za) for za in self._products[kind]['za']]
+        return list(self._products[kind]['z'])
+
+    # Memory-mapped array of one kind and quantity, SIZE (cases, products, groups)
+    def array(self, kind='nuclide', quantity='pka'):
+        key = (kind, quantity)
+        if key not in self._arrays:
+            if quantity not in self.quantities:
+                raise KeyError("Quantity '{}' is not in the result store, use one of {}".format(
+                    quantity, self.quantities))
+            self._arrays[key] = np.load(os.path.join(self.directory, '{}_{}.npy'.format(kind, quantity)),
+                                        mmap_mode=self.mode)
+        return self._arrays[key]
+
+    # Values of one product for all cases, SIZE (cases, groups), only this product is read
+    def product(self, name, quantity='pka', kind='nuclide'):
+        if name not in self._rows[kind]:
+            raise KeyError("{} '{}' is not in the result store".format(kind, name))
+        return self.array(kind, quantity)[:, self._rows[kind][name]]
+
+    # Values of all products for one case (index or name), SIZE (products, groups)
+    def case(self, case, quantity='pka', kind='nuclide'):
+        if type(case) is str:
+            if self.cases is None or case not in self.cases:
+                raise KeyError("Case '{}' is not in the result store".format(case))
+            case = self.cases.index(case)
+        return self.array(kind, quantity)[case]
+
+    # Group sums of all cases and products, SIZE (cases, products), read by chunks of cases
+    def totals(self, quantity='pka', kind='nuclide', chunk_size=1024):
+        array = self.array(kind, quantity)
+        totals = np.zeros(array.shape[:2])
+        for start in range(0, array.shape[0], chunk_size):
+            totals[start:start + chunk_size] = np.sum(array[start:start + chunk_size], axis=-1)
+        return totals
+
+    def flush(self):
+        for array in self._arrays.values():
+            if self.mode != 'r':
+                array.flush()
+
+    def close(self):
+        self.flush()
+        self._arrays = {}
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""
+Composition sweep.
+
+The pka spectra and damage of each channel do not depend on the composition,
+the 'pka_ratios' only weight the parent nuclides in the totals. Each parent
+nuclide is collapsed once and added with ratio 1 into its own slice (see
+PKAAccumulator num_parents), the totals of many candidate compositions are
+then one matrix product:
+
+    totals (candidates, rows, ...) = ratios (candidates, parents) . slices (parents, rows, ...)
+
+Compositions are isotope ratios of the parent nuclides, or element fractions
+expanded into the natural isotopes which are parent nuclides of input:
+
+    python pka_sweep.py [input.json] compositions.json [--groups] [--output Total_PKAs_sweep.npz]
+
+where compositions.json is a list of {"Ag-107": 0.5, "Ag-109": 0.5} or
+{"Ag": 1.0} objects.
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from natural_abundance import natural_isotopes
+from nuclide import nuclide_za, nuclide_names
+from pka_accumulator import PKAAccumulator
+from utility_pka import calculate_average_pka_energy
+
+
+class CompositionSweep:
+    """
+    Totals of many compositions of the parent nuclides of one input, each parent nuclide is collapsed once.
+    """
+
+    def __init__(self, engine, flux_spectrum=None, flux_unit=None, flux_energy_group=None):
+        from pka_engine import projectile_flux
+        inp = engine.inp
+        projectile_fluxes = None
+        if flux_spectrum is None:
+            flux_spectrum, flux_unit, flux_energy_group = inp.flux_spectrum, inp.flux_unit, inp.flux_energy_group
+            projectile_fluxes = inp.projectile_flux_spectra
+        self.do_damage = inp.do_damage
+        self.parents = []           # Parent nuclide names, in the order of the slices
+        ratios = []
+
+        accumulator = None
+        for p, nuc in enumerate(engine.iter_nuclides()):
+            if accumulator is None:
+                accumulator = PKAAccumulator(nuc.recoil_energy_group_struc, inp.do_damage, len(inp.pka_files))
+            self.parents.append(nuc.name)
+            ratios.append(nuc.ratio)
+            engine.collapse(nuc, *projectile_flux(nuc, (flux_spectrum, flux_unit, flux_energy_group),
+                                                  projectile_fluxes))
+            accumulator.add(nuc, 1., p)
+            if inp.streaming:
+                nuc.release_recoil_matrices()
+        self.input_ratios = np.array(ratios, dtype=float)      # 'pka_ratios' of input
+        self.accumulator = accumulator
+        self.energy_group = accumulator.energy_group
+        self._slices = {kind: accumulator.parent_slices(kind) for kind in ('nuclide', 'element')}
+
+    # Ratio matrix of compositions, SIZE (candidates, parents)
+    # compositions: array of ratios SIZE ([candidates,] parents), or one or a list of {name: ratio} with
+    #   parent nuclide names (isotope ratios) or element symbols (element fractions, natural isotopes),
+    #   the 'pka_ratios' of input if None
+    def ratio_matrix(self, compositions=None):
+        if compositions is None:
+            return self.input_ratios[None]
+        if isinstance(compositions, dict):
+            compositions = [compositions]
+        if len(compositions) == 0 or not isinstance(compositions[0], dict):
+            ratios = np.atleast_2d(np.asarray(compositions, dtype=float))
+            assert (ratios.shape[1] == len(self.parents)), \
+                "Compositions need {} ratios, one for each parent nuclide!".format(len(self.parents))
+            return ratios
+
+        # A parent nuclide may have several slices (one per projectile in a mixed field), each gets the ratio
+        index = {}
+        for p, name in enumerate(self.parents):
+            index.setdefault(name, []).append(p)
+        ratios = np.zeros((len(compositions), len(self.parents)))
+        for c, composition in enumerate(compositions):
+            for key, value in composition.items():
+                if type(key) is str and key.strip().isalpha():
+                    # Element fraction, expanded into the natural isotopes of the parent nuclides
+                    for name, fraction in natural_isotopes(key, self.parents).items():
+                        ratios[c, index[name]] += value * fraction
+                    continue
+                name = nuclide_names(*nuclide_za(key))[1]
+                if name not in index:
+                    raise ValueError("{} is not a parent nuclide of input: {}".format(key, self.parents))
+                ratios[c, index[name]] += value
+        return ratios
+
+    # Summary of all nuclides (kind 'nuclide') or elements (kind 'element') for each composition,
+    # from the group sums of the slices only
+    # @return {column: np.array - SIZE (candidates, rows, [spectra])}, and 'names', 'za' or 'z'
+    def summary(self, compositions, kind):
+        ratios = self.ratio_matrix(compositions)
+        slices = self._slices[kind]
+        id_column = 'za' if kind == 'nuclide' else 'z'
+        summary = {'names': slices['names'], id_column: slices[id_column]}
+        if 'pka' not in slices:
+            return summary
+
+        pka = slices['pka']
+        mid_energy = 0.5 * 1.E+6 * (self.energy_group[:-1] + self.energy_group[1:])
+        summary['total_pka'] = self._weight(ratios, np.sum(pka, axis=-1))
+        weighted = self._weight(ratios, np.sum(pka * mid_energy, axis=-1))
+        where = summary['total_pka'] > 0. if kind == 'nuclide' else summary['total_pka'] != 0.
+        summary['average_pka_energy'] = np.divide(weighted, summary['total_pka'], out=np.zeros_like(weighted),
+                                                  where=where)
+        if self.do_damage:
+            summary['displacement_energy'] = self._weight(ratios, np.sum(slices['damage_cross_section'],
+                                                                         axis=-1)) * 1.E+6     # in eV
+            summary['total_nrt_dpa'] = self._weight(ratios, np.sum(slices['damage_dpa'], axis=-1))
+        return summary
+
+    # Summary and the spectra (axis groups last) of all nuclides or elements for each composition
+    def columns(self, compositions, kind):
+        ratios = self.ratio_matrix(compositions)
+        columns = self.summary(ratios, kind)
+        slices = self._slices[kind]
+        if 'pka' not in slices:
+            return columns
+        columns['pka'] = self._weight(ratios, slices['pka'])
+        columns['average_pka_energy'] = calculate_average_pka_energy(columns['pka'], self.energy_group,
+                                                                     positive_only=(kind == 'nuclide'))
+        if self.do_damage:
+            columns['disp_cross_section'] = self._weight(ratios, slices['damage_cross_section'])
+            columns['nrt_dpa'] = self._weight(ratios, slices['damage_dpa'])
+        return columns
+
+    # Sum of the pka spectra of all elements for each composition, SIZE (candidates, [spectra,] groups)
+    def total_pka_spectrum(self, compositions):
+        pka = self._slices['element'].get('pka')
+        if pka is None:
+            return None
+        return np.tensordot(self.ratio_matrix(compositions), pka.sum(axis=0), axes=([1], [0]))
+
+    # ratios (candidates, parents) . values (rows, parents, ...) -> (candidates, rows, ...)
+    @staticmethod
+    def _weight(ratios, values):
+        return np.tensordot(ratios, values, axes=([1], [1]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='PKA and dpa totals of many compositions, one collapse.')
+    parser.add_argument('input', nargs='?', default='input.json')
+    parser.add_argument('compositions', help='json file, a list of {parent nuclide or element: ratio}')
+    parser.add_argument('--groups', action='store_true', help='also save the spectra of each composition')
+    parser.add_argument('--output', default='Total_PKAs_sweep.npz')
+    args = parser.parse_args(argv)
+
+    from pka_engine import PKAEngine
+    from utility_output import write_sweep_into_npz
+    engine = PKAEngine(args.input)
+    engine.read_flux()
+    with open(args.compositions) as f:
+        compositions = json.load(f)
+    sweep = CompositionSweep(engine)
+    write_sweep_into_npz(sweep, compositions, args.groups, args.output)
+    print("\n>>> {} COMPOSITIONS OF {} PARENT NUCLIDES WRITTEN INTO [{}]".format(
+          len(sweep.ratio_matrix(compositions)), len(sweep.parents), args.output), file=sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,58 +10,306 @@ Class definition for input file.
 import numpy as np
 import scipy.sparse as sp
 
+# Key words of the section title lines
+_section_keys = ('matrix', 'section')
+
+
+# Parse the title line of a section
+def _read_title_line(line):
+    title = line[:30].strip()
+    mtd = int(line[30:35])
+    line_right = line[36:].strip().split()
+    return title, mtd, line_right
+
+
+# Find all the section title lines in the text
+# @return [(start, end), ...] - position of each title line, '\n' excluded
+def _find_section_titles(text):
+    titles = []
+    pos = 0
+    found = dict((key, text.find(key)) for key in _section_keys)
+    while True:
+        # Search again only for the key words which have been passed
+        for key in _section_keys:
+            if 0 <= found[key] < pos:
+                found[key] = text.find(key, pos)
+        candidates = [i for i in found.values() if i >= 0]
+        if not candidates:
+            break
+        i = min(candidates)
+        start = text.rfind('\n', 0, i) + 1
+        end = text.find('\n', i)
+        if end < 0:
+            end = len(text)
+        titles.append((start, end))
+        pos = end
+    return titles
+
+
+# Convert a block of 'row column value [...]' lines into a sparse matrix
+# All numbers are read at once, the block never goes through a python loop
+def _block_to_matrix(block, ng):
+    first_line = block.lstrip().split('\n', 1)[0]
+    num_columns = len(first_line.split())
+    if num_columns == 0:
+        return sp.coo_matrix((ng, ng))
+    data = np.fromstring(block, sep=' ').reshape(-1, num_columns)
+    rows = data[:, 0].astype(np.int64) - 1
+    columns = data[:, 1].astype(np.int64) - 1
+    return sp.coo_matrix((data[:, 2], (rows, columns)), shape=[ng, ng])
+
+
+# Split the 1st part block into energy group structure and matrix block
+def _split_energy_group_block(block, num_pka_incident_egs):
+    num_values = (num_pka_incident_egs + 1) * 2
+    num_lines = num_values // 6 + (1 if num_values % 6 > 0 else 0)
+    pos = 0
+    for i in range(num_lines):
+        pos = block.index('\n', pos) + 1
+    pka_e_array = np.fromstring(block[:pos], sep=' ')
+    assert (pka_e_array.shape[0] == num_values), "PKA energy group structure is not complete!"
+    return pka_e_array, block[pos:]
+
+
+# Read lines of current section from file object, stop before the next title line
+def _read_section_block(file_object):
+    x = file_object.tell()
+    lines = []
+    while True:
+        line = file_object.readline()
+        if line == "" or 'matrix' in line or 'section' in line:
+            break
+        lines.append(line)
+    block = "".join(lines)
+    file_object.seek(x)
+    file_object.read(len(block))   # Back to the next title line
+    return block
+
+
+class PKASection:
+    """
+    Index of one matrix section in pka file: (title, mtd, offset, nnz).
+    The matrix is read from the file only when load() is called.
+    """
+
+    def __init__(self, filename, title, mtd, ng, offset, length, nnz):
+        self.filename = filename
+        self.title = title
+        self.mtd = mtd
+        self.ng = ng
+        self.offset = offset        # in bytes, start of the 'row column value' block
+        self.length = length        # in bytes
+        self.nnz = nnz
+
+    def load(self):
+        with open(self.filename, 'rb') as f:
+            return self.read_from(f)
+
+    # Read the matrix from the opened pka file (binary mode)
+    def read_from(self, f):
+        f.seek(self.offset)
+        return _block_to_matrix(f.read(self.length).decode('latin-1'), self.ng)
+
+
+# Read the matrices of lazy sections (PKASection), the sections of one file are read with one open, in file
+# order. Other matrices are returned as they are
+# @return [matrix, ...] - in the same order as sections
+def load_sections(sections):
+    matrices = list(sections)
+    by_file = {}
+    for k, section in enumerate(sections):
+        if isinstance(section, PKASection):
+            by_file.setdefault(section.filename, []).append(k)
+    for filename, indices in by_file.items():
+        with open(filename, 'rb') as f:
+            for k in sorted(indices, key=lambda i: sections[i].offset):
+                matrices[k] = sections[k].read_from(f)
+    return matrices
+
+
+class PKASectionSelection:
+    """
+    Select the pka sections by MT numbers and particle types.
+
+    MT numbers are given as a list of numbers or [low, high] ranges, particle types are the word
+    before 'matrix' in section title, such as 'recoil', 'proton' or 'alpha'. An empty include list
+    selects all the sections.
+    """
+
+    def __init__(self, mt_include=None, mt_exclude=None, particle_include=None, particle_exclude=None):
+        self.mt_include = self._mt_ranges(mt_include)
+        self.mt_exclude = self._mt_ranges(mt_exclude)
+        self.particle_include = [p.lower() for p in particle_include or []]
+        self.particle_exclude = [p.lower() for p in particle_exclude or []]
+
+    @staticmethod
+    def _mt_ranges(mt_list):
+        ranges = []
+        for mt in mt_list or []:
+            if type(mt) in [list, tuple]:
+                ranges.append((int(mt[0]), int(mt[1])))
+            else:
+                ranges.append((int(mt), int(mt)))
+        return ranges
+
+    def __call__(self, title, mtd):
+        if self.mt_include and not any(low <= mtd <= high for low, high in self.mt_include):
+            return False
+        if any(low <= mtd <= high for low, high in self.mt_exclude):
+            return False
+        particle = section_particle(title)
+        if self.particle_include and particle not in self.particle_include:
+            return False
+        return particle not in self.particle_exclude
+
+    def select(self, matrices):
+        return [(title, mtd, A) for title, mtd, A in matrices if self(title, mtd)]
+
+
+# Particle type of the section, such as 'recoil' for '(n,a) recoil matrix'
+def section_particle(title):
+    words = title.split()
+    if 'matrix' in words and words.index('matrix') > 0:
+        return words[words.index('matrix') - 1].lower()
+    return ''
+
+
+# Read the whole pka file (SPECTER-PKA pka-file format) in one pass
+# Each section is located by its title line, and the numbers inside are read in bulk
+# If lazy, only the index of each matrix section (PKASection) is returned, the matrix is read when needed
+# Sections not in selection (PKASectionSelection) are skipped
+# @return (num_pka_incident_egs, pka_e_array, [(title, mtd, M), ...], (title, mtd, ng_xs))
+def read_pka_file(filename, lazy=False, selection=None):
+    if lazy:
+        return _read_pka_file_index(filename, selection)
+    # latin-1 keeps the position in text same as the byte offset in file
+    with open(filename, 'rb') as f:
+        text = f.read().decode('latin-1')
+
+    titles = _find_section_titles(text)
+    assert (len(titles) > 0), "No section found in pka file {}!".format(filename)
+    bounds = [start for start, end in titles[1:]] + [len(text)]
+
+    num_pka_incident_egs = None
+    pka_e_array = None
+    matrices = []
+    ng_info = (None, None, None)
+    for (start, end), next_start in zip(titles, bounds):
+        title, mtd, line_right = _read_title_line(text[start:end])
+        block_start = text.find('\n', end) + 1 if end < len(text) else end
+        block = text[block_start:next_start]
+
+        # 1st part: energy group structure followed by the first matrix
+        if num_pka_incident_egs is None:
+            num_pka_incident_egs = int(line_right[1]) - 1
+            num_pka_points = int(line_right[2])
+            assert (num_pka_incident_egs == num_pka_points), \
+                "PKA points must be same as incident energy group number!"
+            pka_e_array, matrix_block = _split_energy_group_block(block, num_pka_incident_egs)
+            pka_e_array = pka_e_array[:(num_pka_incident_egs + 1)]
+            block_start += len(block) - len(matrix_block)
+            block = matrix_block
+            ng = num_pka_incident_egs
+
+        # 3rd part: (n, gamma) cross section
+        elif 'matrix' not in title:
+            ng = int(line_right[1]) - 1
+            data = np.fromstring(block, sep=' ').reshape(-1, 2)
+            ng_xs = np.zeros(ng)
+            ng_xs[data[:, 0].astype(np.int64) - 1] = data[:, 1]
+            ng_info = (title, mtd, ng_xs)
+            break
+
+        # 2nd part: recoil and particle matrices
+        else:
+            ng = int(line_right[2])
+
+        if selection is not None and not selection(title, mtd):
+            continue
+        matrices.append((title, mtd, _block_to_matrix(block, ng)))
+
+    return num_pka_incident_egs, pka_e_array, matrices, ng_info
+
+
+# Index of the pka file for lazy reading, same return as read_pka_file() with PKASection matrices
+# The file is scanned line by line with byte offsets, only the title lines, the energy group structure and
+# the (n, gamma) cross section are decoded, the memory does not grow with the file size
+def _read_pka_file_index(filename, selection=None):
+    num_pka_incident_egs = None
+    pka_e_array = None
+    matrices = []
+    ng_info = (None, None, None)
+    section = None          # [title, mtd, ng, offset, nnz] of the current matrix section
+
+    def close_section(end):
+        title, mtd, ng, offset, nnz = section
+        if selection is None or selection(title, mtd):
+            matrices.append((title, mtd, PKASection(filename, title, mtd, ng, offset, end - offset, nnz)))
+
+    with open(filename, 'rb') as f:
+        pos = 0
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            next_pos = pos + len(line)
+            if b'matrix' in line or b'section' in line:
+                if section is not None:
+                    close_section(pos)
+                    section = None
+                title, mtd, line_right = _read_title_line(line.decode('latin-1'))
+
+                # 1st part: energy group structure followed by the first matrix
+                if num_pka_incident_egs is None:
+                    num_pka_incident_egs = int(line_right[1]) - 1
+                    num_pka_points = int(line_right[2])
+                    assert (num_pka_incident_egs == num_pka_points), \
+                        "PKA points must be same as incident energy group number!"
+                    num_values = (num_pka_incident_egs + 1) * 2
+                    lines = [f.readline() for i in range(num_values // 6 + (1 if num_values % 6 > 0 else 0))]
+                    next_pos += sum(len(group_line) for group_line in lines)
+                    pka_e_array = np.fromstring(b''.join(lines).decode('latin-1'), sep=' ')
+                    assert (pka_e_array.shape[0] == num_values), "PKA energy group structure is not complete!"
+                    pka_e_array = pka_e_array[:(num_pka_incident_egs + 1)]
+                    ng = num_pka_incident_egs
+
+                # 3rd part: (n, gamma) cross section
+                elif 'matrix' not in title:
+                    ng = int(line_right[1]) - 1
+                    data = np.fromstring(f.read().decode('latin-1'), sep=' ').reshape(-1, 2)
+                    ng_xs = np.zeros(ng)
+                    ng_xs[data[:, 0].astype(np.int64) - 1] = data[:, 1]
+                    ng_info = (title, mtd, ng_xs)
+                    break
+
+                # 2nd part: recoil and particle matrices
+                else:
+                    ng = int(line_right[2])
+                section = [title, mtd, ng, next_pos, 0]
+            elif section is not None:
+                section[4] += 1
+            pos = next_pos
+        if section is not None:
+            close_section(pos)
+
+    assert (num_pka_incident_egs is not None), "No section found in pka file {}!".format(filename)
+    return num_pka_incident_egs, pka_e_array, matrices, ng_info
+
 
 # Read 1st part in pka file (SPECTER-PKA pka-file format)
 # Get the pka incident and recoil energy structure
 def read_pka_file_energy_group_struc(file_object):
     # Check the title line
     line = file_object.readline()
-
-    title = line[:30].strip()
-    mtd = int(line[30:35])
-    line_right = line[36:].strip().split()
+    title, mtd, line_right = _read_title_line(line)
     num_pka_incident_egs = int(line_right[1]) - 1
-    num_pka_recoil_egs = num_pka_incident_egs
     num_pka_points = int(line_right[2])
     assert (num_pka_incident_egs == num_pka_points), "PKA points must be same as incident energy group number!"
 
-    # Read the pka spectrum
-    i_label = 0
-    pka_e_array = np.zeros((num_pka_incident_egs + 1) * 2)
-    for i in range((num_pka_incident_egs + 1) * 2 // 6):  # floor division
-        line = file_object.readline()
-        line = line.strip().split()
-        for j in range(6):
-            pka_e_array[i_label] = float(line[j])
-            i_label += 1
-
-    # Read the last spectrum line (if exist)
-    tmp = (num_pka_incident_egs + 1) * 2 % 6
-    if tmp > 0:
-        line = file_object.readline()
-        line = line.strip().split()
-        for j in range(tmp):
-            pka_e_array[i_label] = float(line[j])
-            i_label += 1
-
-    # Read the last line - ONLY for the 1st part
-    # Read the sparse matrix
-    ng = num_pka_incident_egs
-    rows = []
-    columns = []
-    values = []
-    while True:
-        x = file_object.tell()
-        line = file_object.readline()
-        if 'matrix' in line or 'section' in line:
-            file_object.seek(x)  # Back to last title line
-            break
-        line = line.strip().split()
-        rows.append(int(line[0]) - 1)
-        columns.append(int(line[1]) - 1)
-        values.append(float(line[2]))
-    # Save matrix
-    M = sp.coo_matrix((np.array(values), (np.array(rows), np.array(columns))), shape=[ng, ng])
+    # Read the pka spectrum and the sparse matrix
+    block = _read_section_block(file_object)
+    pka_e_array, block = _split_energy_group_block(block, num_pka_incident_egs)
+    M = _block_to_matrix(block, num_pka_incident_egs)
 
     return title, mtd, num_pka_incident_egs, pka_e_array[:(num_pka_incident_egs+1)], M
 
@@ -71,28 +319,12 @@ def read_pka_file_each_matrix(file_object):
     # Read the title line
     x0 = file_object.tell()
     line = file_object.readline()
-    title = line[:30].strip()
-    mtd = int(line[30:35])
-    line_right = line[36:].strip().split()
+    title, mtd, line_right = _read_title_line(line)
     ng = int(line_right[2])
 
     if 'matrix' in title:
         # Read the sparse matrix
-        rows = []
-        columns = []
-        values = []
-        while True:
-            x = file_object.tell()
-            line = file_object.readline()
-            if 'matrix' in line or 'section' in line:
-                file_object.seek(x)  # Back to last title line
-                break
-            line = line.strip().split()
-            rows.append(int(line[0]) - 1)
-            columns.append(int(line[1]) - 1)
-            values.append(float(line[2]))
-        # Save matrix
-        M = sp.coo_matrix((np.array(values), (np.array(rows), np.array(columns))), shape=[ng, ng])
+        M = _block_to_matrix(_read_section_block(file_object), ng)
     else:
         file_object.seek(x0)
         M = None  # if matrix don't exist
@@ -103,18 +335,12 @@ def read_pka_file_each_matrix(file_object):
 # Read the (n, gamma) cross section
 def read_pka_file_ng_xs(file_object):
     line = file_object.readline()
-    title = line[:30].strip()
-    mtd = int(line[30:35])
-    line_right = line[36:].strip().split()
+    title, mtd, line_right = _read_title_line(line)
     ng = int(line_right[1]) - 1
 
+    data = np.fromstring(file_object.read(), sep=' ').reshape(-1, 2)
     ng_xs = np.zeros(ng)
-    while True:
-        line = file_object.readline()
-        if line == "":
-            break
-        line = line.strip().split()
-        ng_xs[int(line[0]) - 1] = float(line[1])
+    ng_xs[data[:, 0].astype(np.int64) - 1] = data[:, 1]
 
     return title, mtd, ng_xs
 
@@ -132,4 +358,7 @@ if __name__ == '__main__':
         title, mtd, ng_xs = read_pka_file_ng_xs(fp)
         print("{0:30s} {1:4d}".format(title, mtd))
 
-
+    pi, pe_array, matrices, (title, mtd, ng_xs) = read_pka_file('./test/example_data/F019s-p.asc')
+    for title_m, mtd_m, A in matrices:
+        print("{0:30s} {1:4d}".format(title_m, mtd_m))
+    print("{0:30s} {1:4d}".format(title, mtd))
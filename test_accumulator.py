@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Tests of the totals of global nuclides and elements: the accumulator (normal runs), the composition sweep
+and the result store give the same values as the original per nuclide sums (reference_totals below).
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+import numpy as np
+
+from pka_accumulator import PKAAccumulator, product_index
+from pka_store import ResultStore
+from pka_sweep import CompositionSweep
+
+_quantities = ('recoil_pka_spectrum', 'damage_cross_section', 'damage_dpa')
+
+
+# The original sums of the channels of all parent nuclides into global nuclides and elements, the (n,p) and
+# (n,a) channels duplicated by the particle channels are skipped. Pka spectra of the channels must be computed
+# ratios: {parent nuclide name: ratio}, nuc.ratio if None
+# @return {'nuclide': {name: {quantity: np.array}}, 'element': {...}}, in the order the products are found
+def reference_totals(nuclides, ratios=None):
+    totals = {'nuclide': {}, 'element': {}}
+    for nuc in nuclides:
+        ratio = nuc.ratio if ratios is None else ratios.get(nuc.name, 0.)
+        for recoil in nuc.recoil_nuclides:
+            duplicated = ((recoil.name != 'He-4') and (800 <= recoil.mtd <= 849)) or \
+                         ((recoil.name != 'H-1') and (600 <= recoil.mtd <= 649))
+            values = {'recoil_pka_spectrum': recoil.pka_spectrum * ratio,
+                      'damage_cross_section': recoil.damage_cross_section * ratio,
+                      'damage_dpa': recoil.damage_dpa * ratio}
+            for kind, key in (('nuclide', recoil.name), ('element', recoil.element)):
+                if key in totals[kind]:
+                    if duplicated:
+                        break
+                    for q in _quantities:
+                        totals[kind][key][q] = totals[kind][key][q] + values[q]
+                else:
+                    totals[kind][key] = dict(values)
+    return totals
+
+
+def assert_same_totals(products, reference):
+    assert list(products) == list(reference)
+    for name, values in reference.items():
+        for q in _quantities:
+            np.testing.assert_allclose(getattr(products[name], q), values[q], rtol=1e-12, atol=0., err_msg=name)
+
+
+def test_run_totals_match_reference(make_engine):
+    engine = make_engine()
+    result = engine.run()
+    reference = reference_totals(result.nuclides)
+    assert_same_totals(result.global_recoil, reference['nuclide'])
+    assert_same_totals(result.global_element, reference['element'])
+    np.testing.assert_allclose(result.total_pka_spectrum(),
+                               sum(values['recoil_pka_spectrum'] for values in reference['element'].values()),
+                               rtol=1e-12)
+
+
+def test_composition_sweep_matches_reference(make_engine):
+    engine = make_engine()
+    sweep = CompositionSweep(engine)
+    compositions = [{'Ag-107': 1.}, {'Ag-107': 0.3, 'Ag-109': 0.7}]
+    for c, composition in enumerate(compositions):
+        result = engine.run(ratios=composition)
+        for kind in ('nuclide', 'element'):
+            reference = reference_totals(result.nuclides, composition)[kind]
+            columns = sweep.columns(compositions, kind)
+            names = list(columns['names'])
+            for name, values in reference.items():
+                row = names.index(name)
+                np.testing.assert_allclose(columns['pka'][c, row], values['recoil_pka_spectrum'], rtol=1e-12,
+                                           atol=0., err_msg=name)
+                np.testing.assert_allclose(columns['nrt_dpa'][c, row], values['damage_dpa'], rtol=1e-12, atol=0.,
+                                           err_msg=name)
+
+
+def test_result_store_matches_reference(make_engine, tmp_path):
+    engine = make_engine()
+    inp = engine.inp
+    scales = [1., 2.5, 0.1]
+    fluxes = np.stack([inp.flux_spectrum * scale for scale in scales])
+    nuclides = engine.load_nuclides()
+    directory = str(tmp_path / 'store')
+    store = ResultStore.create(directory, ['flux:{}'.format(scale) for scale in scales],
+                               nuclides[0].recoil_energy_group_struc, product_index(nuclides))
+    # Two batches of cases, as PKAEngine.run_into_store
+    for first, last in ((0, 2), (2, 3)):
+        engine.run(fluxes[first:last], inp.flux_unit, inp.flux_energy_group, list(store.cases[first:last]),
+                   accumulator=PKAAccumulator.for_store(store, first, last))
+    store.close()
+
+    store = ResultStore(directory)
+    for case, flux in enumerate(fluxes):
+        result = engine.run(flux, inp.flux_unit, inp.flux_energy_group)
+        reference = reference_totals(result.nuclides)
+        for kind in ('nuclide', 'element'):
+            for name, values in reference[kind].items():
+                np.testing.assert_allclose(store.product(name, 'pka', kind)[case], values['recoil_pka_spectrum'],
+                                           rtol=1e-12, atol=0., err_msg=name)
+                np.testing.assert_allclose(store.product(name, 'nrt_dpa', kind)[case], values['damage_dpa'],
+                                           rtol=1e-12, atol=0., err_msg=name)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+Tests of the binary cache of parsed pka files: entries give the same results as the text parser, the index
+is written once by flush() and the cache is bounded in size.
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+import io
+import json
+import os
+
+from pka_cache import PKACache, _index_name
+from read_pka_file import PKASectionSelection
+from test_read_pka_file import reference_read_pka_file, assert_same_pka_data
+
+
+def test_cache_round_trip(tmp_path, pka_filename):
+    directory = str(tmp_path / 'cache')
+    reference = reference_read_pka_file(pka_filename)
+    cache = PKACache(directory)
+    assert_same_pka_data(cache.read_pka_file(pka_filename), reference)
+    assert_same_pka_data(cache.read_pka_file(pka_filename), reference)
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Nothing is written into the index before flush()
+    assert not os.path.exists(os.path.join(directory, _index_name))
+    cache.flush()
+
+    cache = PKACache(directory)
+    assert_same_pka_data(cache.read_pka_file(pka_filename), reference)
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_cache_selection(tmp_path, pka_filename):
+    selection = PKASectionSelection(mt_include=[[100, 120]], particle_exclude=['proton'])
+    reference = reference_read_pka_file(pka_filename)
+    reference = reference[:2] + (selection.select(reference[2]), reference[3])
+    cache = PKACache(str(tmp_path / 'cache'))
+    # From the text file, then from the cache entry
+    assert_same_pka_data(cache.read_pka_file(pka_filename, selection), reference)
+    assert_same_pka_data(cache.read_pka_file(pka_filename, selection), reference)
+    assert cache.hits == 1
+
+
+def test_cache_is_bounded(tmp_path, pka_filename):
+    directory = str(tmp_path / 'cache')
+    filenames = []
+    for i in range(3):
+        filename = str(tmp_path / 'Ag{}.asc'.format(107 + i))
+        with open(pka_filename, 'rb') as f_in, open(filename, 'wb') as f_out:
+            f_out.write(f_in.read())
+        filenames.append(filename)
+    cache = PKACache(directory)
+    cache.warm(filenames[:1], file_object=io.StringIO())
+    entry_bytes = cache.index[os.path.abspath(filenames[0])]['bytes']
+
+    # Room for two entries: the least recently used one is removed
+    cache = PKACache(directory, max_size=2.5 * entry_bytes / 1024 / 1024)
+    for filename in filenames:
+        cache.read_pka_file(filename)
+    cache.flush()
+    with open(os.path.join(directory, _index_name)) as f:
+        entries = json.load(f)['entries']
+    assert sorted(entries) == sorted(os.path.abspath(filename) for filename in filenames[1:])
+    assert sorted(entry['data_file'] for entry in entries.values()) == \
+        sorted(name for name in os.listdir(directory) if name.endswith('.npz'))
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+"""
+Tests of the memory mapped pka library: nuclides read from the library give the same results as the text
+parser, without copies of the library data.
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+import io
+
+import numpy as np
+
+from nuclide import stack_row_blocks
+from pka_library import PKALibrary, build_pka_library
+from test_read_pka_file import reference_read_pka_file, assert_same_pka_data
+
+
+def build_library(tmp_path, pka_filename):
+    # The nuclide name is taken from the pka file name
+    filename = str(tmp_path / 'Ag107s.asc')
+    with open(pka_filename, 'rb') as f_in, open(filename, 'wb') as f_out:
+        f_out.write(f_in.read())
+    library_file = str(tmp_path / 'pka.lib')
+    build_pka_library([filename], library_file, file_object=io.StringIO())
+    return PKALibrary(library_file)
+
+
+def test_library_round_trip(tmp_path, pka_filename):
+    library = build_library(tmp_path, pka_filename)
+    assert_same_pka_data(library.read_pka_file('Ag-107', 'n'), reference_read_pka_file(pka_filename))
+
+
+def test_library_matrices_are_views(tmp_path, pka_filename):
+    library = build_library(tmp_path, pka_filename)
+    num_egs, pka_e_array, matrices, ng_info = library.read_pka_file('Ag-107', 'n')
+    assert np.shares_memory(pka_e_array, library.buffer)
+    for title, mtd, M in matrices:
+        assert np.shares_memory(M.data, library.buffer)
+    # The row blocks of all channels are joined back into one operator without copy
+    operators = stack_row_blocks([M.T for title, mtd, M in matrices])
+    assert len(operators) == 1
+    assert np.shares_memory(operators[0].data, library.buffer)
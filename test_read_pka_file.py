@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Tests of the pka file parser: the bulk parser, the lazy section index and CRLF files give the same
+results as the original line by line parser (reference_read_pka_file below).
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+import numpy as np
+import scipy.sparse as sp
+
+from read_pka_file import read_pka_file, load_sections, PKASectionSelection
+
+
+# The original line by line parser of pka files (SPECTER-PKA pka-file format)
+# @return (num_pka_incident_egs, pka_e_array, [(title, mtd, M), ...], (title, mtd, ng_xs))
+def reference_read_pka_file(filename):
+    with open(filename) as f:
+        lines = f.read().splitlines()
+
+    def title_line(line):
+        return line[:30].strip(), int(line[30:35]), line[36:].strip().split()
+
+    def read_matrix(i, ng):
+        rows, columns, values = [], [], []
+        while i < len(lines) and 'matrix' not in lines[i] and 'section' not in lines[i]:
+            row, column, value = lines[i].split()[:3]
+            rows.append(int(row) - 1)
+            columns.append(int(column) - 1)
+            values.append(float(value))
+            i += 1
+        return i, sp.coo_matrix((np.array(values), (np.array(rows, dtype=int), np.array(columns, dtype=int))),
+                                shape=(ng, ng))
+
+    title, mtd, line_right = title_line(lines[0])
+    num_egs = int(line_right[1]) - 1
+    values = []
+    i = 1
+    while len(values) < (num_egs + 1) * 2:
+        values.extend(float(x) for x in lines[i].split())
+        i += 1
+    pka_e_array = np.array(values[:num_egs + 1])
+    i, M = read_matrix(i, num_egs)
+    matrices = [(title, mtd, M)]
+
+    ng_info = (None, None, None)
+    while i < len(lines):
+        title, mtd, line_right = title_line(lines[i])
+        if 'matrix' in title:
+            i, M = read_matrix(i + 1, int(line_right[2]))
+            matrices.append((title, mtd, M))
+        else:
+            ng_xs = np.zeros(int(line_right[1]) - 1)
+            for line in lines[i + 1:]:
+                if line.strip():
+                    group, value = line.split()[:2]
+                    ng_xs[int(group) - 1] = float(value)
+            ng_info = (title, mtd, ng_xs)
+            break
+    return num_egs, pka_e_array, matrices, ng_info
+
+
+def assert_same_pka_data(result, reference):
+    num_egs, pka_e_array, matrices, ng_info = result
+    assert num_egs == reference[0]
+    np.testing.assert_array_equal(pka_e_array, reference[1])
+    assert [(title, mtd) for title, mtd, M in matrices] == [(title, mtd) for title, mtd, M in reference[2]]
+    for (title, mtd, M), (_, _, R) in zip(matrices, reference[2]):
+        assert M.shape == R.shape
+        assert (sp.csr_matrix(M) != sp.csr_matrix(R)).nnz == 0, title
+    assert ng_info[:2] == reference[3][:2]
+    np.testing.assert_array_equal(ng_info[2], reference[3][2])
+
+
+# Read the matrices of a lazy read_pka_file() result
+def load_lazy(result):
+    num_egs, pka_e_array, sections, ng_info = result
+    matrices = load_sections([section for title, mtd, section in sections])
+    return num_egs, pka_e_array, [(title, mtd, M) for (title, mtd, section), M in zip(sections, matrices)], ng_info
+
+
+def test_bulk_parser_matches_reference(pka_filename):
+    assert_same_pka_data(read_pka_file(pka_filename), reference_read_pka_file(pka_filename))
+
+
+def test_lazy_sections_match_reference(pka_filename):
+    assert_same_pka_data(load_lazy(read_pka_file(pka_filename, lazy=True)), reference_read_pka_file(pka_filename))
+
+
+def test_crlf_file_matches_reference(tmp_path, pka_filename):
+    crlf_filename = str(tmp_path / 'crlf.asc')
+    with open(pka_filename, 'rb') as f:
+        data = f.read()
+    with open(crlf_filename, 'wb') as f:
+        f.write(data.replace(b'\r\n', b'\n').replace(b'\n', b'\r\n'))
+    reference = reference_read_pka_file(pka_filename)
+    assert_same_pka_data(read_pka_file(crlf_filename), reference)
+    assert_same_pka_data(load_lazy(read_pka_file(crlf_filename, lazy=True)), reference)
+
+
+def test_selection_is_same_for_eager_and_lazy(pka_filename):
+    selection = PKASectionSelection(mt_include=[[100, 120]], particle_exclude=['proton'])
+    eager = read_pka_file(pka_filename, selection=selection)
+    lazy = read_pka_file(pka_filename, lazy=True, selection=selection)
+    reference = reference_read_pka_file(pka_filename)
+    reference = reference[:2] + (selection.select(reference[2]), reference[3])
+    assert len(reference[2]) > 0
+    assert_same_pka_data(eager, reference)
+    assert_same_pka_data(load_lazy(lazy), reference)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Tests of the group rebinning operators: 'interpolate' gives the same flux as the original scipy interp1d
+method, 'conservative' keeps the integral flux where the group structures overlap.
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+import numpy as np
+import pytest
+from scipy import interpolate
+
+from input import read_specter_flux_file
+from utility_pka import interpolate_flux_pka_from_input
+from utility_rebin import RebinOperatorCache, rebin_flux
+
+
+@pytest.fixture
+def flux(flux_filename):
+    flux_unit, energy_group, flux_spectra = read_specter_flux_file(flux_filename)
+    return flux_unit, energy_group, flux_spectra[0]
+
+
+@pytest.fixture
+def pka_energy_group(flux):
+    # Finer than the flux groups in the middle, coarser at both ends, and beyond the flux groups
+    flux_unit, energy_group, flux_spectrum = flux
+    return np.unique(np.concatenate((np.geomspace(energy_group[1], energy_group[-2], 300), energy_group[::7],
+                                     [energy_group[-1] * 1.5])))
+
+
+# The original flux interpolation of utility_pka
+def reference_interpolate(flux_in, flux_unit, ebound_in, ebound_pka):
+    if flux_unit == 'n s^{-1}':
+        flux_in = flux_in / (ebound_in[1:] - ebound_in[:-1])
+    func_interp = interpolate.interp1d((ebound_in[:-1] + ebound_in[1:]) * 0.5, flux_in, kind='linear',
+                                       fill_value='extrapolate')
+    return func_interp((ebound_pka[:-1] + ebound_pka[1:]) * 0.5) * (ebound_pka[1:] - ebound_pka[:-1])
+
+
+def test_interpolate_matches_reference(flux, pka_energy_group):
+    flux_unit, energy_group, flux_spectrum = flux
+    np.testing.assert_allclose(
+        interpolate_flux_pka_from_input(flux_spectrum, flux_unit, energy_group, pka_energy_group),
+        reference_interpolate(flux_spectrum, flux_unit, energy_group, pka_energy_group), rtol=1e-10, atol=0.)
+
+
+def test_conservative_keeps_integral_flux(flux, pka_energy_group):
+    flux_unit, energy_group, flux_spectrum = flux
+    flux_per_group = flux_spectrum * (energy_group[1:] - energy_group[:-1]) \
+        if flux_unit == 'n s^{-1} MeV^{-1}' else flux_spectrum
+    flux_pka = rebin_flux(flux_per_group, energy_group, pka_energy_group, 'conservative')
+    # pka_energy_group covers the whole flux energy range
+    assert pka_energy_group[0] <= energy_group[0] and pka_energy_group[-1] >= energy_group[-1]
+    np.testing.assert_allclose(flux_pka.sum(), flux_per_group.sum(), rtol=1e-12)
+
+    # Flux in any range of the output boundaries is kept, also back into the flux groups
+    back = rebin_flux(flux_pka, pka_energy_group, energy_group, 'conservative')
+    np.testing.assert_allclose(back.sum(), flux_per_group.sum(), rtol=1e-12)
+
+
+def test_operator_cache_reuses_operators(flux, pka_energy_group):
+    flux_unit, energy_group, flux_spectrum = flux
+    cache = RebinOperatorCache(max_size=1)
+    first = cache.get(energy_group, pka_energy_group, 'conservative')
+    assert cache.get(energy_group.copy(), pka_energy_group.copy(), 'conservative') is first
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Bounded: the oldest operator is dropped
+    cache.get(energy_group, pka_energy_group, 'interpolate')
+    assert cache.get(energy_group, pka_energy_group, 'conservative') is not first
+    assert cache.misses == 3
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+"""
+Startup budget of the G-pka entry point (see check_startup.py), run by pytest.
+
+    python -m pytest test_startup.py
+
+@author Jimin Ma  <majm03@yeah.net>
+@time   2026-10-18
+
+"""
+
+import io
+
+from check_startup import check_startup, _default_budget
+
+
+def test_startup_within_budget():
+    output = io.StringIO()
+    assert check_startup(_default_budget, repeat=3, file_object=output), output.getvalue()
+
+
+# The check must fail past the budget
+def test_startup_over_budget_fails():
+    output = io.StringIO()
+    assert not check_startup(0., repeat=1, file_object=output)
+    assert 'FAILED' in output.getvalue()
@@ -2,20 +2,39 @@
 """
 Utility figure functions for the code.
 
+matplotlib is imported only when a figure is drawn, with the headless 'Agg'
+backend. Figures can be rendered from a saved result file (Total_PKAs.npz,
+see utility_output.write_results_into_npz), in a background process:
+
+    python utility_fig.py [Total_PKAs.npz] [--density D] [--atomic-mass M]
+
 @author Jimin Ma  <majm03@foxmail.com>
 @time   2018-09-17
 
 """
 
-import matplotlib.pyplot as plt
+import argparse
+import os
+import subprocess
 import sys
 
+import numpy as np
+
 _avogadro = 6.022141930E+23
+_default_result_file = 'Total_PKAs.npz'
+
+
+def _pyplot():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
 
 
 class SpectrumFig:
     def __init__(self, title):
-        self.fig = plt.figure()
+        self.plt = _pyplot()
+        self.fig = self.plt.figure()
         self.ax = self.fig.add_subplot(111)
 
         self.args = []
@@ -37,57 +56,92 @@ class SpectrumFig:
         self.ax.set_xlabel('PKA energy ($MeV$)')
         self.ax.set_ylabel(r'PKAs $s^{-1} cm^{-3}$')
         # plt.show()
-        plt.savefig(figure_name)
+        self.fig.savefig(figure_name)
+        self.plt.close(self.fig)
 
 
-# 绘制所有的核素和元素图
-def plot_global_element_figure(global_dicts, e_group, pick_list, density, atomic_mass, figure_title):
+# Indices of the top largest values, in descending order, by partial selection
+def top_indices(values, top):
+    if values.shape[0] <= top:
+        return np.argsort(-values, kind='stable')
+    selected = np.argpartition(-values, top - 1)[:top]
+    return selected[np.argsort(-values[selected], kind='stable')]
+
+
+# 绘制核素或元素图
+#   names: list of str, pka: np.array - SIZE (names, groups)
+# If pick_list is empty, all are plotted if there are no more than top, else the top largest total pka
+def plot_pka_figure(names, pka, e_group, pick_list, density, atomic_mass, figure_title, top=10):
     linestyles = ['-', '-.', ':']
     colors = ["red", "yellow", "blue", "lightgreen", "black"]
-    num = len(pick_list)
-    if num == 0:
-        num = len(global_dicts)
-    pkafig = SpectrumFig(title='PKA spectrum')
-    # 若pick_list为空，则绘制所有字典内的数据
+    names = [str(name) for name in names]
     if len(pick_list) == 0:
-        if len(global_dicts) < 11:
-            idx = 0
-            for key in global_dicts:
-                # plot figure
-                pkafig.add_plot(e_group, global_dicts[key].recoil_pka_spectrum * _avogadro * density / atomic_mass,
-                                linestyle=linestyles[idx % 3], color=colors[idx % 5], label='{}'.format(key))
-                idx += 1
+        if len(names) <= top:
+            indices = range(len(names))
         else:
-            # 若字典多于10个，则挑选最大的10个进行绘图
-            global_lists_sorted = sorted(dict_to_list(global_dicts), key=lambda x: sum(x[1].recoil_pka_spectrum),
-                                         reverse=True)
-            idx = 0
-            for i in range(10):
-                pkafig.add_plot(e_group, global_lists_sorted[i][1].recoil_pka_spectrum * _avogadro * density / \
-                                atomic_mass, linestyle=linestyles[idx % 3], color=colors[idx % 5],
-                                label='{}'.format(global_lists_sorted[i][0]))
-                idx += 1
-                if idx == 10:
-                    break
-
+            # 若多于top个，则挑选最大的top个进行绘图
+            indices = top_indices(np.sum(pka, axis=-1), top)
     else:
-        # Check if pick_list are in global_dicts key
-        for i in range(len(pick_list)):
-            if not global_dicts.has_key(pick_list[i]):
-                print("ERROR in pick_list: {} is not in global_nuclide dict!".format(pick_list[i]))
+        # Check if pick_list are in names
+        for key in pick_list:
+            if key not in names:
+                print("ERROR in pick_list: {} is not in global_nuclide dict!".format(key))
                 sys.exit()
-        # plot figure
-        for i in range(len(pick_list)):
-            key = pick_list[i]
-            pkafig.add_plot(e_group, global_dicts[key].recoil_pka_spectrum * _avogadro * density / atomic_mass,
-                            linestyle=linestyles[i % 3], color=colors[i % 5], label='{}'.format(key))
+        indices = [names.index(key) for key in pick_list]
 
+    pkafig = SpectrumFig(title='PKA spectrum')
+    for idx, k in enumerate(indices):
+        pkafig.add_plot(e_group, pka[k] * _avogadro * density / atomic_mass,
+                        linestyle=linestyles[idx % 3], color=colors[idx % 5], label='{}'.format(names[k]))
     pkafig.s_draw(figure_title)
 
 
+# 绘制所有的核素和元素图
+def plot_global_element_figure(global_dicts, e_group, pick_list, density, atomic_mass, figure_title):
+    names = list(global_dicts)
+    pka = np.array([global_dicts[key].recoil_pka_spectrum for key in names])
+    plot_pka_figure(names, pka, e_group, pick_list, density, atomic_mass, figure_title)
+
+
+# Render Element.png and Nuclide.png from a saved result file, the first flux spectrum in batch mode
+def plot_result_file(result_file=_default_result_file, density=0., atomic_mass=0.):
+    with np.load(result_file) as data:
+        e_group = data['energy_group'][:-1]
+        for kind, figure_title in (('element', 'Element.png'), ('nuclide', 'Nuclide.png')):
+            pka = data[kind + '_pka']
+            if pka.ndim == 3:
+                pka = pka[:, 0]
+            plot_pka_figure(data[kind + '_names'], pka, e_group, [], density, atomic_mass, figure_title)
+
+
+# Render the figures of a saved result file in a background process, which outlives the caller
+# Errors of the process are written into '<result file>_plot.log', next to the result file
+def plot_result_file_in_background(result_file=_default_result_file, density=0., atomic_mass=0.,
+                                   file_object=sys.stdout):
+    log_file = os.path.splitext(result_file)[0] + '_plot.log'
+    print(">>> FIGURES RENDERED IN BACKGROUND, ERRORS LOGGED INTO [{}]".format(log_file), file=file_object)
+    with open(os.devnull, 'w') as devnull, open(log_file, 'w') as log:
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__), result_file,
+                                 '--density', repr(density), '--atomic-mass', repr(atomic_mass)],
+                                stdout=devnull, stderr=log, start_new_session=True)
+
+
 # 将字典转化为列表
 def dict_to_list(dic: dict):
     keys = dic.keys()
     vals = dic.values()
     lst = [(key, val) for key, val in zip(keys, vals)]
     return lst
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render PKA figures from a saved result file.')
+    parser.add_argument('result', nargs='?', default=_default_result_file)
+    parser.add_argument('--density', type=float, default=0.)
+    parser.add_argument('--atomic-mass', type=float, default=0.)
+    args = parser.parse_args(argv)
+    plot_result_file(args.result, args.density, args.atomic_mass)
+
+
+if __name__ == '__main__':
+    main()
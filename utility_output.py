@@ -7,26 +7,43 @@ Utility output functions for the code.
 
 """
 
+import csv
+import gzip
+import io
+import json
 import sys
-from xlwt import *
+import numpy as np
+
+from utility_pka import calculate_average_pka_energy
 
 _head = ["Group Num", "Recoil energy (low)", "Recoil energy (high)", "PKAs", "PKAs norm_sum",
          "disp cross section", "NRT_dpa"]
-# 创建配置，样式
-_al = Alignment()
-_al.horz = Alignment.HORZ_CENTER
-_al.vert = Alignment.VERT_CENTER
-_borders = Borders()
-_borders.bottom = Borders.THICK
-_style = XFStyle()
-_style.alignment = _al
-_style.borders = _borders
-_style_num = XFStyle()
-_style_num.num_format_str = '0.0000E+00'
+_xls = {}
+
+
+# xlwt and the styles are only loaded when an xls file is written
+# @return (Workbook, _style, _style_num)
+def _xls_styles():
+    if not _xls:
+        from xlwt import Workbook, Alignment, Borders, XFStyle
+        # 创建配置，样式
+        al = Alignment()
+        al.horz = Alignment.HORZ_CENTER
+        al.vert = Alignment.VERT_CENTER
+        borders = Borders()
+        borders.bottom = Borders.THICK
+        style = XFStyle()
+        style.alignment = al
+        style.borders = borders
+        style_num = XFStyle()
+        style_num.num_format_str = '0.0000E+00'
+        _xls['styles'] = (Workbook, style, style_num)
+    return _xls['styles']
 
 
 # 将最终结果写入Excel文件，每个核素一个excel文件
 def write_each_recoil_pka_into_xls(nuc):
+    Workbook, _style, _style_num = _xls_styles()
     book = Workbook()
     # 对每个反冲核创建一个sheet
     for recoil in nuc.recoil_nuclides:
@@ -55,7 +72,14 @@ def write_each_recoil_pka_into_xls(nuc):
     book.save('PKA_{}.xls'.format(nuc.name))
 
 
+# Equivalent NRT dpa of the summary rows: 0.8 * displacement energy (eV) / (2 * Ed), Ed of the target element
+# of each channel. damage_dpa is in MeV / eV (damage cross section in MeV), so its sum is converted into eV.
+def equivalent_nrt_dpa(item):
+    return np.sum(item.damage_dpa) * 1.E+6
+
+
 def write_total_nuclides_into_xls(global_recoil):
+    Workbook, _style, _style_num = _xls_styles()
     book = Workbook()
     for key in global_recoil:
         print('[{}]'.format(key))
@@ -88,13 +112,13 @@ def write_total_nuclides_into_xls(global_recoil):
         sheet.write(row_values, 3, '{0:10.4E} eV/s'.format(nuclide.average_displacement_energy))
         row_values += 1
         sheet.write(row_values, 1, 'Equivalent NRT dpa')
-        # **** 注意这里的40. *** 需修改
-        sheet.write(row_values, 3, '{0:10.4E} dpa/s'.format(nuclide.average_displacement_energy * 0.8 / (2. * 40.)))
+        sheet.write(row_values, 3, '{0:10.4E} dpa/s'.format(equivalent_nrt_dpa(nuclide)))
     # 保持文件
     book.save('Total_PKAs_nuclides.xls')
 
 
 def write_total_elements_into_xls(global_element):
+    Workbook, _style, _style_num = _xls_styles()
     book = Workbook()
     for key in global_element:
         sheet = book.add_sheet('{}'.format(key))
@@ -126,7 +150,141 @@ def write_total_elements_into_xls(global_element):
         sheet.write(row_values, 3, '{0:10.4E} eV/s'.format(element.average_displacement_energy))
         row_values += 1
         sheet.write(row_values, 1, 'Equivalent NRT dpa')
-        # **** 注意这里的40. *** 需修改
-        sheet.write(row_values, 3, '{0:10.4E} dpa/s'.format(element.average_displacement_energy * 0.8 / (2. * 40.)))
+        sheet.write(row_values, 3, '{0:10.4E} dpa/s'.format(equivalent_nrt_dpa(element)))
     # 保存文件
     book.save('Total_PKAs_elements.xls')
+
+
+# Columnar binary results: every array of all nuclides and elements is one dataset of a compressed npz file
+# Datasets are 'energy_group', 'total_pka' and '<nuclide|element>_<column>', see PKAAccumulator.columns();
+# the axes are (rows, [spectra,] groups), 'flux_names' gives the spectra in batch mode
+def write_results_into_npz(accumulator, flux_names=None, filename='Total_PKAs.npz'):
+    arrays = {'energy_group': accumulator.energy_group}
+    if flux_names is not None:
+        arrays['flux_names'] = np.array(flux_names, dtype=str)
+    total_pka_spectrum = accumulator.total_pka_spectrum()
+    if total_pka_spectrum is not None:
+        arrays['total_pka'] = total_pka_spectrum
+    for kind in ('nuclide', 'element'):
+        for column, values in accumulator.columns(kind).items():
+            arrays['{}_{}'.format(kind, column)] = values
+    np.savez_compressed(filename, **arrays)
+
+
+# Results of a composition sweep (see pka_sweep.CompositionSweep) in the same columnar layout, with a
+# leading candidate axis: (candidates, rows, [spectra,] [groups]). 'parents' and 'ratios'
+# (candidates, parents) give the compositions; the spectra are only written with groups
+def write_sweep_into_npz(sweep, compositions, groups=False, filename='Total_PKAs_sweep.npz'):
+    ratios = sweep.ratio_matrix(compositions)
+    arrays = {'energy_group': sweep.energy_group,
+              'parents': np.array(sweep.parents, dtype=str),
+              'ratios': ratios}
+    if groups:
+        arrays['total_pka'] = sweep.total_pka_spectrum(ratios)
+    for kind in ('nuclide', 'element'):
+        columns = sweep.columns(ratios, kind) if groups else sweep.summary(ratios, kind)
+        for column, values in columns.items():
+            arrays['{}_{}'.format(kind, column)] = values
+    np.savez_compressed(filename, **arrays)
+
+
+class ResultStreamWriter:
+    """
+    Stream results into CSV and/or JSON-lines files (optionally gzip), one buffered write per product.
+    Files are '<prefix>_groups.<csv|jsonl>[.gz]' with the group rows where pka > 0, and
+    '<prefix>_summary.<csv|jsonl>[.gz]' with one summary record per product and flux spectrum.
+    """
+
+    group_fields = ['kind', 'name', 'flux', 'group', 'energy_low', 'energy_high', 'pka', 'pka_norm',
+                    'disp_cross_section', 'nrt_dpa']
+    summary_fields = ['kind', 'name', 'flux', 'total_pka', 'average_pka_energy', 'displacement_energy', 'nrt_dpa']
+
+    def __init__(self, flux_names, formats=('csv',), compress=False, prefix='Total_PKAs'):
+        self.flux_names = list(flux_names)
+        self._outputs = []      # (format, groups file, summary file)
+        for fmt in formats:
+            assert (fmt in ('csv', 'jsonl')), "Unknown stream output format '{}'!".format(fmt)
+            suffix = '.' + fmt + ('.gz' if compress else '')
+            files = [self._open(prefix + name + suffix, compress) for name in ('_groups', '_summary')]
+            if fmt == 'csv':
+                files[0].write(','.join(self.group_fields) + '\n')
+                files[1].write(','.join(self.summary_fields) + '\n')
+            self._outputs.append((fmt, files[0], files[1]))
+
+    @staticmethod
+    def _open(filename, compress):
+        if compress:
+            return gzip.open(filename, 'wt', newline='')
+        return open(filename, 'w', newline='')
+
+    # Write one product, arrays are SIZE ([spectra,] groups), average_pka_energy is SIZE ([spectra])
+    # damage_cross_section and damage_dpa are None if the damage is not calculated
+    def write_product(self, kind, name, energy_group, pka, average_pka_energy,
+                      damage_cross_section=None, damage_dpa=None):
+        pka = np.reshape(pka, (-1, pka.shape[-1]))
+        average_pka_energy = np.reshape(average_pka_energy, -1)
+        if damage_cross_section is not None:
+            damage_cross_section = np.reshape(damage_cross_section, pka.shape)
+            damage_dpa = np.reshape(damage_dpa, pka.shape)
+
+        group_rows = []
+        summary_rows = []
+        for s, flux in enumerate(self.flux_names[:pka.shape[0]]):
+            total = float(pka[s].sum())
+            for i in np.nonzero(pka[s] > 0.)[0]:
+                group_rows.append([kind, name, flux, int(i), float(energy_group[i]), float(energy_group[i + 1]),
+                                   float(pka[s, i]), float(pka[s, i]) / total,
+                                   None if damage_cross_section is None else float(damage_cross_section[s, i]),
+                                   None if damage_dpa is None else float(damage_dpa[s, i])])
+            summary_rows.append([kind, name, flux, total, float(average_pka_energy[s]),
+                                 None if damage_cross_section is None else float(damage_cross_section[s].sum()) * 1.E+6,
+                                 None if damage_dpa is None else float(damage_dpa[s].sum())])
+
+        for fmt, groups_file, summary_file in self._outputs:
+            for f, fields, rows in ((groups_file, self.group_fields, group_rows),
+                                    (summary_file, self.summary_fields, summary_rows)):
+                if fmt == 'csv':
+                    buffer = io.StringIO()
+                    csv.writer(buffer, lineterminator='\n').writerows(
+                        ['' if value is None else value for value in row] for row in rows)
+                    f.write(buffer.getvalue())
+                else:
+                    f.write(''.join(json.dumps(dict(zip(fields, row))) + '\n' for row in rows))
+
+    # Stream the total results of a parent nuclide (not weighted by its ratio), and of each channel if channels
+    def write_parent_nuclide(self, nuc, channels=False):
+        energy_group = nuc.recoil_energy_group_struc
+        damage = [None, None]
+        if nuc.recoil_nuclides and nuc.recoil_nuclides[0].damage_cross_section is not None:
+            damage = [sum(recoil.damage_cross_section for recoil in nuc.recoil_nuclides),
+                      sum(recoil.damage_dpa for recoil in nuc.recoil_nuclides)]
+        self.write_product('parent', nuc.name, energy_group, nuc.recoil_pka_spectrum,
+                           calculate_average_pka_energy(nuc.recoil_pka_spectrum, energy_group, positive_only=True),
+                           *damage)
+        if channels:
+            for recoil in nuc.recoil_nuclides:
+                self.write_product('channel', '{}/{}/{}'.format(nuc.name, recoil.name, recoil.mtd), energy_group,
+                                   recoil.pka_spectrum,
+                                   calculate_average_pka_energy(recoil.pka_spectrum, energy_group, positive_only=True),
+                                   recoil.damage_cross_section, recoil.damage_dpa)
+
+    # Write the global nuclides and elements of the accumulator
+    def write_totals(self, accumulator):
+        for kind in ('nuclide', 'element'):
+            columns = accumulator.columns(kind)
+            for k, name in enumerate(columns['names']):
+                damage = [None, None]
+                if 'disp_cross_section' in columns:
+                    damage = [columns['disp_cross_section'][k], columns['nrt_dpa'][k]]
+                self.write_product(kind, str(name), accumulator.energy_group, columns['pka'][k],
+                                   columns['average_pka_energy'][k], *damage)
+
+    def flush(self):
+        for fmt, groups_file, summary_file in self._outputs:
+            groups_file.flush()
+            summary_file.flush()
+
+    def close(self):
+        for fmt, groups_file, summary_file in self._outputs:
+            groups_file.close()
+            summary_file.close()
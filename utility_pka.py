@@ -6,11 +6,15 @@ Utility functions for the code.
 @time   2018-09-11
 
 """
+import threading
+from collections import OrderedDict
+
 import numpy as np
 import scipy.sparse as sp
-from scipy import interpolate
 
-from models import define_residual, def_coeffs, def_coeffs_njoy, find_damage_displacement_energy
+from models import define_residual, def_coeffs_njoy_array, find_damage_displacement_energy
+from nuclide import NuclideRecoil
+from utility_rebin import grid_fingerprint, rebin_flux
 
 # General constants
 _avogadro = 6.022141930E+23
@@ -18,8 +22,8 @@ _c_light = 299792458.
 _j_to_mev = 1. / 1.602176565E-13
 _neutron_mass = 1.008664923
 _proton_mass = 1.007825032
-_np_mass_dict = {'n': 1.008664923, 'p': 1.007825032}
-_np_za_dict = {'n':(0, 1), 'p': (1, 1)}
+_np_mass_dict = {'n': 1.008664923, 'p': 1.007825032, 'a': 4.002603254}
+_np_za_dict = {'n':(0, 1), 'p': (1, 1), 'a': (2, 4)}
 
 
 # @return (z, a) - means the daughter z and mass number tuple
@@ -42,100 +46,200 @@ def get_daughter_nuclides_particles(title, mtd, Z, A):
     return az_recoil[1], az_recoil[0]     # A tuple (z, a)  Attention the order!
 
 
+# Set up a NuclideRecoil for each channel read from pka file, and load its recoil matrix
+def set_up_recoil_nuclides(nuc):
+    for recoil_nuc in nuc.recoil_nuclides_particles_info:
+        # Deal each reaction channel 处理每个反应道
+        za_recoil = get_daughter_nuclides_particles(recoil_nuc[0], recoil_nuc[1], nuc.Z, nuc.A)
+        nuc_recoil = NuclideRecoil(za_recoil[0], za_recoil[1], recoil_nuc[1])
+        nuc_recoil.title = recoil_nuc[0]
+        nuc_recoil.load_recoil_matrix(recoil_nuc[2])
+        nuc.append_recoil_nuclide(nuc_recoil)
+
+
+# Calculate damage cross section and dpa of each channel, pka spectra must have been computed
+# All channels are done at once, as arrays stacked like nuc.recoil_pka_spectra; the arrays of each channel are views
+def compute_recoil_damage(nuc):
+    coeffs_eds = [get_damage_coeffs_array(nuc.recoil_energy_group_struc, (nuc_recoil.Z, nuc_recoil.A),
+                                          (nuc.Z, nuc.A)) for nuc_recoil in nuc.recoil_nuclides]
+    spectra = nuc.recoil_pka_spectra
+    # Channel axis first, spectra axis (if any) broadcast
+    shape = (len(coeffs_eds),) + (1,) * (spectra.ndim - 1)
+    nuc.recoil_damage_coeffs = np.array([coeffs for coeffs, ed in coeffs_eds]).reshape(
+        (len(coeffs_eds),) + (1,) * (spectra.ndim - 2) + (spectra.shape[-1],))
+    eds = np.array([ed for coeffs, ed in coeffs_eds], dtype=float).reshape(shape)
+    nuc.recoil_damage_cross_sections = nuc.recoil_damage_coeffs * spectra
+    nuc.recoil_damage_dpa = nuc.recoil_damage_cross_sections * 0.8 / (2. * eds)
+    nuc.recoil_damage_coeffs = nuc.recoil_damage_coeffs.reshape(len(coeffs_eds), -1)
+
+    for k, nuc_recoil in enumerate(nuc.recoil_nuclides):
+        nuc_recoil.damage_function_coeffs, nuc_recoil.estimate_ed = coeffs_eds[k]
+        nuc_recoil.damage_cross_section = nuc.recoil_damage_cross_sections[k]
+        nuc_recoil.damage_dpa = nuc.recoil_damage_dpa[k]
+
+
+# Channels duplicated by the particle channels: (n,p) 600-649 except H-1, (n,a) 800-849 except He-4
+def is_duplicated_channel(name, mtd):
+    return ((name != 'He-4') and (800 <= mtd <= 849)) or ((name != 'H-1') and (600 <= mtd <= 649))
+
+
+# Decide which channels of nuc are added into global nuclides and elements, in the same order as the total results.
+# A duplicated channel is skipped if its nuclide (or element) has been added by an earlier channel.
+# seen_nuclides and seen_elements are sets of names added by earlier channels, they are updated here.
+# @return (to_nuclide, to_element) - np.array of bool, one value per channel
+def channel_masks(nuc, seen_nuclides, seen_elements):
+    to_nuclide = np.zeros(len(nuc.recoil_nuclides), dtype=bool)
+    to_element = np.zeros(len(nuc.recoil_nuclides), dtype=bool)
+    for k, recoil_nuc in enumerate(nuc.recoil_nuclides):
+        duplicated = is_duplicated_channel(recoil_nuc.name, recoil_nuc.mtd)
+        if recoil_nuc.name in seen_nuclides and duplicated:
+            continue
+        seen_nuclides.add(recoil_nuc.name)
+        to_nuclide[k] = True
+        if recoil_nuc.element in seen_elements and duplicated:
+            continue
+        seen_elements.add(recoil_nuc.element)
+        to_element[k] = True
+    return to_nuclide, to_element
+
+
+# channel_masks() of all nuclides
+# @return [(to_nuclide, to_element), ...] - one tuple for each nuclide
+def global_channel_masks(nuclides):
+    seen_nuclides = set()
+    seen_elements = set()
+    return [channel_masks(nuc, seen_nuclides, seen_elements) for nuc in nuclides]
+
+
 # @return flux_pka - in pka energy structure
-def interpolate_flux_pka_from_input(flux_in, flux_unit, ebound_in, ebound_pka):
+# method: 'interpolate' or 'conservative', see utility_rebin
+def interpolate_flux_pka_from_input(flux_in, flux_unit, ebound_in, ebound_pka, method='interpolate'):
 
-    # Change the unite into per 'n s^{-1} MeV^{-1}'
-    # Make sure that the interpolation happens in unit of per MeV
-    flux_in_per_mev = None
+    # Change the unite into 'n s^{-1}', the rebinning operator works per group
+    flux_in_per_group = None
     if flux_unit == 'n s^{-1}':
-        flux_in_per_mev = flux_in / (ebound_in[1:] - ebound_in[:-1])
+        flux_in_per_group = flux_in
     elif flux_unit == 'n s^{-1} MeV^{-1}':
-        flux_in_per_mev = flux_in
+        flux_in_per_group = flux_in * (ebound_in[1:] - ebound_in[:-1])
 
-    assert (flux_in_per_mev is not None), " Flux input unit is ERROR !"
+    assert (flux_in_per_group is not None), " Flux input unit is ERROR !"
 
-    ebound_in_mid = (ebound_in[:-1] + ebound_in[1:]) * 0.5
-    # interpolate the functions
-    func_interp = interpolate.interp1d(ebound_in_mid, flux_in_per_mev, kind='linear', fill_value="extrapolate")
-    ebound_pka_mid = (ebound_pka[:-1] + ebound_pka[1:]) * 0.5
-    flux_pka = func_interp(ebound_pka_mid)
+    # One cached sparse operator for all nuclides and spectra with the same group structures
+    # Unit of flux_pka is 'n s^{-1}', easy for matrix collapse
+    return rebin_flux(flux_in_per_group, ebound_in, ebound_pka, method)
 
-    # Change Unit into 'n s^{-1}', easy for matrix collapse
-    flux_pka *= (ebound_pka[1:] - ebound_pka[:-1])
 
-    return flux_pka
+# Average pka energy in eV, the last axis of pka_spectrum is the energy group
+# If positive_only, the average is 0 when the total pka is not positive
+# @return float, or np.array for more than one spectrum. 0 if there is no pka
+def calculate_average_pka_energy(pka_spectrum, energy_group, positive_only=False):
+    total = np.sum(pka_spectrum, axis=-1)
+    weighted = np.sum(pka_spectrum * 0.5 * 1.E+6 * (energy_group[:-1] + energy_group[1:]), axis=-1)
+    where = total > 0. if positive_only else total != 0.
+    average = np.divide(weighted, total, out=np.zeros_like(weighted), where=where)
+    return float(average) if average.ndim == 0 else average
 
 
 # @return ng_recoil_matrix - in pka energy structure
 def estimate_ng_recoil_matrix(recoil_energy_group, ng_xs_array, parent_mass, key_n_p, daughter_mass):
-
     incident_mass = _np_mass_dict[key_n_p]
+    return estimate_capture_recoil_matrix(recoil_energy_group, ng_xs_array, parent_mass, incident_mass,
+                                          daughter_mass)
+
+
+# Recoil matrix of capture reaction, such as (n,g) or (p,g), estimated from its cross section
+# All incident groups are dealt at once, the sparse matrix is built without dense array
+# @return recoil_matrix - coo_matrix (incident group, recoil group) in pka energy structure
+def estimate_capture_recoil_matrix(recoil_energy_group, xs_array, parent_mass, incident_mass, daughter_mass):
 
     # get the extra energy due to mass defection
     #  E = 1/2 * (\Delta m * c^2) / m_{daughter}
     #  1000. is coefficient of g to kg
     extra_energy = _j_to_mev * (parent_mass + incident_mass - daughter_mass)**2 * \
                    _c_light**2 / (2.0 * 1000.0 * _avogadro * daughter_mass)
-    
+
     # 对每个入射能群，计算每个可能的出射能群，然后相加
     # 目前按照 SPECTER-PKA 方法来计算
     num_e_g = recoil_energy_group.shape[0] - 1
-    num_ng_xs = ng_xs_array.shape[0]
-
-    assert num_e_g == num_ng_xs, " ERROR! NG XS array size is not same as recoil energy group!"
-
-    ng_recoil_kermas = np.zeros((num_e_g, num_e_g))
-    for j in range(num_e_g):
-
-        # 动量守恒，使用能量表述
-        upper_e_out = recoil_energy_group[j+1] * incident_mass / daughter_mass
-        lower_e_out = recoil_energy_group[j] * incident_mass / daughter_mass
-
-        # 增加质量亏损引入的能量
-        upper_e_out += extra_energy
-        lower_e_out += extra_energy
-
-        energy_bin_width = recoil_energy_group[1:] - recoil_energy_group[:-1]
-
-        lower_bin = num_e_g
-        upper_bin = 0
-        for k in range(1, num_e_g):
-            if lower_e_out < recoil_energy_group[k]:
-                lower_bin = k - 1
-                break
-
-        for k in range(num_e_g - 1, 0, -1):
-            if upper_e_out > recoil_energy_group[k]:
-                upper_bin = k + 1
-                break
-
-        if lower_bin == num_e_g or upper_bin == 0:
-            continue
+    num_xs = xs_array.shape[0]
+
+    assert num_e_g == num_xs, " ERROR! NG XS array size is not same as recoil energy group!"
+
+    # 动量守恒，使用能量表述；增加质量亏损引入的能量
+    lower_e_out = recoil_energy_group[:-1] * incident_mass / daughter_mass + extra_energy
+    upper_e_out = recoil_energy_group[1:] * incident_mass / daughter_mass + extra_energy
+    energy_bin_width = recoil_energy_group[1:] - recoil_energy_group[:-1]
+
+    # Recoil groups [lower_bin, upper_bin) of each incident group, found by binary search
+    inner_bounds = recoil_energy_group[1:num_e_g]
+    lower_bin = np.searchsorted(inner_bounds, lower_e_out, side='right')
+    lower_bin[lower_bin == num_e_g - 1] = num_e_g
+    upper_bin = np.searchsorted(inner_bounds, upper_e_out, side='left') + 1
+    upper_bin[upper_bin == 1] = 0
+    counts = np.where((lower_bin != num_e_g) & (upper_bin != 0), np.maximum(upper_bin - lower_bin, 0), 0)
+
+    # Triplets (j, k, value) of all the overlaps
+    j = np.repeat(np.arange(num_e_g), counts)
+    k = np.arange(j.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lower_bin, counts)
+    overlap = np.minimum(upper_e_out[j], recoil_energy_group[k + 1]) - np.maximum(lower_e_out[j],
+                                                                                 recoil_energy_group[k])
+    # 截面xs除能量间隔
+    values = xs_array[j] * overlap / energy_bin_width[k]
+    nonzero = values != 0.
+
+    return sp.coo_matrix((values[nonzero], (j[nonzero], k[nonzero])), shape=(num_e_g, num_e_g))
+
+
+class DamageCoeffsCache:
+    """
+    Bounded (LRU) memo of damage function coefficient arrays.
+    Key is (grid fingerprint, residual (Z, A), target (Z, A), Ed). Cached arrays are read only.
+    Thread safe, runs of several threads (e.g. pka_service) share it.
+    """
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._coeffs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, recoil_energy_group, residual_za, target_za, ed):
+        key = (grid_fingerprint(recoil_energy_group), tuple(residual_za), tuple(target_za), ed)
+        with self._lock:
+            coeffs = self._coeffs.get(key)
+            if coeffs is not None:
+                self.hits += 1
+                self._coeffs.move_to_end(key)
+                return coeffs
+            self.misses += 1
+
+        # Computed out of the lock, two threads may compute the same coefficients, the last one is kept
+        emid = (recoil_energy_group[1:] + recoil_energy_group[:-1]) * 0.5 * 1.E+6   # in eV
+        # USE NJOY method
+        coeffs = def_coeffs_njoy_array(emid, residual_za[0], residual_za[1], target_za[0], target_za[1])
+        coeffs.flags.writeable = False
+        with self._lock:
+            self._coeffs[key] = coeffs
+            if len(self._coeffs) > self.max_size:
+                self._coeffs.popitem(last=False)
+        return coeffs
 
-        for k in range(lower_bin, upper_bin):
-            ng_recoil_kermas[k, j] += ng_xs_array[j] * (min(upper_e_out, recoil_energy_group[k+1]) -
-                                                        max(lower_e_out, recoil_energy_group[k]))
+    def clear(self):
+        with self._lock:
+            self._coeffs.clear()
+            self.hits = 0
+            self.misses = 0
 
-        # 截面xs除能量间隔
-        ng_recoil_kermas[:, j] /= energy_bin_width
 
-    M = sp.coo_matrix(ng_recoil_kermas)
-    return M.T
+damage_coeffs_cache = DamageCoeffsCache()
 
 
 # @parameter incident_za (0, 1) for neutron
 #            target_za (Z, A) for target nuclide
-# @return damage_coeffs_array - in pka energy structure
+# @return damage_coeffs_array - in pka energy structure, shared by the same key, DO NOT change it in place
 def get_damage_coeffs_array(recoil_energy_group, residual_za, target_za):
     ed = find_damage_displacement_energy(target_za[0])
     # ed = 40.0 # ====TO be removed!!!
-    coeffs = []
-    emid = (recoil_energy_group[1:] + recoil_energy_group[:-1]) * 0.5 * 1.E+6   # in eV
-    for eg in emid[:]:
-        # OLD NRT method
-        # coeffs.append(def_coeffs(eg, residual_za[0], residual_za[1], target_za[0], target_za[1], ed)[0])
-        # USE NJOY method
-        coeffs.append(float(def_coeffs_njoy(eg, residual_za[0], residual_za[1], target_za[0], target_za[1], ed)))
-    coeffs = np.array(coeffs)
+    coeffs = damage_coeffs_cache.get(recoil_energy_group, residual_za, target_za, ed)
     return coeffs, ed